@@ -0,0 +1,76 @@
+import argparse
+import json
+import time
+
+from frames import loadFrames, makeFeedPushFrames
+
+from google.protobuf import json_format
+
+from kuaishou.ks_pb2 import PayloadType
+from kuaishou.ks_pb2 import SCWebFeedPush
+from kuaishou.ks_pb2 import SocketMessage
+from kuaishou.views import FeedPushView
+
+
+def _payloads(frames):
+    ret = []
+    for frame in frames:
+        msg = SocketMessage()
+        msg.ParseFromString(frame)
+        if msg.payloadType == PayloadType.SC_FEED_PUSH:
+            ret.append(msg.payload)
+    return ret
+
+
+# 以前的做法：MessageToDict + json.dumps
+def legacy(payload):
+    push = SCWebFeedPush()
+    push.ParseFromString(payload)
+    data = json_format.MessageToDict(push, preserving_proto_field_name=True)
+    json.dumps(data, ensure_ascii=False)
+    return data
+
+
+# 惰性视图，只读礼物
+def lazyGifts(payload):
+    push = SCWebFeedPush()
+    push.ParseFromString(payload)
+    view = FeedPushView(push)
+    return [(g.user_id, g.gift_id, g.comboCount) for g in view.gifts]
+
+
+# 惰性视图，但回调仍然需要 dict
+def lazyDict(payload):
+    push = SCWebFeedPush()
+    push.ParseFromString(payload)
+    return FeedPushView(push).to_dict()
+
+
+def bench(name, fn, payloads, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for payload in payloads:
+            fn(payload)
+    elapsed = time.perf_counter() - start
+    n = iterations * len(payloads)
+    print(f'{name:<12} {n / elapsed:>12.0f} frames/s  {elapsed / n * 1e6:>8.1f} us/frame')
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SCWebFeedPush 解码对比')
+    parser.add_argument('--frames', help='录制的帧文件（FrameRecorder 录制文件，或每行一个十六进制 SocketMessage）')
+    parser.add_argument('--iterations', type=int, default=5)
+    args = parser.parse_args()
+
+    frames = loadFrames(args.frames) if args.frames else makeFeedPushFrames()
+    payloads = _payloads(frames)
+    print(f'{len(payloads)} 个 SCWebFeedPush 帧, {sum(map(len, payloads))} 字节')
+    base = bench('legacy', legacy, payloads, args.iterations)
+    for name, fn in (('lazy-gifts', lazyGifts), ('lazy-dict', lazyDict)):
+        elapsed = bench(name, fn, payloads, args.iterations)
+        print(f'{"":<12} 加速 {base / elapsed:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
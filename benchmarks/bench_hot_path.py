@@ -0,0 +1,180 @@
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+
+from frames import loadFrames, makeEnterRoomAck, makeMixedFrames
+
+from kuaishou.KsLive import Tool
+from kuaishou.ks_pb2 import PayloadType
+from kuaishou.ks_pb2 import SocketMessage
+
+
+class StubWebSocket:
+    """离线替身：只记录发出的数据，不建立连接"""
+
+    keep_running = True
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, data, opcode=None):
+        self.sent.append(data)
+
+    def close(self):
+        self.keep_running = False
+
+
+def makeTool(callback=None, lazy=False) -> Tool:
+    tool = Tool('https://live.kuaishou.com/u/bench', '', '', '/tmp', cookie='bench')
+    tool.liveRoomId = 'bench'
+    tool.feed_push_lazy = lazy
+    tool.feed_push_callback = callback
+    return tool
+
+
+def _noop(data):
+    pass
+
+
+# 按 PayloadType 取出已解压的包体，给 parse*Pack 用
+def _payloads(frames, payloadType):
+    tool = makeTool()
+    ret = []
+    for frame in frames:
+        msg = SocketMessage()
+        msg.ParseFromString(frame)
+        if msg.payloadType == payloadType:
+            payload = tool.decompressor.decompress(msg)
+            if payload is not None:
+                ret.append(payload)
+    return ret
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return 0
+    return sorted_values[min(int(len(sorted_values) * q), len(sorted_values) - 1)]
+
+
+def measure(fn, items, iterations):
+    for item in items[:20]:
+        fn(item)
+    perf = time.perf_counter_ns
+    latencies = []
+    append = latencies.append
+    start = perf()
+    for _ in range(iterations):
+        for item in items:
+            t0 = perf()
+            fn(item)
+            append(perf() - t0)
+    elapsed = (perf() - start) / 1e9
+    latencies.sort()
+
+    # 内存单独跑一遍：tracemalloc 本身会拖慢执行，不能和计时混在一起
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    peaks = []
+    for item in items:
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        fn(item)
+        peaks.append(tracemalloc.get_traced_memory()[1] - current)
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    n = len(latencies)
+    return {
+        'frames': n,
+        'fps': n / elapsed if elapsed else 0.0,
+        'p50_us': _percentile(latencies, 0.50) / 1000,
+        'p90_us': _percentile(latencies, 0.90) / 1000,
+        'p99_us': _percentile(latencies, 0.99) / 1000,
+        'peak_kib': sum(peaks) / len(peaks) / 1024 if peaks else 0.0,
+        'retained_kib': retained / 1024,
+    }
+
+
+def scenarios(frames, gzip_frames):
+    ws = StubWebSocket()
+    ret = []
+
+    def onMessage(name, tool, items):
+        ret.append((name, lambda frame: tool.onMessage(ws, frame), items))
+
+    onMessage('onMessage/idle', makeTool(), frames)
+    onMessage('onMessage/dict', makeTool(_noop), frames)
+    onMessage('onMessage/lazy', makeTool(_noop, lazy=True), frames)
+    if gzip_frames:
+        onMessage('onMessage/gzip', makeTool(_noop, lazy=True), gzip_frames)
+
+    tool = makeTool(_noop)
+    for name, payloadType in (('parseFeedPushPack', PayloadType.SC_FEED_PUSH),
+                              ('parseSCWebLiveWatchingUsers', PayloadType.SC_LIVE_WATCHING_LIST),
+                              ('parseHeartBeatPack', PayloadType.SC_HEARTBEAT_ACK)):
+        items = _payloads(frames, payloadType)
+        if items:
+            ret.append((name, getattr(tool, name), items))
+    ret.append(('parseEnterRoomAckPack', tool.parseEnterRoomAckPack, [makeEnterRoomAck()] * 100))
+    return ret
+
+
+# 和基线比较：吞吐下降或 p99 上升超过 tolerance 视为回归
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, cur in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if cur['fps'] < base['fps'] * (1 - tolerance):
+            regressions.append(f'{name}: fps {base["fps"]:.0f} -> {cur["fps"]:.0f}')
+        if cur['p99_us'] > base['p99_us'] * (1 + tolerance):
+            regressions.append(f'{name}: p99 {base["p99_us"]:.1f}us -> {cur["p99_us"]:.1f}us')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='onMessage / parse*Pack 热路径离线基准')
+    parser.add_argument('--frames', help='录制的帧文件（FrameRecorder 录制文件，或每行一个十六进制 SocketMessage）')
+    parser.add_argument('--count', type=int, default=200, help='合成帧数量')
+    parser.add_argument('--comments', type=int, default=20, help='每个合成 SCWebFeedPush 的弹幕数（调大模拟大批量推送）')
+    parser.add_argument('--iterations', type=int, default=5)
+    parser.add_argument('--only', help='只跑名字包含该字符串的场景')
+    parser.add_argument('--save', help='结果写入 json 文件，作为以后的基线')
+    parser.add_argument('--baseline', help='和基线 json 比较，出现回归时退出码为 1')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    if args.frames:
+        frames = loadFrames(args.frames)
+        gzip_frames = None
+    else:
+        frames = makeMixedFrames(args.count, comments=args.comments)
+        gzip_frames = makeMixedFrames(args.count, gzip_feeds=True, comments=args.comments)
+    print(f'{len(frames)} 帧, {sum(map(len, frames))} 字节')
+    print(f'{"场景":<28} {"frames/s":>10} {"p50us":>8} {"p90us":>8} {"p99us":>8} {"峰值KiB":>9} {"残留KiB":>9}')
+
+    results = {}
+    for name, fn, items in scenarios(frames, gzip_frames):
+        if args.only and args.only not in name:
+            continue
+        r = results[name] = measure(fn, items, args.iterations)
+        print(f'{name:<28} {r["fps"]:>10.0f} {r["p50_us"]:>8.1f} {r["p90_us"]:>8.1f} {r["p99_us"]:>8.1f} '
+              f'{r["peak_kib"]:>9.1f} {r["retained_kib"]:>9.1f}')
+
+    if args.save:
+        with open(args.save, 'w') as fh:
+            json.dump(results, fh, indent=2)
+    if args.baseline:
+        with open(args.baseline, 'r') as fh:
+            regressions = compare(results, json.load(fh), args.tolerance)
+        for line in regressions:
+            print('回归:', line)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
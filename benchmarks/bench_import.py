@@ -0,0 +1,105 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 不应该出现在轻量导入路径上的重量级依赖
+HEAVY = ('selenium', 'protobuf_inspector', 'websocket', 'requests', 'aiohttp', 'http.server')
+
+# 场景名 -> 子进程里执行的代码
+SCENARIOS = {
+    'ks_pb2': 'import kuaishou.ks_pb2',
+    'dispatch': 'import kuaishou.dispatch',
+    'codec': 'import kuaishou.codec',
+    'KsLive': 'import kuaishou.KsLive',
+    'Tool(cookie)': ("from kuaishou.KsLive import Tool\n"
+                     "Tool('https://live.kuaishou.com/u/bench', '', '', '/tmp', cookie='bench')"),
+    'rooms': 'import kuaishou.rooms',
+}
+
+# 在全新的解释器里计时：只统计场景代码本身，不含解释器启动
+_CHILD = '''
+import json, resource, sys, time
+before = set(sys.modules)
+start = time.perf_counter()
+exec(compile(sys.argv[1], '<scenario>', 'exec'))
+elapsed = time.perf_counter() - start
+loaded = set(sys.modules) - before
+print(json.dumps({'ms': elapsed * 1000, 'rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                  'modules': len(loaded), 'heavy': sorted(m for m in json.loads(sys.argv[2]) if m in loaded)}))
+'''
+
+
+def measure(code: str, repeat: int) -> dict:
+    env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    runs = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, '-c', _CHILD, code, json.dumps(HEAVY)], cwd=ROOT, env=env,
+                             capture_output=True, text=True)
+        if out.returncode != 0:
+            raise RuntimeError(out.stderr.strip().splitlines()[-1] if out.stderr else f'exit {out.returncode}')
+        runs.append(json.loads(out.stdout))
+    return {
+        'ms': statistics.median(r['ms'] for r in runs),
+        'rss_kib': statistics.median(r['rss_kib'] for r in runs),
+        'modules': runs[-1]['modules'],
+        'heavy': runs[-1]['heavy'],
+    }
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, cur in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if cur['ms'] > base['ms'] * (1 + tolerance):
+            regressions.append(f'{name}: {base["ms"]:.1f}ms -> {cur["ms"]:.1f}ms')
+        if cur['rss_kib'] > base['rss_kib'] * (1 + tolerance):
+            regressions.append(f'{name}: rss {base["rss_kib"]}KiB -> {cur["rss_kib"]}KiB')
+        added = set(cur['heavy']) - set(base['heavy'])
+        if added:
+            regressions.append(f'{name}: 新加载了 {sorted(added)}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='导入耗时 / 内存基准：每次在新的子进程里导入')
+    parser.add_argument('--repeat', type=int, default=5, help='每个场景启动几个子进程，取中位数')
+    parser.add_argument('--only', help='只跑名字包含该字符串的场景')
+    parser.add_argument('--save', help='结果写入 json 文件，作为以后的基线')
+    parser.add_argument('--baseline', help='和基线 json 比较，出现回归时退出码为 1')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    print(f'{"场景":<14} {"耗时ms":>8} {"RSS MiB":>8} {"模块数":>6}  重量级依赖')
+    results = {}
+    for name, code in SCENARIOS.items():
+        if args.only and args.only not in name:
+            continue
+        try:
+            r = results[name] = measure(code, args.repeat)
+        except RuntimeError as e:
+            print(f'{name:<14} 失败: {e}')
+            continue
+        print(f'{name:<14} {r["ms"]:>8.1f} {r["rss_kib"] / 1024:>8.1f} {r["modules"]:>6}  '
+              f'{", ".join(r["heavy"]) or "-"}')
+
+    if args.save:
+        with open(args.save, 'w') as fh:
+            json.dump(results, fh, indent=2)
+    if args.baseline:
+        with open(args.baseline, 'r') as fh:
+            regressions = compare(results, json.load(fh), args.tolerance)
+        for line in regressions:
+            print('回归:', line)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+import argparse
+import json
+import re
+import time
+
+import frames  # noqa: F401  把仓库根目录加入 sys.path
+
+from kuaishou.page import StateExtractor
+
+_LEGACY_RE = re.compile(
+    r'__INITIAL_STATE__=(.*?);\(function\(\)\{var s;\(s=document\.currentScript\|\|document\.scripts\[document\.scripts\.length-1]\)\.parentNode\.r')
+
+
+# 构造一个和线上结构相近的直播页：state 里有大量无关数据，页面尾部还有大段脚本
+def makeLivePage(liveStreamId='abcDEF123', padding=400) -> bytes:
+    state = {
+        'global': {'config': {f'k{i}': 'x' * 40 for i in range(padding)}},
+        'liveroom': {
+            'playList': [{'liveStream': {'id': f'other{i}', 'caption': '直播' * 20}} for i in range(20)],
+            'liveStream': {'id': liveStreamId, 'caption': '直播间标题', 'playUrls': [{'url': 'https://x' * 10}]},
+            'author': {'id': '3xabc', 'name': '主播'},
+        },
+        'recommend': [{'photoId': f'p{i}', 'caption': '推荐' * 30} for i in range(padding)],
+    }
+    head = '<html><head>' + '<meta name="x" content="y">' * 200 + '</head><body><script>window.__INITIAL_STATE__='
+    tail = (';(function(){var s;(s=document.currentScript||document.scripts[document.scripts.length-1])'
+            '.parentNode.removeChild(s);}());</script>' + '<script>var a=1;</script>' * 5000 + '</body></html>')
+    return (head + json.dumps(state, ensure_ascii=False) + tail).encode('utf-8')
+
+
+def legacy(page: bytes):
+    text = json.loads(_LEGACY_RE.search(page.decode('utf-8')).group(1))
+    return text['liveroom']['liveStream']['id']
+
+
+def streaming(page: bytes, chunk_size=16384):
+    extractor = StateExtractor()
+    view = memoryview(page)
+    for i in range(0, len(page), chunk_size):
+        if extractor.feed(bytes(view[i:i + chunk_size])):
+            break
+    return extractor.liveStream()['id'], extractor.bytes_read
+
+
+def main():
+    parser = argparse.ArgumentParser(description='直播页房间号提取对比')
+    parser.add_argument('pages', nargs='*', help='保存下来的直播页 html 文件')
+    parser.add_argument('--iterations', type=int, default=50)
+    args = parser.parse_args()
+
+    pages = [open(p, 'rb').read() for p in args.pages] or [makeLivePage()]
+    for page in pages:
+        assert legacy(page) == streaming(page)[0]
+        print(f'页面 {len(page)} 字节, 流式读取到 {streaming(page)[1]} 字节后停止')
+        for name, fn in (('legacy', legacy), ('streaming', streaming)):
+            start = time.perf_counter()
+            for _ in range(args.iterations):
+                fn(page)
+            elapsed = (time.perf_counter() - start) / args.iterations
+            print(f'  {name:<10} {elapsed * 1e3:8.3f} ms/页')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+import argparse
+import json
+import os
+import sqlite3
+import tempfile
+import time
+
+from frames import makeFeedPush
+
+from kuaishou.ks_pb2 import SCWebFeedPush
+from kuaishou.sinks import COLUMNS, JsonlSink, SqliteSink, flattenFeedPush
+
+
+def _pushes(count):
+    ret = []
+    for i in range(count):
+        push = SCWebFeedPush()
+        push.ParseFromString(makeFeedPush(seed=i))
+        ret.append(push)
+    return ret
+
+
+# 以前的做法：每条事件单独 INSERT + commit
+def perEventSqlite(pushes, path):
+    db = sqlite3.connect(path)
+    db.execute(f'CREATE TABLE feed_events ({", ".join(COLUMNS)})')
+    insert = f'INSERT INTO feed_events VALUES ({", ".join("?" * len(COLUMNS))})'
+    for push in pushes:
+        for row in flattenFeedPush(push, 'bench'):
+            db.execute(insert, row)
+            db.commit()
+    db.close()
+
+
+# 以前的做法：每条事件打开文件追加一行
+def perEventJsonl(pushes, path):
+    for push in pushes:
+        for row in flattenFeedPush(push, 'bench'):
+            with open(path, 'a', encoding='utf-8') as fh:
+                fh.write(json.dumps(dict(zip(COLUMNS, row)), ensure_ascii=False) + '\n')
+
+
+def batched(sink, pushes):
+    with sink:
+        for push in pushes:
+            sink.writeFeedPush(push, 'bench')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='逐条写出 vs 微批写出')
+    parser.add_argument('--pushes', type=int, default=200)
+    args = parser.parse_args()
+
+    pushes = _pushes(args.pushes)
+    events = sum(len(flattenFeedPush(p, 'bench')) for p in pushes)
+    print(f'{args.pushes} 个 SCWebFeedPush, {events} 条事件')
+    with tempfile.TemporaryDirectory() as tmp:
+        cases = (
+            ('sqlite 逐条', lambda: perEventSqlite(pushes, os.path.join(tmp, 'a.db'))),
+            ('sqlite 微批', lambda: batched(SqliteSink(os.path.join(tmp, 'b.db')), pushes)),
+            ('jsonl 逐条', lambda: perEventJsonl(pushes, os.path.join(tmp, 'a.jsonl'))),
+            ('jsonl 微批', lambda: batched(JsonlSink(os.path.join(tmp, 'jsonl')), pushes)),
+        )
+        for name, fn in cases:
+            start = time.perf_counter()
+            fn()
+            elapsed = time.perf_counter() - start
+            print(f'{name:<12} {events / elapsed:>12.0f} events/s')
+
+
+if __name__ == '__main__':
+    main()
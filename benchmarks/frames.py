@@ -0,0 +1,139 @@
+import binascii
+import gzip
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from kuaishou.ks_pb2 import CompressionType  # noqa: E402
+from kuaishou.ks_pb2 import PayloadType  # noqa: E402
+from kuaishou.ks_pb2 import SCHeartbeatAck  # noqa: E402
+from kuaishou.ks_pb2 import SCWebEnterRoomAck  # noqa: E402
+from kuaishou.ks_pb2 import SCWebFeedPush  # noqa: E402
+from kuaishou.ks_pb2 import SCWebLiveWatchingUsers  # noqa: E402
+from kuaishou.ks_pb2 import SocketMessage  # noqa: E402
+from kuaishou.recorder import MAGIC, FrameReader  # noqa: E402
+
+_NAMES = ['快手用户', '小可爱', '路人甲', 'Like.', '北晨的信智', '子璩ᵇᵃᵇʸ']
+_HEAD = 'https://p1.a.yximgs.com/uhead/AB/2022/11/12/21/BMjAyMjExMTIyMTA0MjhfMjgxMDE5Nzg4MV8yX2hkMjc5XzI2MQ==_s.jpg'
+
+
+def _fillUser(user, i):
+    user.principalId = f'3x{i:013d}'
+    user.userName = _NAMES[i % len(_NAMES)]
+    user.headUrl = _HEAD
+
+
+# 构造一个 SCWebFeedPush 包体
+def makeFeedPush(comments=20, gifts=5, likes=30, shares=2, combos=3, seed=0) -> bytes:
+    rnd = random.Random(seed)
+    push = SCWebFeedPush()
+    push.displayWatchingCount = '1.2万'
+    push.displayLikeCount = '35.6万'
+    for i in range(comments):
+        feed = push.commentFeeds.add()
+        feed.id = f'c{seed}-{i}'
+        _fillUser(feed.user, rnd.randrange(10000))
+        feed.content = '主播好厉害' * rnd.randint(1, 4)
+        feed.sortRank = i
+    for i in range(gifts):
+        feed = push.giftFeeds.add()
+        feed.id = f'g{seed}-{i}'
+        _fillUser(feed.user, rnd.randrange(10000))
+        feed.giftId = rnd.choice([1, 2, 9, 197, 10075])
+        feed.batchSize = 1
+        feed.comboCount = rnd.randint(1, 10)
+        feed.time = 1669000000000 + i
+        feed.mergeKey = f'mk{seed}-{i}'
+    for i in range(likes):
+        feed = push.likeFeeds.add()
+        feed.id = f'l{seed}-{i}'
+        _fillUser(feed.user, rnd.randrange(10000))
+    for i in range(shares):
+        feed = push.shareFeeds.add()
+        feed.id = f's{seed}-{i}'
+        _fillUser(feed.user, rnd.randrange(10000))
+        feed.time = 1669000000000 + i
+    for i in range(combos):
+        feed = push.comboCommentFeed.add()
+        feed.id = f'cc{seed}-{i}'
+        feed.content = '666'
+        feed.comboCount = rnd.randint(2, 50)
+    return push.SerializeToString()
+
+
+# 构造一个 SCWebLiveWatchingUsers 包体（类似 hexStrToProtobuf 里的示例）
+def makeWatchingUsers(users=30, seed=0) -> bytes:
+    rnd = random.Random(seed)
+    msg = SCWebLiveWatchingUsers()
+    for i in range(users):
+        info = msg.watchingUser.add()
+        _fillUser(info.user, rnd.randrange(10000))
+        info.tuhao = i < 3
+        info.displayKsCoin = str(rnd.randint(1, 2000))
+    msg.displayWatchingCount = '1.2万'
+    msg.pendingDuration = 60000
+    return msg.SerializeToString()
+
+
+def makeHeartbeatAck(timestamp=1669000000000) -> bytes:
+    ack = SCHeartbeatAck()
+    ack.timestamp = timestamp
+    ack.clientTimestamp = timestamp - 35
+    return ack.SerializeToString()
+
+
+def makeEnterRoomAck() -> bytes:
+    ack = SCWebEnterRoomAck()
+    ack.minReconnectMs = 1000
+    ack.maxReconnectMs = 10000
+    ack.heartbeatIntervalMs = 20000
+    return ack.SerializeToString()
+
+
+# 把包体包进 SocketMessage
+def makeSocketMessage(payloadType: int, payload: bytes, compressionType: int = 0) -> bytes:
+    msg = SocketMessage()
+    msg.payloadType = payloadType
+    msg.compressionType = compressionType
+    msg.payload = payload
+    return msg.SerializeToString()
+
+
+def makeFeedPushFrames(count=200, **kwargs):
+    return [makeSocketMessage(PayloadType.SC_FEED_PUSH, makeFeedPush(seed=i, **kwargs)) for i in range(count)]
+
+
+# 模拟线上的帧序列：以弹幕为主，夹杂在线用户列表和心跳应答；gzip 为 True 时弹幕包体按 GZIP 压缩
+def makeMixedFrames(count=200, gzip_feeds=False, **kwargs):
+    frames = []
+    for i in range(count):
+        if i % 10 == 9:
+            frames.append(makeSocketMessage(PayloadType.SC_LIVE_WATCHING_LIST, makeWatchingUsers(seed=i)))
+        elif i % 20 == 4:
+            frames.append(makeSocketMessage(PayloadType.SC_HEARTBEAT_ACK, makeHeartbeatAck(1669000000000 + i)))
+        else:
+            payload = makeFeedPush(seed=i, **kwargs)
+            if gzip_feeds:
+                frames.append(makeSocketMessage(PayloadType.SC_FEED_PUSH, gzip.compress(payload),
+                                                CompressionType.GZIP))
+            else:
+                frames.append(makeSocketMessage(PayloadType.SC_FEED_PUSH, payload))
+    return frames
+
+
+# 读取录制的帧：每行一个十六进制的 SocketMessage
+def loadHexFrames(path):
+    with open(path, 'r') as fh:
+        return [binascii.unhexlify(line.strip().replace(' ', '')) for line in fh if line.strip()]
+
+
+# 读取录制的帧：FrameRecorder 录制的二进制文件，或者每行一个十六进制 SocketMessage 的文本文件
+def loadFrames(path):
+    with open(path, 'rb') as fh:
+        magic = fh.read(len(MAGIC))
+    if magic == MAGIC:
+        with FrameReader(path) as reader:
+            return [frame for _, frame in reader]
+    return loadHexFrames(path)
@@ -0,0 +1,95 @@
+import argparse
+import asyncio
+import multiprocessing
+import resource
+import time
+
+import frames  # noqa: F401  把仓库根目录加入 sys.path
+
+from kuaishou.httpclient import AsyncHttpClient
+from kuaishou.KsLive import Tool
+from kuaishou.mockserver import MockLiveServer
+from kuaishou.rooms import RoomManager
+
+
+# 模拟服务跑在单独的进程里，避免和客户端抢同一个事件循环
+def _serve(port_queue, kwargs):
+    async def run():
+        server = await MockLiveServer(**kwargs).start()
+        port_queue.put(server.port)
+        while True:
+            await asyncio.sleep(3600)
+
+    asyncio.run(run())
+
+
+# 提高文件描述符上限，几千个连接需要
+def _raiseNoFile(need):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < need:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(need, hard), hard))
+
+
+async def soak(args, port):
+    base = f'http://127.0.0.1:{port}'
+    counters = {'frames': 0, 'feeds': 0}
+
+    def onFeedPush(view):
+        counters['frames'] += 1
+        push = view.message
+        counters['feeds'] += len(push.commentFeeds) + len(push.giftFeeds) + len(push.likeFeeds)
+
+    manager = RoomManager(http=AsyncHttpClient(pool_size=args.rooms * 2, timeout=60))
+    tools = []
+    for i in range(args.rooms):
+        tool = Tool(f'{base}/u/soak{i}', '', '', '/tmp', cookie='soak', api_base=base)
+        tool.backoff.base = args.backoff
+        tools.append(tool)
+        await manager.addRoom(tool, onFeedPush, lazy=True)
+
+    start = last = time.perf_counter()
+    last_frames = last_feeds = 0
+    while time.perf_counter() - start < args.duration:
+        await asyncio.sleep(args.report)
+        now = time.perf_counter()
+        connected = sum(1 for room in manager.rooms.values() if room.ws is not None and not room.ws.closed)
+        reconnects = sum(t.reconnectCount for t in tools)
+        print(f'[{now - start:6.1f}s] 在线 {connected}/{args.rooms}  '
+              f'{(counters["frames"] - last_frames) / (now - last):8.0f} frames/s  '
+              f'{(counters["feeds"] - last_feeds) / (now - last):8.0f} feeds/s  重连 {reconnects}')
+        last, last_frames, last_feeds = now, counters['frames'], counters['feeds']
+
+    elapsed = time.perf_counter() - start
+    reconnects = [t.reconnectCount for t in tools]
+    print(f'共 {counters["frames"]} 帧 / {counters["feeds"]} 条, 平均 {counters["frames"] / elapsed:.0f} frames/s, '
+          f'重连 {sum(reconnects)} 次（单房间最多 {max(reconnects)} 次）')
+    await manager.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='用 MockLiveServer 压测 RoomManager：吞吐和断线重连')
+    parser.add_argument('--rooms', type=int, default=1000)
+    parser.add_argument('--duration', type=float, default=60)
+    parser.add_argument('--report', type=float, default=5, help='统计输出间隔（秒）')
+    parser.add_argument('--comment-rate', type=float, default=5.0, help='每个房间每秒弹幕数')
+    parser.add_argument('--gift-rate', type=float, default=0.5)
+    parser.add_argument('--like-rate', type=float, default=10.0)
+    parser.add_argument('--drop-after', type=float, default=None, help='服务端平均多少秒断开一次连接')
+    parser.add_argument('--backoff', type=float, default=0.2, help='客户端首次重连等待（秒）')
+    parser.add_argument('--gzip', action='store_true')
+    args = parser.parse_args()
+
+    _raiseNoFile(args.rooms * 4 + 256)
+    port_queue = multiprocessing.Queue()
+    kwargs = dict(comment_rate=args.comment_rate, gift_rate=args.gift_rate, like_rate=args.like_rate,
+                  drop_after=args.drop_after, gzip_feeds=args.gzip, min_reconnect_ms=0)
+    server = multiprocessing.Process(target=_serve, args=(port_queue, kwargs), daemon=True)
+    server.start()
+    try:
+        asyncio.run(soak(args, port_queue.get(timeout=30)))
+    finally:
+        server.terminate()
+
+
+if __name__ == '__main__':
+    main()
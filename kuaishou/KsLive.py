@@ -1,30 +1,45 @@
-import _thread
 import binascii
-import copy
+import io
 import json
 import logging
 import os
 import random
-import re
+import threading
 import time
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
 
-import websocket
-import requests
-
-from protobuf_inspector.types import StandardParser
 from google.protobuf import json_format
-from selenium.webdriver.chrome.options import Options
-from selenium import webdriver
 
 from .ks_pb2 import CSWebEnterRoom
 from .ks_pb2 import CSWebHeartbeat
 from .ks_pb2 import SocketMessage
-from .ks_pb2 import SCHeartbeatAck
 from .ks_pb2 import PayloadType
-from .ks_pb2 import SCWebFeedPush
-from .ks_pb2 import SCWebLiveWatchingUsers
-from .ks_pb2 import SCWebEnterRoomAck
+from .codec import PayloadDecompressor
+from .credentials import CookieProvider
+from .credentials import getBrowserCookieProvider
+from .credentials import harvestCookie
+from .dispatch import Dispatcher
+from .gifts import GiftCatalogue
+from .gifts import getGiftCatalogue
+from .httpclient import AsyncHttpClient
+from .httpclient import HttpClient
+from .httpclient import RETRY_STATUS
+from .httpclient import getHttpClient
+from .page import StateExtractor
+from .page import liveRoomIdCache
+from .dispatch import FeedPushCallback
+from .heartbeat import Heartbeat
+from .heartbeat import HeartbeatScheduler
+from .heartbeat import getHeartbeatScheduler
+from .metrics import MetricsRegistry
+from .metrics import RoomMetrics
+from .metrics import span
+from .metrics import startSpan
+from .reconnect import Backoff
+
+# websocket-client / selenium / protobuf_inspector 只在用到时导入：只解析帧、用现成 cookie 的进程启动更快、占用内存更少
+if TYPE_CHECKING:
+    import websocket
 
 
 class NoLivingException(Exception):
@@ -35,17 +50,27 @@ class CookieNotUseful(Exception):
     pass
 
 
+# userCardInfo 查询的字段
+userCardFields = '    id\n    originUserId\n    avatar\n    name\n    description\n    sex\n    constellation\n    cityName\n    followStatus\n    privacy\n    feeds {\n      eid\n      photoId\n      thumbnailUrl\n      timestamp\n      __typename\n    }\n    counts {\n      fan\n      follow\n      photo\n      __typename\n    }\n    __typename\n'
+
+# 二进制帧，等于 websocket.ABNF.OPCODE_BINARY
+OPCODE_BINARY = 0x2
+
 user_agent = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/107.0.0.0 Safari/537.36'
 
 
 class Tool:
     apiHost = 'https://live.kuaishou.com/live_graphql'
+    webSocketInfoUrl = 'https://live.kuaishou.com/live_api/liveroom/websocketinfo'
+    allGiftsUrl = 'https://live.kuaishou.com/live_api/emoji/allgifts'
     # 进入房间时需要的token
     token = ''
     # 网页token
     cookie = ''
     # websocket地址
     webSocketUrl = ''
+    # 心跳间隔（秒），进房应答里的 heartbeatIntervalMs 会覆盖
+    heartbeatInterval = 20
     # 房间号
     liveRoomId = None
     # 直播网页地址
@@ -57,16 +82,63 @@ class Tool:
     }
     # 存储用户直播信息 比如直播地址
     userLiveInfo = ''
+    # DEBUG 日志前缀
+    logLabels = {
+        PayloadType.SC_HEARTBEAT_ACK: '[parseHeartBeatPack] [心跳❤️响应]',
+        PayloadType.SC_FEED_PUSH: '[parseFeedPushPack] [直播间弹幕🐎消息]',
+        PayloadType.SC_LIVE_WATCHING_LIST: '[parseSCWebLiveWatchingUsers] [在线观众列表👀]',
+    }
 
     # 初始化
     def __init__(self, liveUrl: str, chrome_bin_path: str, chrome_driver_path: str, runtime_dir: str,
-                 proxy_host: Optional[str] = None, proxy_port: Optional[str] = None, cookie: Optional[str] = None):
-        self.feed_push_callback = None
+                 proxy_host: Optional[str] = None, proxy_port: Optional[str] = None, cookie: Optional[str] = None,
+                 cookie_provider: Optional[CookieProvider] = None, http_client: Optional[HttpClient] = None,
+                 api_base: Optional[str] = None):
+        # PayloadType -> 解码器 + 订阅者
+        self.dispatcher = Dispatcher()
+        self.dispatcher.subscribe(PayloadType.SC_ENTER_ROOM_ACK, self.onEnterRoomAck, inline=True)
+        self.dispatcher.subscribe(PayloadType.SC_HEARTBEAT_ACK, self.onHeartbeatAck, inline=True)
+        self._feed_push_callback: Optional[FeedPushCallback] = None
+        # True 时回调拿到 FeedPushView（惰性解析），False 时和以前一样拿到 dict
+        self._feed_push_lazy = False
+        # 负载解压及按 PayloadType 的字节统计
+        self.decompressor = PayloadDecompressor()
+        # 断线重连：getWebSocketInfo 返回的全部地址轮换使用
+        self.webSocketUrls = []
+        self._urlIndex = -1
+        self.reconnectCount = 0
+        self.lastErrorCode = 0
+        self.backoff = Backoff()
+        self.ws: Optional['websocket.WebSocketApp'] = None
+        # wssServerStop 设置；wssServerStart 退出时才清除，启动前发出的停止请求不会丢
+        self._stopped = threading.Event()
+        # 保护 self.ws 的替换和停止检查，避免停止请求落在建立连接之前
+        self._wsLock = threading.Lock()
+        # FrameRecorder：设置后收到的原始帧都会写入录制文件，可离线回放
+        self.recorder = None
+        # 当前连接的心跳状态（RTT、丢失次数），由进程内共享的调度器统一发送
+        self.heartbeat: Optional[Heartbeat] = None
+        self.heartbeat_scheduler: HeartbeatScheduler = getHeartbeatScheduler()
+        # RoomMetrics：调用 enableMetrics 后记录帧数、字节数、解码/回调耗时、重连、心跳 RTT
+        self.metrics: Optional[RoomMetrics] = None
+        self._enterSpan = None
+        # 进程内共享的礼物目录，GiftView.gift_name / unit_price 从这里查
+        self.gift_catalogue: GiftCatalogue = getGiftCatalogue()
 
         self.liveUrl = liveUrl
+        # 接口地址前缀，默认 https://live.kuaishou.com；指向 MockLiveServer 时可离线测试
+        if api_base is not None:
+            api_base = api_base.rstrip('/')
+            self.apiHost = api_base + '/live_graphql'
+            self.webSocketInfoUrl = api_base + '/live_api/liveroom/websocketinfo'
+            self.allGiftsUrl = api_base + '/live_api/emoji/allgifts'
+        # 进程内共享的 keep-alive 连接池，第一次发同步请求时才创建（只用 asyncio 的进程不加载 requests）
+        self._http: Optional[HttpClient] = http_client
         self.chrome_bin_path = chrome_bin_path
         self.chrome_driver_path = chrome_driver_path
         self.runtime_dir = runtime_dir
+        if self.gift_catalogue.cache_path is None:
+            self.gift_catalogue.cache_path = os.path.join(runtime_dir, 'gift_catalogue.json')
         self.proxy_host = proxy_host
         self.proxy_port = proxy_port
         if self.proxy_host is not None and self.proxy_port is not None:
@@ -77,15 +149,63 @@ class Tool:
             }
         else:
             self._request_proxies = None
+        # 请求头按实例拷贝一份，多个房间同进程运行时互不覆盖 Referer/cookie
+        self.headers = dict(self.headers)
         self.headers['Referer'] = self.liveUrl
+        # 没传 cookie 时使用进程内共享的 cookie 提供者，多个直播间只启动一次浏览器
         if cookie:
+            self.cookie_provider = cookie_provider
             self.headers['cookie'] = cookie
         else:
-            self.headers['cookie'] = self._get_cookie()
+            self.cookie_provider = cookie_provider or getBrowserCookieProvider(
+                chrome_bin_path, chrome_driver_path, runtime_dir, proxy_host, proxy_port)
+            self.headers['cookie'] = self.cookie_provider.get()
+        # 连续遇到 CookieNotUseful 的次数，超过 cookie_retries 后不再重试
+        self.cookie_retries = 3
+        self._cookieFailures = 0
+
+    @property
+    def http(self) -> HttpClient:
+        if self._http is None:
+            self._http = getHttpClient()
+        return self._http
+
+    @http.setter
+    def http(self, client: HttpClient):
+        self._http = client
+
+    # 弹幕回调，设置后自动订阅 SC_FEED_PUSH
+    @property
+    def feed_push_callback(self):
+        return self._feed_push_callback.callback if self._feed_push_callback is not None else None
+
+    @feed_push_callback.setter
+    def feed_push_callback(self, callback):
+        if self._feed_push_callback is not None:
+            self.dispatcher.unsubscribe(PayloadType.SC_FEED_PUSH, self._feed_push_callback)
+            self._feed_push_callback = None
+        if callback is not None:
+            self._feed_push_callback = FeedPushCallback(callback, self._feed_push_lazy)
+            self.dispatcher.subscribe(PayloadType.SC_FEED_PUSH, self._feed_push_callback)
+
+    @property
+    def feed_push_lazy(self) -> bool:
+        return self._feed_push_lazy
+
+    @feed_push_lazy.setter
+    def feed_push_lazy(self, lazy: bool):
+        self._feed_push_lazy = lazy
+        if self._feed_push_callback is not None:
+            self._feed_push_callback.lazy = lazy
 
     @staticmethod
     def get_browser(chrome_bin_path, chrome_driver_path, user_data_dir: str, proxy_host: Optional[str] = None,
                     proxy_port: Optional[str] = None):
+        try:
+            from selenium import webdriver
+            from selenium.webdriver.chrome.options import Options
+        except ImportError:
+            raise ImportError('获取 cookie 需要安装 selenium: pip install selenium')
         options = Options()
         options.binary_location = chrome_bin_path
         options.add_argument('--headless')
@@ -103,43 +223,65 @@ class Tool:
         return browser
 
     def _get_cookie(self) -> str:
-        user_data_dir = os.path.join(self.runtime_dir, "chrome_user_data_dir")
-        if not os.path.exists(user_data_dir):
-            os.makedirs(user_data_dir, mode=0o755, exist_ok=True)
-        browser = self.get_browser(self.chrome_bin_path, self.chrome_driver_path, user_data_dir, self.proxy_host,
-                                   self.proxy_port)
-        browser.get(self.liveUrl)
-        browser.implicitly_wait(50)
-        # time.sleep(5)
-        cookie_list = browser.get_cookies()
-        browser.quit()
-        ret_str_list = []
-        for cookie_dict in cookie_list:
-            ret_str_list.append(f"{cookie_dict['name']}={cookie_dict['value']}")
-        return "; ".join(ret_str_list)
+        return harvestCookie(self.liveUrl, self.chrome_bin_path, self.chrome_driver_path, self.runtime_dir,
+                             self.proxy_host, self.proxy_port)
+
+    # cookie 失效时换一个新的；返回 False 表示没有可用的新 cookie
+    def refreshCookie(self) -> bool:
+        self._cookieFailures += 1
+        if self.cookie_provider is None or self._cookieFailures > self.cookie_retries:
+            return False
+        if not self.cookie_provider.invalidate(self.headers['cookie']):
+            return False
+        self.headers['cookie'] = self.cookie_provider.get()
+        logging.info(f'[refreshCookie] [已更换cookie, 第{self._cookieFailures}次]')
+        return True
 
     # 获取房间号
-    def getLiveRoomId(self):
+    # 边下载边查找 __INITIAL_STATE__，找到后就不再读取剩余页面，只解析 liveroom 部分；结果按直播地址缓存
+    def getLiveRoomId(self, use_cache: bool = True):
+        if use_cache:
+            cached = liveRoomIdCache.get(self.liveUrl)
+            if cached is not None:
+                self.liveRoomId = cached
+                return cached
         liveUrl = self.liveUrl.strip('/')
         logging.info(f"requests 代理信息. [proxies = {self._request_proxies}]")
-        res = requests.get(url=liveUrl, headers=self.headers, proxies=self._request_proxies)
-        ss = re.search(
-            r'__INITIAL_STATE__=(.*?);\(function\(\)\{var s;\(s=document\.currentScript\|\|document\.scripts\[document\.scripts\.length-1]\)\.parentNode\.r',
-            res.text)
-        if ss is None:
+        extractor = StateExtractor()
+        with span('getLiveRoomId', room=self.liveUrl):
+            with self.http.get(liveUrl, headers=self.headers, proxies=self._request_proxies, stream=True) as res:
+                for chunk in res.iter_content(chunk_size=16384):
+                    if extractor.feed(chunk):
+                        break
+            return self._parseLiveRoomId(extractor)
+
+    async def getLiveRoomIdAsync(self, http: AsyncHttpClient, use_cache: bool = True):
+        if use_cache:
+            cached = liveRoomIdCache.get(self.liveUrl)
+            if cached is not None:
+                self.liveRoomId = cached
+                return cached
+        extractor = StateExtractor()
+        with span('getLiveRoomId', room=self.liveUrl):
+            async with http.session().get(self.liveUrl.strip('/'), headers=self.headers,
+                                          proxy=self._aiohttpProxy()) as res:
+                async for chunk in res.content.iter_chunked(16384):
+                    if extractor.feed(chunk):
+                        break
+            return self._parseLiveRoomId(extractor)
+
+    def _parseLiveRoomId(self, extractor: StateExtractor):
+        if extractor.state is None:
             raise CookieNotUseful("cookie 不能用了，请手动配置cookie 或者切换ip")
-        text = ss.group(1)
-        text = json.loads(text)
-
-        # print(text['liveroom']['liveStream'])
-        live_room_info = text['liveroom']['liveStream']
+        live_room_info = extractor.liveStream()
         if not live_room_info:
             raise CookieNotUseful("cookie 不能用了，请手动配置cookie 或者切换ip")
-        if 'id' not in text['liveroom']['liveStream']:
+        if 'id' not in live_room_info:
             raise NoLivingException("还未开播")
         self.liveRoomId = live_room_info['id']
         if self.liveRoomId == '':
             raise RuntimeError('liveRoomId获取失败')
+        liveRoomIdCache.set(self.liveUrl, self.liveRoomId)
         return self.liveRoomId
 
     # 获取主播直播信息 （主播个人信息，直播地址，房间号等等）
@@ -149,112 +291,246 @@ class Tool:
 
     # 获取直播websocket信息
     def getWebSocketInfo(self, liveRoomId):
-        _url = 'https://live.kuaishou.com/live_api/liveroom/websocketinfo'
+        with span('getWebSocketInfo', room=self.liveUrl):
+            resp = self.http.get(self.webSocketInfoUrl, params={'liveStreamId': liveRoomId},
+                                 headers=self._jsonHeaders(), proxies=self._request_proxies)
+            return self._checkWebSocketInfo(resp.json())
+
+    async def getWebSocketInfoAsync(self, http: AsyncHttpClient, liveRoomId):
+        with span('getWebSocketInfo', room=self.liveUrl):
+            resp = await http.get(self.webSocketInfoUrl, params={'liveStreamId': liveRoomId},
+                                  headers=self._jsonHeaders(), proxy=self._aiohttpProxy())
+            return self._checkWebSocketInfo(resp.json())
 
-        _headers = copy.deepcopy(self.headers)
-        _headers['Accept'] = 'application/json, text/plain, */*'
-        resp = requests.get(_url, params={'liveStreamId': liveRoomId}, headers=_headers,
-                            proxies=self._request_proxies)
-        resp_data = resp.json()
+    def _jsonHeaders(self) -> dict:
+        return dict(self.headers, Accept='application/json, text/plain, */*')
+
+    @staticmethod
+    def _checkWebSocketInfo(resp_data: dict) -> dict:
         if resp_data['data']['result'] != 1:
             raise CookieNotUseful(f"cookie 不能用了，请手动配置cookie 或者切换ip. [func = getWebSocketInfo, data = {resp_data}]")
-        return resp.json()
+        return resp_data
+
+    # aiohttp 的代理参数
+    def _aiohttpProxy(self) -> Optional[str]:
+        if self.proxy_host is None or self.proxy_port is None:
+            return None
+        return f'http://{self.proxy_host}:{self.proxy_port}'
+
+    # 轮换 websocket 地址；一轮地址都用过之后重新获取 token 和地址列表
+    def nextWebSocketUrl(self):
+        if self._urlIndex + 1 >= len(self.webSocketUrls):
+            rid = self.getLiveRoomId()
+            try:
+                wssInfo = self.getWebSocketInfo(rid)
+            except CookieNotUseful:
+                # 缓存的房间号可能已经过期（重新开播），重新获取房间号，变了就再试一次
+                liveRoomIdCache.invalidate(self.liveUrl)
+                if self.getLiveRoomId(use_cache=False) == rid:
+                    raise
+                wssInfo = self.getWebSocketInfo(self.liveRoomId)
+            self._setWebSocketInfo(wssInfo)
+        else:
+            self._urlIndex += 1
+        self.webSocketUrl = self.webSocketUrls[self._urlIndex]
+        return self.webSocketUrl
+
+    async def nextWebSocketUrlAsync(self, http: AsyncHttpClient):
+        if self._urlIndex + 1 >= len(self.webSocketUrls):
+            rid = await self.getLiveRoomIdAsync(http)
+            try:
+                wssInfo = await self.getWebSocketInfoAsync(http, rid)
+            except CookieNotUseful:
+                liveRoomIdCache.invalidate(self.liveUrl)
+                if await self.getLiveRoomIdAsync(http, use_cache=False) == rid:
+                    raise
+                wssInfo = await self.getWebSocketInfoAsync(http, self.liveRoomId)
+            self._setWebSocketInfo(wssInfo)
+        else:
+            self._urlIndex += 1
+        self.webSocketUrl = self.webSocketUrls[self._urlIndex]
+        return self.webSocketUrl
+
+    def _setWebSocketInfo(self, wssInfo: dict):
+        self.token = wssInfo['data']['token']
+        self.webSocketUrls = list(wssInfo['data']['websocketUrls'])
+        self._urlIndex = 0
 
     # 启动websocket服务
-    def wssServerStart(self, feed_push_callback=None):
+    # delivery：DeliveryQueue，设置后回调在消费者线程里执行，慢回调不会卡住收包和心跳
+    # reconnect：断线后按退避时间自动重连，直到调用 wssServerStop
+    # recorder：FrameRecorder，录制收到的原始帧
+    def wssServerStart(self, feed_push_callback=None, lazy: bool = False, delivery=None, reconnect: bool = True,
+                       recorder=None):
         self.feed_push_callback = feed_push_callback
+        if recorder is not None:
+            self.recorder = recorder
+        self.feed_push_lazy = lazy
+        if delivery is not None:
+            self.dispatcher.delivery = delivery.start()
+
+        self.loadGiftCatalogue()
+        if self.metrics is not None:
+            self.metrics.start()
+        import websocket
 
-        rid = self.getLiveRoomId()
-        wssInfo = self.getWebSocketInfo(rid)
-        self.token = wssInfo['data']['token']
-        self.webSocketUrl = wssInfo['data']['websocketUrls'][0]
         websocket.enableTrace(False)
-        # 创建一个长连接
-        ws = websocket.WebSocketApp(
-            self.webSocketUrl, on_message=self.onMessage, on_error=self.onError, on_close=self.onClose,
-            on_open=self.onOpen
-        )
-        ws.run_forever(http_proxy_host=self.proxy_host, http_proxy_port=self.proxy_port)
-
-    def onMessage(self, ws: websocket.WebSocketApp, message: bytes):
+        try:
+            while not self._stopped.is_set():
+                try:
+                    self.nextWebSocketUrl()
+                    # 创建一个长连接
+                    ws = websocket.WebSocketApp(
+                        self.webSocketUrl, on_message=self.onMessage, on_error=self.onError, on_close=self.onClose,
+                        on_open=self.onOpen
+                    )
+                    with self._wsLock:
+                        if self._stopped.is_set():
+                            break
+                        self.ws = ws
+                    # ping_timeout 让收包循环每秒醒来检查 keep_running：连接建立过程中被 close 时
+                    # socket 已从 selector 里移除，不设超时会一直阻塞在 select
+                    ws.run_forever(http_proxy_host=self.proxy_host, http_proxy_port=self.proxy_port, ping_timeout=1)
+                except NoLivingException:
+                    raise
+                except CookieNotUseful:
+                    if not self.refreshCookie():
+                        raise
+                except Exception as e:
+                    logging.error(f'[wssServerStart] [连接失败, url = {self.webSocketUrl}, err = {e}]')
+                if not reconnect or self._stopped.is_set():
+                    break
+                self.reconnectCount += 1
+                if self.metrics is not None:
+                    self.metrics.reconnects.inc()
+                delay = self.backoff.next()
+                logging.info(f'[wssServerStart] [{delay:.1f}秒后第{self.reconnectCount}次重连]')
+                self._stopped.wait(delay)
+        finally:
+            # 已经退出，清除停止标记，之后可以再次启动
+            self._stopped.clear()
+            if self.recorder is not None:
+                self.recorder.flush()
+
+    # 停止websocket服务，不再重连
+    def wssServerStop(self):
+        with self._wsLock:
+            self._stopped.set()
+            ws = self.ws
+        self.stopHeartbeat()
+        # 连接还没建立时 close 不起作用，由 onOpen 检查停止标记后关闭
+        if ws is not None:
+            ws.close()
+
+    def onMessage(self, ws: 'websocket.WebSocketApp', message: bytes):
+        if self.recorder is not None:
+            self.recorder.record(message)
         wssPackage = SocketMessage()
         wssPackage.ParseFromString(message)
-
-        if wssPackage.payloadType == PayloadType.SC_ENTER_ROOM_ACK:
-            self.parseEnterRoomAckPack(wssPackage.payload)
+        if self.metrics is not None:
+            self.metrics.onFrame(wssPackage.payloadType, len(message))
+        payload = self.decompressor.decompress(wssPackage)
+        if payload is None:
             return
 
-        if wssPackage.payloadType == PayloadType.SC_HEARTBEAT_ACK:
-            self.parseHeartBeatPack(wssPackage.payload)
-            return
+        # 只有被订阅的数据包才会解析
+        data = self.dispatcher.dispatch(wssPackage.payloadType, payload)
+        if logging.root.isEnabledFor(logging.DEBUG):
+            self._debugLog(wssPackage, payload, data)
 
-        if wssPackage.payloadType == PayloadType.SC_FEED_PUSH:
-            self.parseFeedPushPack(wssPackage.payload)
+    def _debugLog(self, wssPackage: SocketMessage, payload: bytes, data=None):
+        payloadType = wssPackage.payloadType
+        if payloadType == PayloadType.SC_ENTER_ROOM_ACK:
             return
-
-        if wssPackage.payloadType == PayloadType.SC_LIVE_WATCHING_LIST:
-            self.parseSCWebLiveWatchingUsers(wssPackage.payload)
+        label = self.logLabels.get(payloadType)
+        if label is None:
+            data = json_format.MessageToDict(wssPackage, preserving_proto_field_name=True)
+            log = json.dumps(data, ensure_ascii=False)
+            logging.debug('[onMessage] [无法解析的数据包⚠️]' + log)
             return
-
-        data = json_format.MessageToDict(wssPackage, preserving_proto_field_name=True)
-        log = json.dumps(data, ensure_ascii=False)
-        logging.debug('[onMessage] [无法解析的数据包⚠️]' + log)
+        if data is None:
+            data = self.dispatcher.decode(payloadType, payload)
+        logging.debug(label + ' [RoomId:' + self.liveRoomId + '] ｜ ' + data.to_json())
+
+    # 解析并分发某个类型的包体，返回视图
+    def _parsePack(self, payloadType: int, message: bytes):
+        data = self.dispatcher.decode(payloadType, message)
+        self.dispatcher.publish(payloadType, data)
+        if logging.root.isEnabledFor(logging.DEBUG) and payloadType in self.logLabels:
+            logging.debug(self.logLabels[payloadType] + ' [RoomId:' + self.liveRoomId + '] ｜ ' + data.to_json())
+        return data
 
     def parseEnterRoomAckPack(self, message: bytes):
-        scWebEnterRoomAck = SCWebEnterRoomAck()
-        scWebEnterRoomAck.ParseFromString(message)
-        data = json_format.MessageToDict(scWebEnterRoomAck, preserving_proto_field_name=True)
-        log = json.dumps(data, ensure_ascii=False)
-        logging.info('[parseEnterRoomAckPack] [进入房间成功ACK应答👌] [RoomId:' + self.liveRoomId + '] ｜ ' + log)
-        return data
+        return self._parsePack(PayloadType.SC_ENTER_ROOM_ACK, message)
 
     # 进入直播间的用户
     def parseSCWebLiveWatchingUsers(self, message: bytes):
-        scWebLiveWatchingUsers = SCWebLiveWatchingUsers()
-        scWebLiveWatchingUsers.ParseFromString(message)
-        data = json_format.MessageToDict(scWebLiveWatchingUsers, preserving_proto_field_name=True)
-        log = json.dumps(data, ensure_ascii=False)
-        logging.debug(
-            '[parseSCWebLiveWatchingUsers] [不知道是啥的数据包🤷] [RoomId:' + self.liveRoomId + '] ｜ ' + log)
-        return data
+        return self._parsePack(PayloadType.SC_LIVE_WATCHING_LIST, message)
 
     # 直播间弹幕信息
     def parseFeedPushPack(self, message: bytes):
-        scWebFeedPush = SCWebFeedPush()
-        scWebFeedPush.ParseFromString(message)
-        data = json_format.MessageToDict(scWebFeedPush, preserving_proto_field_name=True)
-        if self.feed_push_callback is not None:
-            self.feed_push_callback(data)
-        log = json.dumps(data, ensure_ascii=False)
-        logging.debug('[parseFeedPushPack] [直播间弹幕🐎消息] [RoomId:' + self.liveRoomId + '] ｜ ' + log)
-        return data
+        return self._parsePack(PayloadType.SC_FEED_PUSH, message)
 
     def parseHeartBeatPack(self, message: bytes):
-        heartAckMsg = SCHeartbeatAck()
-        heartAckMsg.ParseFromString(message)
-        data = json_format.MessageToDict(heartAckMsg, preserving_proto_field_name=True)
-        log = json.dumps(data, ensure_ascii=False)
-        logging.debug('[parseHeartBeatPack] [心跳❤️响应] [RoomId:' + self.liveRoomId + '] ｜ ' + log)
-        return data
+        return self._parsePack(PayloadType.SC_HEARTBEAT_ACK, message)
+
+    # 进入房间成功
+    def onEnterRoomAck(self, data):
+        ack = data.message
+        if self._enterSpan is not None:
+            self._enterSpan.end()
+            self._enterSpan = None
+        self.backoff.reset()
+        self._cookieFailures = 0
+        self.backoff.updateFromAck(ack.minReconnectMs, ack.maxReconnectMs)
+        if ack.heartbeatIntervalMs:
+            self.heartbeatInterval = ack.heartbeatIntervalMs / 1000
+            heartbeat = self.heartbeat
+            if heartbeat is not None and not heartbeat.fixed:
+                heartbeat.setInterval(self.heartbeatInterval)
+                self.heartbeat_scheduler.reschedule(heartbeat)
+        if logging.root.isEnabledFor(logging.INFO):
+            logging.info('[parseEnterRoomAckPack] [进入房间成功ACK应答👌] [RoomId:' + self.liveRoomId + '] ｜ ' + data.to_json())
+
+    # 心跳应答，计算往返耗时
+    def onHeartbeatAck(self, data):
+        heartbeat = self.heartbeat
+        if heartbeat is not None:
+            rtt = heartbeat.onAck(data.message.clientTimestamp)
+            if rtt is not None and self.metrics is not None:
+                self.metrics.heartbeat_rtt.observe(rtt)
 
     def onError(self, ws, error):
         logging.error(f'[Error] [websocket异常, err = {error}]')
 
-    def onClose(self, ws):
-        logging.info('[Close] [websocket已关闭]')
+    def onClose(self, ws, close_status_code=None, close_msg=None):
+        if close_status_code:
+            self.lastErrorCode = close_status_code
+        self.stopHeartbeat()
+        logging.info(f'[Close] [websocket已关闭, code = {close_status_code}, msg = {close_msg}]')
 
     def onOpen(self, ws):
+        if self._stopped.is_set():
+            ws.close()
+            return
         data = self.connectData()
         logging.info('[onOpen] [建立wss连接]')
-        ws.send(data, websocket.ABNF.OPCODE_BINARY)
-        _thread.start_new_thread(self.keepHeartBeat, (ws,))
+        ws.send(data, OPCODE_BINARY)
+        self.keepHeartBeat(ws)
 
+    # 进房鉴权包；从这里到收到 SCWebEnterRoomAck 记为 enterRoom 耗时
     def connectData(self):
+        if self._enterSpan is not None:
+            # 上一次进房没有等到应答
+            self._enterSpan.end(ConnectionError('没有收到进房应答'))
+        self._enterSpan = startSpan('enterRoom', room=self.liveUrl)
         obj = CSWebEnterRoom()
         obj.payloadType = 200
         obj.payload.token = self.token
         obj.payload.liveStreamId = self.liveRoomId
         obj.payload.pageId = self.getPageId()  # pageId
+        obj.payload.reconnectCount = self.reconnectCount
+        obj.payload.lastErrorCode = self.lastErrorCode
         data = obj.SerializeToString()  # 序列化成二进制字符串
         return data
 
@@ -265,14 +541,25 @@ class Tool:
         obj.payload.timestamp = int(time.time() * 1000)
         return obj.SerializeToString()
 
-    # 发送心跳包
-    def keepHeartBeat(self, ws: websocket.WebSocketApp):
-        while True:
-            # 20秒发一次心跳包
-            time.sleep(20)
-            payload = self.heartbeatData()
-            logging.debug("[keepHeartBeat] [发送心跳]")
-            ws.send(payload, websocket.ABNF.OPCODE_BINARY)
+    # 发送心跳包：交给共享的心跳调度器，连接关闭时取消；连续收不到应答时主动断开，尽快重连
+    def keepHeartBeat(self, ws: 'websocket.WebSocketApp'):
+        def onDead():
+            logging.warning(f'[keepHeartBeat] [心跳无应答，断开重连, url = {self.webSocketUrl}]')
+            ws.close()
+
+        self.startHeartbeat(lambda data: ws.send(data, OPCODE_BINARY), onDead)
+
+    # 注册当前连接的心跳；interval 为 None 时使用进房应答下发的间隔
+    def startHeartbeat(self, send, on_dead, interval: Optional[float] = None) -> Heartbeat:
+        self.stopHeartbeat()
+        heartbeat = Heartbeat(interval or self.heartbeatInterval, name=self.liveUrl, fixed=interval is not None)
+        self.heartbeat = self.heartbeat_scheduler.register(heartbeat, send, on_dead)
+        return heartbeat
+
+    def stopHeartbeat(self):
+        heartbeat = self.heartbeat
+        if heartbeat is not None:
+            self.heartbeat_scheduler.cancel(heartbeat)
 
     def getPageId(self):
         # js 中获取到该值的组成字符串
@@ -312,19 +599,48 @@ class Tool:
         query = 'query UserCardInfoById($principalId: String, $count: Int) {\n  userCardInfo(principalId: $principalId, count: $count) {\n    id\n    originUserId\n    avatar\n    name\n    description\n    sex\n    constellation\n    cityName\n    followStatus\n    privacy\n    feeds {\n      eid\n      photoId\n      thumbnailUrl\n      timestamp\n      __typename\n    }\n    counts {\n      fan\n      follow\n      photo\n      __typename\n    }\n    __typename\n  }\n}\n'
         return self.liveGraphql('UserCardInfoById', variables, query)
 
-    # 获取所有礼物信息
-    def getAllGifts(self):
+    # 批量获取用户基本信息：一个 GraphQL 请求里用别名（u0、u1...）查多个用户，返回 principalId -> 信息，查不到的为 None
+    def getUserCardInfoByIds(self, principalIds, count: int = 3) -> dict:
+        principalIds = list(principalIds)
+        variables = {'count': count}
+        params = ['$count: Int']
+        fields = []
+        for i, principalId in enumerate(principalIds):
+            variables[f'p{i}'] = principalId
+            params.append(f'$p{i}: String')
+            fields.append(f'  u{i}: userCardInfo(principalId: $p{i}, count: $count) {{\n{userCardFields}  }}\n')
+        query = f'query UserCardInfoByIds({", ".join(params)}) {{\n{"".join(fields)}}}\n'
+        res = self.liveGraphql('UserCardInfoByIds', variables, query)
+        data = res.get('data')
+        if data is None:
+            raise RuntimeError(f'批量获取用户信息失败: {res.get("errors") or res}')
+        return {principalId: data.get(f'u{i}') for i, principalId in enumerate(principalIds)}
+
+    # 获取所有礼物信息：进程内只请求一次，缓存在 runtime_dir 下，过期后带 ETag 重新校验；refresh 为 True 时强制校验
+    def getAllGifts(self, refresh: bool = False):
         # variables = {}
         # query = 'query AllGifts {\n  allGifts\n}\n'
         # data = self.liveGraphql('AllGifts', variables, query)
-        all_gift_url = 'https://live.kuaishou.com/live_api/emoji/allgifts'
-        resp = requests.get(all_gift_url, headers=self.headers, proxies=self._request_proxies)
-        return resp.json()
+        return self.gift_catalogue.ensure(self._fetchAllGifts, force=refresh).raw
+
+    # 开启指标统计，返回 RoomMetrics；registry 默认为进程内共享的注册表
+    def enableMetrics(self, registry: Optional[MetricsRegistry] = None) -> RoomMetrics:
+        self.metrics = RoomMetrics(self.liveUrl, registry)
+        self.dispatcher.metrics = self.metrics
+        return self.metrics
+
+    # 在后台加载礼物目录，不耽误连接；已经加载且没过期时什么也不做
+    def loadGiftCatalogue(self):
+        self.gift_catalogue.ensureInBackground(self._fetchAllGifts)
+
+    def _fetchAllGifts(self, headers: dict):
+        return self.http.get(self.allGiftsUrl, headers=dict(self.headers, **headers), proxies=self._request_proxies)
 
     # 底层统一请求方法
     def liveGraphql(self, operationName: str, variables, query, headers=None):
+        # 每次请求单独拷贝请求头，不修改 self.headers，多线程同时调用互不影响
         if headers is None:
-            head = self.headers
+            head = dict(self.headers)
             head['content-type'] = 'application/json'
         else:
             head = headers
@@ -334,7 +650,11 @@ class Tool:
             'variables': variables,
             'query': query
         }
-        res = requests.post(url=self.apiHost, data=json.dumps(data), headers=head, proxies=self._request_proxies).json()
+        resp = self.http.post(self.apiHost, data=json.dumps(data), headers=head, proxies=self._request_proxies)
+        # 限流 / 网关错误时服务端没有处理请求，抛出带状态码的 HTTPError，调用方（如 ActionQueue）可以安全重试
+        if resp.status_code in RETRY_STATUS:
+            resp.raise_for_status()
+        res = resp.json()
         logging.debug('[liveGraphql] [操作返回数据] ｜ ' + json.dumps(res, ensure_ascii=False))
         return res
 
@@ -342,12 +662,12 @@ class Tool:
     def hexStrToProtobuf(self, hexStr):
         # 示例数据
         # hexStr = '08d40210011aeb250a8e010a81010a0b66666731343535323939391206e68595e799bd1a6a68747470733a2f2f70312e612e7978696d67732e636f6d2f75686561642f41422f323032322f31312f31322f32312f424d6a41794d6a45784d5449794d5441304d6a68664d6a67784d4445354e7a67344d5638795832686b4d6a6335587a49324d513d3d5f732e6a7067180120012a04323132300aa8010a9e010a0b79697869616f77753636361209e79fa5e5b08fe6ada61a830168747470733a2f2f616c69696d672e612e7978696d67732e636f6d2f75686561642f41422f323032322f31302f30322f31392f424d6a41794d6a45774d4449784f544d304e4442664e6a497a4d4455324d445977587a4a66614751304e444a664d546b335f732e6a70674030655f306f5f306c5f3530685f3530775f3835712e73726318012a033430330ab6010aac010a0c4c31333130373432373635301212e9bb8ee699a8f09f8c8af09f8c8af09f8c8a1a870168747470733a2f2f616c69696d672e612e7978696d67732e636f6d2f75686561642f41422f323032322f31312f31392f31332f424d6a41794d6a45784d546b784d7a4d784d5452664d5441344e5467794d5449334d5638795832686b4e444935587a45304d513d3d5f732e6a70674030655f306f5f306c5f3530685f3530775f3835712e73726318012a033335390ac2010ab8010a104757515053414148445244444145775a121ee69492e4b880e58fa3e8a28be6989fe6989fe98081e7bb99e58c97e699a81a830168747470733a2f2f616c69696d672e612e7978696d67732e636f6d2f75686561642f41422f323032322f31312f31322f32312f424d6a41794d6a45784d5449794d5445774d6a4e664d5445314d7a59354d4451324e6c38795832686b4e7a46664f5449355f732e6a70674030655f306f5f306c5f3530685f3530775f3835712e73726318012a033130330a91010a88010a0f337870323538746a6d6376337a62751209e58699e7949ce8af971a6a68747470733a2f2f70332e612e7978696d67732e636f6d2f75686561642f41422f323032322f31312f32302f31372f424d6a41794d6a45784d6a41784e7a4d784e5442664d7a45784d7a4d784f5445784e6c38795832686b4d545530587a49344d513d3d5f732e6a706718012a0233340aac010aa3010a0979756875616e306b64120ce88a8be594a4e1b587e1b69c1a870168747470733a2f2f616c69696d672e612e7978696d67732e636f6d2f75686561642f41422f323032322f30362f31312f30312f424d6a41794d6a41324d5445774d5451334e5452664d5441774d6a51324f4445344f4638795832686b4e444535587a457a4e773d3d5f732e6a70674030655f306f5f306c5f3530685f3530775f3835712e73726318012a0233330a8a010a81010a0c6868686832303033313032391205e888aac2b71a6a68747470733a2f2f70332e612e7978696d67732e636f6d2f75686561642f41422f323032322f31312f30332f32322f424d6a41794d6a45784d444d794d6a41784d546c664d6a4d7a4d7a45794d4455304d3138795832686b4e544133587a4d314d513d3d5f732e6a706718012a0233310aab010aa2010a0f3378686d3568677a6e657963666b6b1209e890a8e5bf853536391a830168747470733a2f2f616c69696d672e612e7978696d67732e636f6d2f75686561642f41422f323032302f30372f32342f30382f424d6a41794d4441334d6a51774f4449774d4442664d5467344e5455314d5449784e6c38795832686b4d6a4d79587a673d5f732e6a70674030655f306f5f306c5f3530685f3530775f3835712e73726318012a0232330a93010a8a010a0f33787569663363746b6e6d38773271120be790aae790aa37313432321a6a68747470733a2f2f70312e612e7978696d67732e636f6d2f75686561642f41422f323032322f31312f31382f31322f424d6a41794d6a45784d5467784d6a45784e4446664d7a45794f5441354f446b304e3138795832686b4e7a6730587a49344e773d3d5f732e6a706718012a0232320a94010a8b010a0f337862677a6a627034777570763567120cefbc87e7bbade99b86efbc821a6a68747470733a2f2f70352e612e7978696d67732e636f6d2f75686561642f41422f323032322f30382f33302f31352f424d6a41794d6a41344d7a41784e5451334e4452664d5441324d6a51334d6a41324e3138795832686b4f545533587a63314e413d3d5f732e6a706718012a0232320aa5010a9c010a0979796473696f73313212054c696b652e1a870168747470733a2f2f616c69696d672e612e7978696d67732e636f6d2f75686561642f41422f323032322f31312f31382f31322f424d6a41794d6a45784d5467784d6a51324e4456664d6a4d354d4459774d5455344e5638785832686b4d546731587a51354d773d3d5f732e6a70674030655f306f5f306c5f3530685f3530775f3835712e73726318012a0232310a90010a85010a0a48657969676530353230120be4bba5e6ad8c20f09f8e801a6a68747470733a2f2f70312e612e7978696d67732e636f6d2f75686561642f41422f323032322f31312f31332f31302f424d6a41794d6a45784d544d784d4455354d6a4e664d544d324e6a41304e7a41774d5638785832686b4d6a6779587a51794f413d3d5f732e6a7067180120012a0231320aa8010a9f010a0f33786b623464793435706a797570711206e684a6e6829f1a830168747470733a2f2f616c69696d672e612e7978696d67732e636f6d2f75686561642f41422f323032322f31312f30342f32322f424d6a41794d6a45784d4451794d6a41774d445a664e4445794f446b324d545931587a4a66614751324e4456664f446b355f732e6a70674030655f306f5f306c5f3530685f3530775f3835712e73726318012a0231310aa5010a9c010a08776a353431383830120ae88b8fe791bee699a82f1a830168747470733a2f2f616c69696d672e612e7978696d67732e636f6d2f75686561642f41422f323032322f31312f30332f30302f424d6a41794d6a45784d444d774d4449344e546c664d6a41354e6a45794e544d31587a4666614751304d7a6c664e444d785f732e6a70674030655f306f5f306c5f3530685f3530775f3835712e73726318012a0231310abc010ab3010a0f33786334746a7a376e7875636561791216e7a9bfe5b1b1e794b2efbc88696b756ee59ba2efbc891a870168747470733a2f2f616c69696d672e612e7978696d67732e636f6d2f75686561642f41422f323032322f30382f32362f31312f424d6a41794d6a41344d6a59784d5451334d4442664d6a4d314d7a41314d4449774d3138795832686b4e444d79587a4d7a4e673d3d5f732e6a70674030655f306f5f306c5f3530685f3530775f3835712e73726318012a0231300a8c010a84010a0957535162616f353230120fe5b08f20e5a88120e5b09120e380821a6668747470733a2f2f70312e612e7978696d67732e636f6d2f75686561642f41422f323032322f31312f31332f31392f424d6a41794d6a45784d544d784f5445354d5446664f5455314e4449304f445578587a4a666147517a4e5452664e4449785f732e6a706718012a01330a8f010a87010a0f337834646178626768746a78716979120ce7a78be8be9ee1b587e1b69c1a6668747470733a2f2f70332e612e7978696d67732e636f6d2f75686561642f41422f323032322f31312f31342f31312f424d6a41794d6a45784d5451784d544d7a4d544a664e7a55354d7a63774d446b31587a4a66614751784f544e664e5459315f732e6a706718012a01330a8d010a85010a0f3378723937706975747768326d7a321206e791bee4b8811a6a68747470733a2f2f70312e612e7978696d67732e636f6d2f75686561642f41422f323032312f30342f32332f32312f424d6a41794d5441304d6a4d794d5445304e544a664d5463794d7a55304f4463304d4638795832686b4f546378587a59354e513d3d5f732e6a706718012a01330ab0010aa8010a0d6c713431383835343138386868120de585b3e4ba8ee58a8920e5bcb71a870168747470733a2f2f616c69696d672e612e7978696d67732e636f6d2f75686561642f41422f323032322f31312f30352f32332f424d6a41794d6a45784d4455794d7a4d334e544a664d54517a4f44497a4e6a67784d6c38795832686b4d544578587a67324f413d3d5f732e6a70674030655f306f5f306c5f3530685f3530775f3835712e73726318012a01330a8b010a83010a0e4c544431353933313731353337371209e4bba5e6a4bfe383bb1a6668747470733a2f2f70332e612e7978696d67732e636f6d2f75686561642f41422f323032322f31312f30372f31392f424d6a41794d6a45784d4463784f544d314d545a664d5441314d5463784e4459334e6c38795832686b4f444579587a55315f732e6a706718012a01330a89010a83010a0b64796c3230303830363130120ce5b08fe5b08fe5a79ce99c961a6668747470733a2f2f70342e612e7978696d67732e636f6d2f75686561642f41422f323032322f31302f31362f31312f424d6a41794d6a45774d5459784d5455354e5442664f4449304e7a517a4e545535587a4a66614751334d7a42664e5445335f732e6a70672a01320ab7010ab1010a0f3378727a33667a69737438717334611218e5bf98e5b79de38088e5b7b2e69c89e58584e5bc9fe380891a830168747470733a2f2f616c69696d672e612e7978696d67732e636f6d2f75686561642f41422f323032322f31312f31342f31312f424d6a41794d6a45784d5451784d54557a4d6a42664f4441304e444d794f545579587a4666614751304d7a52664d7a4d785f732e6a70674030655f306f5f306c5f3530685f3530775f3835712e7372632a01320a90010a8a010a0e796f6e6773686974756f7a68616e1210e5b08fe58b87e5a3ab2de99988e8b68a1a6668747470733a2f2f70312e612e7978696d67732e636f6d2f75686561642f41422f323032322f30352f32382f31332f424d6a41794d6a41314d6a67784d7a51354d445a664e7a59304f44517a4d7a6b35587a4a66614751794d6a56664e544d7a5f732e6a70672a01320a8d010a87010a0f3378746d706b6167627536766e7139120ce5ad90e792a9e1b587e1b69c1a6668747470733a2f2f70312e612e7978696d67732e636f6d2f75686561642f41422f323032322f31302f33312f31312f424d6a41794d6a45774d7a45784d544d784e4468664e6a45324d4445304d444d30587a4a66614751314e446c664d54497a5f732e6a70672a01320a89010a83010a0f4c4a483532304c4a31333134656d6f1204f09f88b71a6a68747470733a2f2f70352e612e7978696d67732e636f6d2f75686561642f41422f323032322f31312f31342f31382f424d6a41794d6a45784d5451784f4441314d4442664d6a67354d4441774f5455314e6c38795832686b4d6a6730587a63794e513d3d5f732e6a70672a01320aa5010a9d010a0f33786967326675743533373872626b1204456e6d681a830168747470733a2f2f616c69696d672e612e7978696d67732e636f6d2f75686561642f41422f323032322f31312f32332f31312f424d6a41794d6a45784d6a4d784d544d784e446c664d6a59324e7a517a4d4455334f5638785832686b4d7a4132587a6b315f732e6a70674030655f306f5f306c5f3530685f3530775f3835712e73726318012a01320ab1010aab010a0f33786d39353268396a393473787a731212e5ad90e792a9efbc88e5b08fe58fb7efbc891a830168747470733a2f2f616c69696d672e612e7978696d67732e636f6d2f75686561642f41422f323032322f31312f30372f30302f424d6a41794d6a45784d4463774d4451794e4452664d6a517a4d5463314d6a49354e5638795832686b4e5464664e7a49785f732e6a70674030655f306f5f306c5f3530685f3530775f3835712e7372632a01320aa9010aa3010a0f3378397370326436703272727866391206e585b1e5928c1a870168747470733a2f2f616c69696d672e612e7978696d67732e636f6d2f75686561642f41422f323032322f30372f32382f31322f424d6a41794d6a41334d6a67784d6a55314d7a42664d6a4d354e6a4d774e4455304d3138795832686b4e6a6b35587a45774e413d3d5f732e6a70674030655f306f5f306c5f3530685f3530775f3835712e7372632a01320aa5010a9f010a0b4c5a5032303133313479611206e6b3bde4b8801a870168747470733a2f2f616c69696d672e612e7978696d67732e636f6d2f75686561642f41422f323032322f30372f31332f31362f424d6a41794d6a41334d544d784e6a49304e5456664d546b324e4445794f4463334f5638795832686b4f545179587a597a4d673d3d5f732e6a70674030655f306f5f306c5f3530685f3530775f3835712e7372632a01320a9f010a99010a0f3378326e37793865656573766b6879121ee58c97e699a8e79a84e4bfa1e699baefbc88e5b7b2e7b4abe7a082efbc891a6668747470733a2f2f70312e612e7978696d67732e636f6d2f75686561642f41422f323032322f31312f31332f31312f424d6a41794d6a45784d544d784d5441344d6a68664d5467344d44497a4f5441354e5638785832686b4f446b79587a45795f732e6a70672a013220a699a0ebca30'
-        with open('t-proto', 'wb') as w:
-            w.write(binascii.unhexlify(hexStr))
-
+        try:
+            from protobuf_inspector.types import StandardParser
+        except ImportError:
+            raise ImportError('解析未知包体需要安装 protobuf_inspector: pip install protobuf-inspector')
         parser = StandardParser()
-        with open('t-proto', 'rb') as fh:
-            output = parser.parse_message(fh, "message")
+        output = parser.parse_message(io.BytesIO(binascii.unhexlify(hexStr)), "message")
         logging.debug(output)
         return output
 
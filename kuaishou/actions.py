@@ -0,0 +1,255 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import requests
+
+from .ratelimit import TokenBucket
+from .reconnect import Backoff
+
+# 可能可以重试的异常，具体由 ActionQueue._retryable 判断
+TRANSIENT_ERRORS = (requests.ConnectionError, requests.HTTPError)
+
+# 默认只对 429 重试：服务端明确表示没有处理。5xx 时请求可能已经生效，需要时通过 retry_status 打开
+DEFAULT_RETRY_STATUS = (429,)
+
+
+# 连接阶段就失败了（DNS、拒绝连接、连接超时），请求肯定没有发出去。
+# 发出请求之后连接被重置（ProtocolError / RemoteDisconnected）也是 ConnectionError，但服务端可能已经处理，不算
+def _connectFailed(e: BaseException) -> bool:
+    from urllib3.exceptions import ConnectTimeoutError
+    from urllib3.exceptions import NewConnectionError
+
+    if isinstance(e, requests.ConnectTimeout):
+        return True
+    if not isinstance(e, requests.ConnectionError) or not e.args:
+        return False
+    # requests 把 urllib3 的 MaxRetryError 包在 args[0] 里，真正的原因在 reason
+    reason = getattr(e.args[0], 'reason', e.args[0])
+    return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+
+def _failed(future: Future) -> bool:
+    return future.done() and (future.cancelled() or future.exception() is not None)
+
+
+class Action:
+    """一次待执行的操作：调用 tool 的 method(*args)"""
+
+    __slots__ = ('tool', 'method', 'args', 'room', 'account', 'key', 'future', 'attempts', 'backoff', 'created')
+
+    def __init__(self, tool, method: str, args: tuple, room: str, account: str, key: tuple, backoff: Backoff):
+        self.tool = tool
+        self.method = method
+        self.args = args
+        self.room = room
+        self.account = account
+        self.key = key
+        self.future = Future()
+        self.attempts = 0
+        self.backoff = backoff
+        self.created = time.time()
+
+
+class ActionQueue:
+    """发弹幕、关注等主动操作的发送队列
+
+    - 每个账号（按 cookie 区分）一个令牌桶，每秒最多 rate 次，突发 burst 次，避免账号被限流
+    - 同一个直播间的操作按提交顺序逐个执行，不同直播间并行（workers 个线程）
+    - dedup_window 秒内同一账号提交的相同操作只执行一次，返回同一个 Future
+    - 连接阶段失败、服务端返回 retry_status（默认只有 429）时按指数退避重试 max_retries 次，
+      重试期间同一直播间后面的操作继续排队，顺序不变；读超时、响应中途断开等请求可能已经送达的错误不重试，避免重复发送
+    """
+
+    def __init__(self, rate: float = 0.5, burst: float = 3, workers: int = 8, max_retries: int = 3,
+                 dedup_window: float = 30.0, retry_base: float = 1.0, retry_max: float = 30.0,
+                 retry_status: Iterable[int] = DEFAULT_RETRY_STATUS):
+        self.rate = rate
+        self.retry_status = frozenset(retry_status)
+        self.burst = burst
+        self.max_retries = max_retries
+        self.dedup_window = dedup_window
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.buckets: Dict[str, TokenBucket] = {}
+        # 直播间 -> 待执行的操作，队首是正在执行或等待执行的
+        self._rooms: Dict[str, deque] = {}
+        # 可以尝试执行队首操作的直播间：(时间, 序号, 直播间)
+        self._heap: List[Tuple[float, int, str]] = []
+        self._seq = itertools.count()
+        # 去重：key -> (过期时间, Future)
+        self._recent: 'OrderedDict[tuple, tuple]' = OrderedDict()
+        self._cond = threading.Condition()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ActionQueue')
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        # 统计
+        self.submitted = 0
+        self.executed = 0
+        self.deduplicated = 0
+        self.retried = 0
+        self.failed = 0
+        self.throttled = 0
+
+    def _bucket(self, account: str) -> TokenBucket:
+        bucket = self.buckets.get(account)
+        if bucket is None:
+            bucket = self.buckets[account] = TokenBucket(self.rate, self.burst)
+        return bucket
+
+    # 提交任意 Tool 方法；room 默认取 tool.liveRoomId，account 默认取 tool 的 cookie
+    def submit(self, tool, method: str, *args, room: Optional[str] = None, account: Optional[str] = None,
+               dedupe: bool = True) -> Future:
+        if room is None:
+            room = tool.liveRoomId or tool.liveUrl
+        if account is None:
+            account = tool.headers.get('cookie') or str(id(tool))
+        key = (account, method, args)
+        now = time.monotonic()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('ActionQueue 已关闭')
+            if dedupe:
+                while self._recent and next(iter(self._recent.values()))[0] < now:
+                    self._recent.popitem(last=False)
+                recent = self._recent.get(key)
+                if recent is not None and not _failed(recent[1]):
+                    self.deduplicated += 1
+                    return recent[1]
+            action = Action(tool, method, args, room, account, key,
+                            Backoff(base=self.retry_base, max_delay=self.retry_max))
+            if dedupe:
+                self._recent[key] = (now + self.dedup_window, action.future)
+                self._recent.move_to_end(key)
+            self.submitted += 1
+            queue = self._rooms.get(room)
+            if queue is None:
+                queue = self._rooms[room] = deque()
+            queue.append(action)
+            if len(queue) == 1:
+                self._schedule(room, now)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='ActionQueueDispatcher', daemon=True)
+                self._thread.start()
+        return action.future
+
+    # 发弹幕，参数同 Tool.sendMsg
+    def sendMsg(self, tool, content: str, liveStreamId=None, color=None, **kwargs) -> Future:
+        kwargs.setdefault('room', liveStreamId)
+        return self.submit(tool, 'sendMsg', content, liveStreamId, color, **kwargs)
+
+    # 关注 / 取消关注，参数同 Tool.follow
+    def follow(self, tool, principalId=None, type=1, **kwargs) -> Future:
+        return self.submit(tool, 'follow', principalId, type, **kwargs)
+
+    # 在事件循环里等待结果：await queue.submitAsync(tool, 'sendMsg', ...)
+    def submitAsync(self, tool, method: str, *args, **kwargs) -> asyncio.Future:
+        return asyncio.wrap_future(self.submit(tool, method, *args, **kwargs))
+
+    # 调用方需持有锁
+    def _schedule(self, room: str, due: float):
+        heapq.heappush(self._heap, (due, next(self._seq), room))
+        self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed and not self._rooms:
+                        return
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    due, _, room = self._heap[0]
+                    now = time.monotonic()
+                    if due > now:
+                        self._cond.wait(due - now)
+                        continue
+                    heapq.heappop(self._heap)
+                    queue = self._rooms.get(room)
+                    if not queue:
+                        continue
+                    action = queue[0]
+                    wait = self._bucket(action.account).waitTime()
+                    if wait > 0 or not self.buckets[action.account].tryAcquire():
+                        # 账号额度用完，这个直播间晚点再试，其他直播间不受影响
+                        self.throttled += 1
+                        self._schedule(room, now + max(wait, 0.01))
+                        continue
+                    break
+            self._pool.submit(self._execute, action)
+
+    def _retryable(self, e: BaseException) -> bool:
+        if isinstance(e, requests.HTTPError):
+            return e.response is not None and e.response.status_code in self.retry_status
+        return _connectFailed(e)
+
+    def _execute(self, action: Action):
+        action.attempts += 1
+        try:
+            result = getattr(action.tool, action.method)(*action.args)
+        except TRANSIENT_ERRORS as e:
+            if self._retryable(e) and action.attempts <= self.max_retries:
+                self.retried += 1
+                delay = action.backoff.next()
+                logging.warning(f'[ActionQueue] [{action.method}失败，{delay:.1f}秒后第{action.attempts}次重试, '
+                                f'room = {action.room}, err = {e}]')
+                with self._cond:
+                    self._schedule(action.room, time.monotonic() + delay)
+                return
+            self._finish(action, exception=e)
+        except Exception as e:
+            self._finish(action, exception=e)
+        else:
+            self._finish(action, result=result)
+
+    def _finish(self, action: Action, result=None, exception: Optional[BaseException] = None):
+        with self._cond:
+            queue = self._rooms.get(action.room)
+            # close(wait=False) 已经清空了队列
+            if queue and queue[0] is action:
+                queue.popleft()
+                if queue:
+                    self._schedule(action.room, time.monotonic())
+                else:
+                    del self._rooms[action.room]
+                    self._cond.notify()
+            if exception is None:
+                self.executed += 1
+            else:
+                self.failed += 1
+        if action.future.cancelled():
+            return
+        if exception is not None:
+            logging.error(f'[ActionQueue] [{action.method}失败, room = {action.room}, err = {exception}]')
+            action.future.set_exception(exception)
+        else:
+            action.future.set_result(result)
+
+    # 不再接受新操作；wait 为 True 时等队列里的操作全部执行完
+    def close(self, wait: bool = True):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+            if not wait:
+                for queue in self._rooms.values():
+                    for action in queue:
+                        action.future.cancel()
+                self._rooms.clear()
+                self._heap.clear()
+        if self._thread is not None:
+            self._thread.join()
+        self._pool.shutdown(wait=wait)
+
+    def getStats(self) -> dict:
+        with self._cond:
+            pending = sum(len(queue) for queue in self._rooms.values())
+        return {'submitted': self.submitted, 'executed': self.executed, 'deduplicated': self.deduplicated,
+                'retried': self.retried, 'failed': self.failed, 'throttled': self.throttled, 'pending': pending,
+                'rooms': len(self._rooms), 'accounts': len(self.buckets)}
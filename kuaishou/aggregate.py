@@ -0,0 +1,329 @@
+import hashlib
+import math
+import re
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .ks_pb2 import PayloadType
+
+
+# 把 displayWatchingCount / displayLikeCount 这类展示文本转成数字：'1.2万' -> 12000，'3,456' -> 3456
+def parseDisplayCount(text: str) -> int:
+    if not text:
+        return 0
+    m = re.match(r'\s*([\d.,]+)\s*([万wW亿]?)', text)
+    if m is None:
+        return 0
+    try:
+        value = float(m.group(1).replace(',', ''))
+    except ValueError:
+        return 0
+    unit = m.group(2)
+    if unit in ('万', 'w', 'W'):
+        value *= 10000
+    elif unit == '亿':
+        value *= 100000000
+    return int(value)
+
+
+class SlidingCounter:
+    """滑动窗口计数：窗口切成固定个数的桶循环使用，内存和事件数量无关"""
+
+    __slots__ = ('window', 'width', '_counts', '_slots')
+
+    def __init__(self, window: float = 60.0, buckets: int = 60):
+        self.window = window
+        self.width = window / buckets
+        self._counts = [0] * buckets
+        # 每个桶当前对应的时间片编号，过期的桶在下次写入时清零
+        self._slots = [-1] * buckets
+
+    def add(self, value: float = 1, now: Optional[float] = None):
+        idx = int((time.time() if now is None else now) // self.width)
+        i = idx % len(self._counts)
+        if self._slots[i] != idx:
+            self._slots[i] = idx
+            self._counts[i] = 0
+        self._counts[i] += value
+
+    def total(self, now: Optional[float] = None) -> float:
+        idx = int((time.time() if now is None else now) // self.width)
+        low = idx - len(self._counts)
+        return sum(c for c, s in zip(self._counts, self._slots) if low < s <= idx)
+
+    # 每秒平均
+    def rate(self, now: Optional[float] = None) -> float:
+        return self.total(now) / self.window
+
+
+class SpaceSaving:
+    """Space-Saving 算法求 top-K：最多保留 capacity 个计数器，新 key 替换当前最小的计数器"""
+
+    __slots__ = ('capacity', '_counts')
+
+    def __init__(self, capacity: int = 100):
+        self.capacity = capacity
+        # key -> [计数, 误差上界]
+        self._counts: Dict[str, List[float]] = {}
+
+    def add(self, key: str, value: float = 1):
+        entry = self._counts.get(key)
+        if entry is not None:
+            entry[0] += value
+        elif len(self._counts) < self.capacity:
+            self._counts[key] = [value, 0]
+        else:
+            victim = min(self._counts, key=lambda k: self._counts[k][0])
+            floor = self._counts.pop(victim)[0]
+            self._counts[key] = [floor + value, floor]
+
+    # 返回 [(key, 计数, 误差上界)]，按计数从大到小
+    def top(self, k: int = 10) -> List[Tuple[str, float, float]]:
+        items = sorted(self._counts.items(), key=lambda item: item[1][0], reverse=True)[:k]
+        return [(key, count, error) for key, (count, error) in items]
+
+    def __len__(self):
+        return len(self._counts)
+
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+class HyperLogLog:
+    """HyperLogLog 基数估计：2^precision 个寄存器（precision=12 时 4KB，标准误差约 1.6%）；
+    哈希与进程无关，不同进程的结果可以 merge"""
+
+    __slots__ = ('precision', 'm', '_registers')
+
+    def __init__(self, precision: int = 12):
+        self.precision = precision
+        self.m = 1 << precision
+        self._registers = bytearray(self.m)
+
+    def add(self, value: str):
+        h = _hash64(value)
+        i = h >> (64 - self.precision)
+        rest = h & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self._registers[i]:
+            self._registers[i] = rank
+
+    def merge(self, other: 'HyperLogLog'):
+        if other.precision != self.precision:
+            raise ValueError('HyperLogLog precision 不一致')
+        regs = self._registers
+        for i, r in enumerate(other._registers):
+            if r > regs[i]:
+                regs[i] = r
+
+    def count(self) -> int:
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self._registers)
+        zeros = self._registers.count(0)
+        # 小基数时改用线性计数
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+
+class RoomAggregator:
+    """单个直播间的增量统计：滑动窗口速率、按固定窗口切分的汇总、top-K 送礼用户、去重观众数
+
+    只保留计数器，不保存原始事件，每个房间内存固定。
+    gift_price：gift_id -> 单价（快币），不设置时礼物价值记为 0，送礼榜按礼物个数排序。
+    """
+
+    def __init__(self, room_id: str, window: float = 60.0, tumbling: float = 60.0, history: int = 60,
+                 top_k: int = 10, gift_price: Optional[Callable[[int], float]] = None, hll_precision: int = 12,
+                 on_window: Optional[Callable[[str, dict], None]] = None):
+        self.room_id = room_id
+        self.top_k = top_k
+        self.gift_price = gift_price
+        self.on_window = on_window
+        self.tumbling = tumbling
+        self._lock = threading.Lock()
+        # 滑动窗口
+        self.comments = SlidingCounter(window)
+        self.likes = SlidingCounter(window)
+        self.gifts = SlidingCounter(window)
+        self.gift_value = SlidingCounter(window)
+        # 累计
+        self.total_comments = 0
+        self.total_likes = 0
+        self.total_gifts = 0
+        self.total_gift_value = 0.0
+        self.watching_count = 0
+        self.max_watching_count = 0
+        self.like_count = 0
+        self.gifters = SpaceSaving(top_k * 10)
+        self.viewers = HyperLogLog(hll_precision)
+        # 固定窗口：当前窗口的起始时间和计数，结束的窗口放进 history
+        self.history: deque = deque(maxlen=history)
+        self._windowStart = self._windowOf(time.time())
+        self._window = self._emptyWindow()
+
+    def _windowOf(self, now: float) -> float:
+        return now - now % self.tumbling
+
+    @staticmethod
+    def _emptyWindow() -> dict:
+        return {'comments': 0, 'likes': 0, 'gifts': 0, 'gift_value': 0.0, 'max_watching_count': 0}
+
+    def _roll(self, now: float):
+        start = self._windowOf(now)
+        if start == self._windowStart:
+            return
+        closed = dict(self._window, room_id=self.room_id, start=self._windowStart,
+                      end=self._windowStart + self.tumbling)
+        self.history.append(closed)
+        self._windowStart = start
+        self._window = self._emptyWindow()
+        if self.on_window is not None:
+            self.on_window(self.room_id, closed)
+
+    # 一个 SCWebFeedPush（或 FeedPushView）
+    def addFeedPush(self, push, now: Optional[float] = None):
+        # FeedCoalescer 合并过的推送：一条点赞代表 counts 里的多次
+        counts = getattr(push, 'counts', None)
+        push = getattr(push, 'message', push)
+        if now is None:
+            now = time.time()
+        with self._lock:
+            self._roll(now)
+            window = self._window
+            viewers = self.viewers
+            if push.displayWatchingCount:
+                self.watching_count = parseDisplayCount(push.displayWatchingCount)
+                self.max_watching_count = max(self.max_watching_count, self.watching_count)
+                window['max_watching_count'] = max(window['max_watching_count'], self.watching_count)
+            if push.displayLikeCount:
+                self.like_count = parseDisplayCount(push.displayLikeCount)
+
+            n = len(push.commentFeeds)
+            if n:
+                self.comments.add(n, now)
+                self.total_comments += n
+                window['comments'] += n
+                for feed in push.commentFeeds:
+                    viewers.add(feed.user.principalId)
+            n = len(push.likeFeeds)
+            if n:
+                if counts and 'likeFeeds' in counts:
+                    n = sum(counts['likeFeeds'])
+                self.likes.add(n, now)
+                self.total_likes += n
+                window['likes'] += n
+                for feed in push.likeFeeds:
+                    viewers.add(feed.user.principalId)
+            if push.giftFeeds:
+                price = self.gift_price
+                gifts = value = 0
+                for feed in push.giftFeeds:
+                    count = max(feed.batchSize, 1)
+                    worth = price(feed.giftId) * count if price is not None else 0
+                    gifts += count
+                    value += worth
+                    user_id = feed.user.principalId
+                    viewers.add(user_id)
+                    self.gifters.add(user_id, worth if price is not None else count)
+                self.gifts.add(gifts, now)
+                self.gift_value.add(value, now)
+                self.total_gifts += gifts
+                self.total_gift_value += value
+                window['gifts'] += gifts
+                window['gift_value'] += value
+            for feed in push.shareFeeds:
+                viewers.add(feed.user.principalId)
+
+    # SCWebLiveWatchingUsers：在线观众列表
+    def addWatchingUsers(self, message, now: Optional[float] = None):
+        message = getattr(message, 'message', message)
+        with self._lock:
+            self._roll(time.time() if now is None else now)
+            for info in message.watchingUser:
+                self.viewers.add(info.user.principalId)
+            if message.displayWatchingCount:
+                self.watching_count = parseDisplayCount(message.displayWatchingCount)
+                self.max_watching_count = max(self.max_watching_count, self.watching_count)
+
+    def snapshot(self, now: Optional[float] = None) -> dict:
+        if now is None:
+            now = time.time()
+        with self._lock:
+            self._roll(now)
+            return {
+                'room_id': self.room_id,
+                'comments_per_sec': self.comments.rate(now),
+                'likes_per_sec': self.likes.rate(now),
+                'gifts_in_window': self.gifts.total(now),
+                'gift_value_in_window': self.gift_value.total(now),
+                'total_comments': self.total_comments,
+                'total_likes': self.total_likes,
+                'total_gifts': self.total_gifts,
+                'total_gift_value': self.total_gift_value,
+                'watching_count': self.watching_count,
+                'max_watching_count': self.max_watching_count,
+                'like_count': self.like_count,
+                'distinct_viewers': self.viewers.count(),
+                'top_gifters': [{'user_id': key, 'score': count, 'error': error}
+                                for key, count, error in self.gifters.top(self.top_k)],
+                'current_window': dict(self._window, start=self._windowStart),
+            }
+
+
+class AggregationEngine:
+    """多个直播间的统计，按直播地址分别维护 RoomAggregator
+
+    没有指定 gift_price 时，attach 的直播间用该 Tool 的礼物目录（tool.gift_catalogue.price）计算礼物价值。
+    """
+
+    def __init__(self, **room_kwargs):
+        self.room_kwargs = room_kwargs
+        self.rooms: Dict[str, RoomAggregator] = {}
+        self._lock = threading.Lock()
+        self._callbacks = {}
+
+    # gift_price 只在新建 RoomAggregator 且构造时没有指定 gift_price 时使用
+    def room(self, room_id: str, gift_price: Optional[Callable[[int], float]] = None) -> RoomAggregator:
+        aggregator = self.rooms.get(room_id)
+        if aggregator is None:
+            with self._lock:
+                aggregator = self.rooms.get(room_id)
+                if aggregator is None:
+                    kwargs = self.room_kwargs
+                    if gift_price is not None and kwargs.get('gift_price') is None:
+                        kwargs = dict(kwargs, gift_price=gift_price)
+                    aggregator = self.rooms[room_id] = RoomAggregator(room_id, **kwargs)
+        return aggregator
+
+    def removeRoom(self, room_id: str):
+        with self._lock:
+            self.rooms.pop(room_id, None)
+
+    # 订阅 Tool 的弹幕推送和在线观众列表，在收包线程里直接累加计数；
+    # 按直播地址区分房间，和 FeedDedup、PresenceTracker 一致，重新开播后继续累计
+    def attach(self, tool):
+        price = tool.gift_catalogue.price
+
+        def onFeedPush(view):
+            self.room(tool.liveUrl, price).addFeedPush(view)
+
+        def onWatchingUsers(view):
+            self.room(tool.liveUrl, price).addWatchingUsers(view)
+
+        self._callbacks[id(tool)] = (onFeedPush, onWatchingUsers)
+        tool.dispatcher.subscribe(PayloadType.SC_FEED_PUSH, onFeedPush, inline=True)
+        tool.dispatcher.subscribe(PayloadType.SC_LIVE_WATCHING_LIST, onWatchingUsers, inline=True)
+
+    def detach(self, tool):
+        callbacks = self._callbacks.pop(id(tool), None)
+        if callbacks is not None:
+            tool.dispatcher.unsubscribe(PayloadType.SC_FEED_PUSH, callbacks[0])
+            tool.dispatcher.unsubscribe(PayloadType.SC_LIVE_WATCHING_LIST, callbacks[1])
+
+    def snapshot(self, now: Optional[float] = None) -> Dict[str, dict]:
+        return {room_id: aggregator.snapshot(now) for room_id, aggregator in list(self.rooms.items())}
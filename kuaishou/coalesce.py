@@ -0,0 +1,243 @@
+import asyncio
+import functools
+import logging
+import threading
+import time
+from typing import Dict, Optional
+
+from .ks_pb2 import PayloadType
+from .ks_pb2 import SCWebFeedPush
+from .views import FEED_KINDS
+from .views import CoalescedFeedPushView
+
+_FIELDS = tuple(field for field, _ in FEED_KINDS.values())
+
+# 还没收到过推送，不知道 Tool 跑在哪个事件循环上
+_UNKNOWN = object()
+
+
+def _runningLoop() -> Optional[asyncio.AbstractEventLoop]:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+class RoomCoalescer:
+    """单个直播间的点赞 / 连击弹幕合并：window 秒内按用户合并点赞、按内容合并连击弹幕
+
+    弹幕、礼物等其余 feed 原样放行，不增加延迟；只剩点赞和连击弹幕的推送直接丢弃。
+    窗口结束时 flush 成一个 CoalescedFeedPushView，带上最新的在线人数 / 点赞数，各条 count 之和等于原始 feed 条数。
+    """
+
+    def __init__(self, room_id: str, window: float = 1.0, max_keys: int = 10000, likes: bool = True,
+                 combo_comments: bool = True):
+        self.room_id = room_id
+        self.window = window
+        self.max_keys = max_keys
+        self.likes = likes
+        self.combo_comments = combo_comments
+        # principalId -> [WebLikeFeed, 次数]
+        self._likes: Dict[str, list] = {}
+        # 内容 -> [WebComboCommentFeed, 条数]，comboCount 取窗口内最大的
+        self._combos: Dict[str, list] = {}
+        self._start = 0.0
+        self._watching = ''
+        self._likeCount = ''
+        self._pendingLikeCount = 0
+        self._lock = threading.Lock()
+        # 统计
+        self.received = 0
+        self.emitted = 0
+        self.dropped_pushes = 0
+        self.flushes = 0
+
+    # 合并推送里的点赞 / 连击弹幕并从推送中删掉；返回 False 表示推送里已经没有别的 feed，可以丢弃
+    def add(self, push, now: Optional[float] = None) -> bool:
+        push = getattr(push, 'message', push)
+        if now is None:
+            now = time.time()
+        merged = 0
+        with self._lock:
+            if not self._likes and not self._combos:
+                self._start = now
+            if self.likes and push.likeFeeds:
+                likes = self._likes
+                for feed in push.likeFeeds:
+                    principalId = feed.user.principalId
+                    entry = likes.get(principalId)
+                    if entry is None:
+                        # 从推送里删掉之后 feed 仍然有效，不用复制
+                        likes[principalId] = [feed, 1]
+                    else:
+                        entry[1] += 1
+                merged += len(push.likeFeeds)
+                del push.likeFeeds[:]
+            if self.combo_comments and push.comboCommentFeed:
+                combos = self._combos
+                for feed in push.comboCommentFeed:
+                    entry = combos.get(feed.content)
+                    if entry is None:
+                        combos[feed.content] = [feed, 1]
+                    else:
+                        entry[1] += 1
+                        if feed.comboCount > entry[0].comboCount:
+                            entry[0].comboCount = feed.comboCount
+                merged += len(push.comboCommentFeed)
+                del push.comboCommentFeed[:]
+            if not merged:
+                return True
+            self.received += merged
+            if push.displayWatchingCount:
+                self._watching = push.displayWatchingCount
+            if push.displayLikeCount:
+                self._likeCount = push.displayLikeCount
+            if push.pendingLikeCount:
+                self._pendingLikeCount = push.pendingLikeCount
+            keep = any(getattr(push, field) for field in _FIELDS)
+            if not keep:
+                self.dropped_pushes += 1
+            return keep
+
+    # 窗口到期或者合并的 key 太多，需要 flush
+    def due(self, now: Optional[float] = None) -> bool:
+        if not self._likes and not self._combos:
+            return False
+        if len(self._likes) + len(self._combos) >= self.max_keys:
+            return True
+        return (time.time() if now is None else now) - self._start >= self.window
+
+    # 取出当前窗口的合并结果；没有内容时返回 None
+    def flush(self, now: Optional[float] = None) -> Optional[CoalescedFeedPushView]:
+        if now is None:
+            now = time.time()
+        with self._lock:
+            if not self._likes and not self._combos:
+                return None
+            likes, self._likes = self._likes, {}
+            combos, self._combos = self._combos, {}
+            push = SCWebFeedPush(displayWatchingCount=self._watching, displayLikeCount=self._likeCount,
+                                 pendingLikeCount=self._pendingLikeCount)
+            counts = {}
+            if likes:
+                push.likeFeeds.extend(feed for feed, _ in likes.values())
+                counts['likeFeeds'] = [count for _, count in likes.values()]
+            if combos:
+                push.comboCommentFeed.extend(feed for feed, _ in combos.values())
+                counts['comboCommentFeed'] = [count for _, count in combos.values()]
+            self.emitted += len(likes) + len(combos)
+            self.flushes += 1
+            return CoalescedFeedPushView(push, counts, self._start, now)
+
+    def getStats(self) -> dict:
+        return {'received': self.received, 'emitted': self.emitted, 'dropped_pushes': self.dropped_pushes,
+                'flushes': self.flushes, 'pending': len(self._likes) + len(self._combos),
+                'ratio': self.received / self.emitted if self.emitted else 0.0}
+
+
+class FeedCoalescer:
+    """多个直播间的点赞 / 连击弹幕合并：attach 后作为 Dispatcher 的过滤器运行，
+    后台线程每隔一小段时间把到期的窗口作为 CoalescedFeedPushView 分发给原来的订阅者
+
+    和 FeedDedup 一起用时先 attach FeedDedup，重复的 feed 不会被计数。
+    """
+
+    def __init__(self, window: float = 1.0, max_keys: int = 10000, likes: bool = True, combo_comments: bool = True):
+        self.window = window
+        self.room_kwargs = {'window': window, 'max_keys': max_keys, 'likes': likes,
+                            'combo_comments': combo_comments}
+        self.rooms: Dict[str, RoomCoalescer] = {}
+        self._lock = threading.Lock()
+        # id(tool) -> [tool, 过滤器, 收包所在的事件循环]；事件循环在第一次收到推送时记下，线程版 Tool 为 None
+        self._tools = {}
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def room(self, room_id: str) -> RoomCoalescer:
+        coalescer = self.rooms.get(room_id)
+        if coalescer is None:
+            with self._lock:
+                coalescer = self.rooms.get(room_id)
+                if coalescer is None:
+                    coalescer = self.rooms[room_id] = RoomCoalescer(room_id, **self.room_kwargs)
+        return coalescer
+
+    def removeRoom(self, room_id: str):
+        with self._lock:
+            self.rooms.pop(room_id, None)
+
+    # 按直播地址区分房间，和 FeedDedup 一致
+    def attach(self, tool):
+        entry = [tool, None, _UNKNOWN]
+
+        def onFeedPush(view):
+            if entry[2] is _UNKNOWN:
+                entry[2] = _runningLoop()
+            coalescer = self.room(tool.liveUrl)
+            keep = coalescer.add(view)
+            if coalescer.due():
+                self._flush(tool, coalescer)
+            return view if keep else None
+
+        entry[1] = onFeedPush
+        with self._lock:
+            self._tools[id(tool)] = entry
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name='FeedCoalescer', daemon=True)
+                self._thread.start()
+        tool.dispatcher.addFilter(PayloadType.SC_FEED_PUSH, onFeedPush)
+
+    # 取消过滤，剩下的合并结果立即分发
+    def detach(self, tool):
+        with self._lock:
+            entry = self._tools.pop(id(tool), None)
+        if entry is None:
+            return
+        tool.dispatcher.removeFilter(PayloadType.SC_FEED_PUSH, entry[1])
+        coalescer = self.rooms.get(tool.liveUrl)
+        if coalescer is not None:
+            self._flush(tool, coalescer, loop=entry[2])
+
+    # loop 为收包所在的事件循环：不在该循环的线程里时交回循环分发，订阅者（包括 async 回调）不会在定时线程里执行
+    def _flush(self, tool, coalescer: RoomCoalescer, now: Optional[float] = None, loop=None):
+        view = coalescer.flush(now)
+        if view is None:
+            return
+        # 原始 feed 已经过了前面的过滤器，合并结果不再过滤
+        publish = functools.partial(tool.dispatcher.publish, PayloadType.SC_FEED_PUSH, view, skip_filters=True)
+        if loop is not _UNKNOWN and loop is not None and loop.is_running() and _runningLoop() is not loop:
+            loop.call_soon_threadsafe(publish)
+        else:
+            publish()
+
+    def _run(self):
+        interval = max(self.window / 4, 0.01)
+        while not self._stop.wait(interval):
+            now = time.time()
+            for tool, _, loop in list(self._tools.values()):
+                coalescer = self.rooms.get(tool.liveUrl)
+                if coalescer is None or not coalescer.due(now):
+                    continue
+                try:
+                    self._flush(tool, coalescer, now, loop)
+                except Exception as e:
+                    logging.exception(f'[FeedCoalescer] [分发合并结果异常, room = {coalescer.room_id}, err = {e}]')
+
+    # 停止后台线程，并分发所有剩下的合并结果
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for tool, _, loop in list(self._tools.values()):
+            coalescer = self.rooms.get(tool.liveUrl)
+            if coalescer is not None:
+                self._flush(tool, coalescer, loop=loop)
+
+    def getStats(self) -> dict:
+        rooms = {room_id: coalescer.getStats() for room_id, coalescer in list(self.rooms.items())}
+        received = sum(r['received'] for r in rooms.values())
+        emitted = sum(r['emitted'] for r in rooms.values())
+        return {'rooms': rooms, 'received': received, 'emitted': emitted,
+                'ratio': received / emitted if emitted else 0.0}
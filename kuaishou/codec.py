@@ -0,0 +1,75 @@
+import logging
+import zlib
+from typing import Dict, Optional
+
+from .ks_pb2 import CompressionType
+from .ks_pb2 import SocketMessage
+from .dispatch import payloadTypeName
+
+# 32 + MAX_WBITS：自动识别 gzip / zlib 头
+_WBITS = 32 + zlib.MAX_WBITS
+
+
+class PayloadStats:
+    """某个 PayloadType 的收包统计"""
+
+    __slots__ = ('frames', 'compressed_frames', 'compressed_bytes', 'uncompressed_bytes')
+
+    def __init__(self):
+        self.frames = 0
+        self.compressed_frames = 0
+        # 线上收到的字节数（未压缩的帧两者相同）
+        self.compressed_bytes = 0
+        self.uncompressed_bytes = 0
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class PayloadDecompressor:
+    """SocketMessage 负载解压；按 PayloadType 记住解压后的平均大小，
+    下次直接按这个大小分配输出缓冲区，避免 zlib 反复扩容"""
+
+    def __init__(self):
+        self.stats: Dict[int, PayloadStats] = {}
+        # payloadType -> 解压后/压缩前 的大小比例（滑动平均）
+        self._ratios: Dict[int, float] = {}
+
+    def _stat(self, payloadType: int) -> PayloadStats:
+        stat = self.stats.get(payloadType)
+        if stat is None:
+            stat = self.stats[payloadType] = PayloadStats()
+        return stat
+
+    # 返回解压后的负载，无法解压时返回 None
+    def decompress(self, wssPackage: SocketMessage) -> Optional[bytes]:
+        payload = wssPackage.payload
+        payloadType = wssPackage.payloadType
+        stat = self._stat(payloadType)
+        stat.frames += 1
+        size = len(payload)
+        stat.compressed_bytes += size
+
+        compressionType = wssPackage.compressionType
+        if compressionType == CompressionType.GZIP:
+            ratio = self._ratios.get(payloadType, 4.0)
+            try:
+                # 多留 1/4 余量，尽量一次分配到位
+                payload = zlib.decompress(payload, _WBITS, max(int(size * ratio * 1.25), 256))
+            except zlib.error as e:
+                logging.error(f'[PayloadDecompressor] [gzip解压失败, payloadType = {payloadType}, err = {e}]')
+                return None
+            self._ratios[payloadType] = ratio * 0.8 + len(payload) / max(size, 1) * 0.2
+            stat.compressed_frames += 1
+        elif compressionType == CompressionType.AES:
+            logging.debug(f'[PayloadDecompressor] [AES加密的数据包暂不支持⚠️] [payloadType = {payloadType}]')
+            return None
+        stat.uncompressed_bytes += len(payload)
+        return payload
+
+    # 以 PayloadType 名称为 key 的统计信息
+    def getStats(self) -> dict:
+        ret = {}
+        for payloadType, stat in self.stats.items():
+            ret[payloadTypeName(payloadType)] = stat.to_dict()
+        return ret
@@ -0,0 +1,218 @@
+import abc
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+LIVE_HOME = 'https://live.kuaishou.com/'
+
+
+# 启动无头浏览器打开直播页，收集 cookie 字符串
+def harvestCookie(url: str, chrome_bin_path: str, chrome_driver_path: str, runtime_dir: str,
+                  proxy_host: Optional[str] = None, proxy_port: Optional[str] = None) -> str:
+    from .KsLive import Tool
+
+    user_data_dir = os.path.join(runtime_dir, "chrome_user_data_dir")
+    if not os.path.exists(user_data_dir):
+        os.makedirs(user_data_dir, mode=0o755, exist_ok=True)
+    browser = Tool.get_browser(chrome_bin_path, chrome_driver_path, user_data_dir, proxy_host, proxy_port)
+    try:
+        browser.get(url)
+        browser.implicitly_wait(50)
+        cookie_list = browser.get_cookies()
+    finally:
+        browser.quit()
+    return "; ".join(f"{cookie_dict['name']}={cookie_dict['value']}" for cookie_dict in cookie_list)
+
+
+class CookieProvider(abc.ABC):
+    """cookie 提供者；多个 Tool/直播间可以共用同一个"""
+
+    # 返回当前可用的 cookie
+    @abc.abstractmethod
+    def get(self) -> str:
+        ...
+
+    # 标记 cookie 不可用（遇到 CookieNotUseful 时调用），返回是否还有机会拿到新的 cookie
+    def invalidate(self, cookie: str) -> bool:
+        return False
+
+
+class StaticCookieProvider(CookieProvider):
+    """固定 cookie，不会刷新"""
+
+    def __init__(self, cookie: str):
+        self.cookie = cookie
+
+    def get(self) -> str:
+        return self.cookie
+
+
+class BrowserCookieProvider(CookieProvider):
+    """用无头浏览器获取 cookie，缓存到磁盘并在过期前后台刷新
+
+    同一个实例只会同时启动一个浏览器，进程重启后优先读磁盘缓存。
+    """
+
+    def __init__(self, chrome_bin_path: str, chrome_driver_path: str, runtime_dir: str,
+                 proxy_host: Optional[str] = None, proxy_port: Optional[str] = None, url: str = LIVE_HOME,
+                 ttl: float = 6 * 3600, refresh_ahead: float = 600, cache_path: Optional[str] = None):
+        self.chrome_bin_path = chrome_bin_path
+        self.chrome_driver_path = chrome_driver_path
+        self.runtime_dir = runtime_dir
+        self.proxy_host = proxy_host
+        self.proxy_port = proxy_port
+        self.url = url
+        self.ttl = ttl
+        # 提前多久在后台刷新
+        self.refresh_ahead = refresh_ahead
+        self.cache_path = cache_path or os.path.join(runtime_dir, 'cookie_cache.json')
+        self._lock = threading.Lock()
+        self._cookie: Optional[str] = None
+        self._expires_at = 0.0
+        self._timer: Optional[threading.Timer] = None
+        # 统计
+        self.harvests = 0
+
+    def _valid(self) -> bool:
+        return self._cookie is not None and time.time() < self._expires_at
+
+    def _load(self):
+        try:
+            with open(self.cache_path, 'r') as fh:
+                data = json.load(fh)
+        except (OSError, ValueError):
+            return
+        if data.get('cookie') and time.time() < data.get('expires_at', 0):
+            self._cookie = data['cookie']
+            self._expires_at = data['expires_at']
+            logging.info(f'[BrowserCookieProvider] [使用磁盘缓存的cookie, path = {self.cache_path}]')
+
+    def _save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)), exist_ok=True)
+        tmp = self.cache_path + '.tmp'
+        # 登录态 cookie 只允许自己读写；先删掉上次残留的临时文件，O_CREAT 的权限只对新文件生效
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:
+            pass
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as fh:
+            json.dump({'cookie': self._cookie, 'expires_at': self._expires_at}, fh)
+        os.replace(tmp, self.cache_path)
+
+    def _harvest(self):
+        logging.info(f'[BrowserCookieProvider] [启动浏览器获取cookie, url = {self.url}]')
+        self._cookie = harvestCookie(self.url, self.chrome_bin_path, self.chrome_driver_path, self.runtime_dir,
+                                     self.proxy_host, self.proxy_port)
+        self._expires_at = time.time() + self.ttl
+        self.harvests += 1
+        self._save()
+
+    def _schedule(self):
+        if self._timer is not None:
+            self._timer.cancel()
+        delay = max(self._expires_at - time.time() - self.refresh_ahead, 60)
+        self._timer = threading.Timer(delay, self.refresh)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def get(self) -> str:
+        with self._lock:
+            if not self._valid():
+                self._load()
+            if not self._valid():
+                self._harvest()
+                self._schedule()
+            elif self._timer is None:
+                self._schedule()
+            return self._cookie
+
+    # 立即重新获取 cookie（后台定时器也调用这里）
+    def refresh(self) -> str:
+        with self._lock:
+            try:
+                self._harvest()
+            except Exception as e:
+                logging.error(f'[BrowserCookieProvider] [刷新cookie失败, err = {e}]')
+                if not self._valid():
+                    raise
+            self._schedule()
+            return self._cookie
+
+    def invalidate(self, cookie: str) -> bool:
+        with self._lock:
+            if cookie == self._cookie:
+                self._cookie = None
+                self._expires_at = 0.0
+                try:
+                    os.remove(self.cache_path)
+                except OSError:
+                    pass
+        return True
+
+    def close(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+
+class CookiePool(CookieProvider):
+    """多个 cookie（或 provider）轮换使用，失效的 cookie 冷却一段时间后再参与轮换"""
+
+    def __init__(self, members: Iterable[Union[str, CookieProvider]], cooldown: float = 600):
+        self.members: List[CookieProvider] = [
+            StaticCookieProvider(m) if isinstance(m, str) else m for m in members
+        ]
+        if not self.members:
+            raise ValueError('CookiePool 至少需要一个 cookie')
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._index = 0
+        # cookie -> 冷却结束时间
+        self._bad: Dict[str, float] = {}
+        # cookie -> 所属 provider
+        self._owner: Dict[str, CookieProvider] = {}
+
+    def get(self) -> str:
+        with self._lock:
+            now = time.time()
+            for _ in range(len(self.members)):
+                member = self.members[self._index % len(self.members)]
+                self._index += 1
+                cookie = member.get()
+                self._owner[cookie] = member
+                if self._bad.get(cookie, 0) <= now:
+                    self._bad.pop(cookie, None)
+                    return cookie
+            # 全部在冷却中：返回冷却最早结束的那个
+            cookie, _ = min(self._bad.items(), key=lambda item: item[1])
+            return cookie
+
+    def invalidate(self, cookie: str) -> bool:
+        with self._lock:
+            self._bad[cookie] = time.time() + self.cooldown
+            member = self._owner.get(cookie)
+        refreshable = False
+        if member is not None:
+            refreshable = member.invalidate(cookie)
+        return refreshable or len(self.members) > 1
+
+
+_shared_providers: Dict[Tuple, BrowserCookieProvider] = {}
+_shared_lock = threading.Lock()
+
+
+# 同一组浏览器配置在进程内共用一个 BrowserCookieProvider，N 个直播间只启动一次浏览器
+def getBrowserCookieProvider(chrome_bin_path: str, chrome_driver_path: str, runtime_dir: str,
+                             proxy_host: Optional[str] = None, proxy_port: Optional[str] = None,
+                             **kwargs) -> BrowserCookieProvider:
+    key = (chrome_bin_path, chrome_driver_path, os.path.abspath(runtime_dir), proxy_host, proxy_port)
+    with _shared_lock:
+        provider = _shared_providers.get(key)
+        if provider is None:
+            provider = _shared_providers[key] = BrowserCookieProvider(
+                chrome_bin_path, chrome_driver_path, runtime_dir, proxy_host, proxy_port, **kwargs)
+        return provider
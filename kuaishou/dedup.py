@@ -0,0 +1,150 @@
+import threading
+import time
+from collections import deque
+from typing import Dict, Iterable, Optional
+
+from .ks_pb2 import PayloadType
+from .views import FEED_KINDS
+
+DEFAULT_KINDS = tuple(FEED_KINDS)
+
+
+# 没有 id 的 feed 用 用户 + 时间 + 内容 作为身份；连击弹幕的 comboCount 会更新，也算进去
+def _fallbackKey(kind: str, feed) -> int:
+    if kind == 'combo_comment':
+        return hash((feed.id, feed.content, feed.comboCount))
+    return hash((feed.user.principalId, getattr(feed, 'time', 0) or feed.sortRank, getattr(feed, 'content', ''),
+                 getattr(feed, 'giftId', 0)))
+
+
+class FeedDeduplicator:
+    """单个直播间的 feed 去重：window 秒内见过的 feed 身份（整数哈希）记在集合里
+
+    身份按到达顺序放进队列，每个 SCWebFeedPush 记一个时间戳；过期或超过 max_keys 时从最旧的开始淘汰，内存有上限。
+    每条 feed 只做一次哈希和集合查找，没有重复时不修改消息。
+    """
+
+    def __init__(self, window: float = 300.0, max_keys: int = 100000, kinds: Iterable[str] = DEFAULT_KINDS):
+        kinds = set(kinds)
+        if not kinds <= set(FEED_KINDS):
+            raise ValueError(f'未知的 feed 类型: {kinds - set(FEED_KINDS)}, 可选 {list(FEED_KINDS)}')
+        self.window = window
+        self.max_keys = max_keys
+        # (字段名, feed 类型, 序号, 能否只按 id 判断)；序号加到哈希上区分不同类型的同名 id
+        self.fields = [(FEED_KINDS[kind][0], kind, i, kind != 'combo_comment')
+                       for i, kind in enumerate(FEED_KINDS) if kind in kinds]
+        self._keys = set()
+        self._order: deque = deque()
+        # [时间, 这一批加入的身份个数]
+        self._stamps: deque = deque()
+        self._lock = threading.Lock()
+        # 统计
+        self.seen = 0
+        self.suppressed: Dict[str, int] = {kind: 0 for _, kind, _, _ in self.fields}
+        self.evicted = 0
+
+    # 调用方需持有锁
+    def _evict(self, now: float):
+        order = self._order
+        keys = self._keys
+        stamps = self._stamps
+        expired = now - self.window
+        while stamps and stamps[0][0] < expired:
+            for _ in range(stamps.popleft()[1]):
+                keys.discard(order.popleft())
+                self.evicted += 1
+        while len(order) > self.max_keys:
+            keys.discard(order.popleft())
+            self.evicted += 1
+            stamps[0][1] -= 1
+            if not stamps[0][1]:
+                stamps.popleft()
+
+    # 从 SCWebFeedPush 里删掉已经见过的 feed，返回删掉的条数
+    def filterFeedPush(self, push, now: Optional[float] = None) -> int:
+        push = getattr(push, 'message', push)
+        if now is None:
+            now = time.monotonic()
+        removed = added = 0
+        with self._lock:
+            # 先淘汰过期的身份，安静一段时间后到达的推送不会和窗口外的 feed 比较
+            self._evict(now)
+            keys = self._keys
+            append = self._order.append
+            for field, kind, index, byId in self.fields:
+                feeds = getattr(push, field)
+                if not feeds:
+                    continue
+                duplicates = None
+                n = 0
+                for feed in feeds:
+                    fid = feed.id
+                    key = (hash(fid) if fid and byId else _fallbackKey(kind, feed)) + index
+                    if key in keys:
+                        if duplicates is None:
+                            duplicates = []
+                        duplicates.append(n)
+                    else:
+                        keys.add(key)
+                        append(key)
+                    n += 1
+                self.seen += n
+                if duplicates:
+                    for pos in reversed(duplicates):
+                        del feeds[pos]
+                    self.suppressed[kind] += len(duplicates)
+                    removed += len(duplicates)
+                    n -= len(duplicates)
+                added += n
+            if added:
+                self._stamps.append([now, added])
+            self._evict(now)
+        return removed
+
+    def getStats(self) -> dict:
+        return {'seen': self.seen, 'suppressed': dict(self.suppressed),
+                'suppressed_total': sum(self.suppressed.values()), 'keys': len(self._keys), 'evicted': self.evicted}
+
+
+class FeedDedup:
+    """多个直播间的 feed 去重：attach 后在 Dispatcher 分发之前删掉重复的 feed，
+    feed_push_callback、subscribeFeed 以及各种 sink 都只会收到一次"""
+
+    def __init__(self, window: float = 300.0, max_keys: int = 100000, kinds: Iterable[str] = DEFAULT_KINDS):
+        self.window = window
+        self.max_keys = max_keys
+        self.kinds = tuple(kinds)
+        self.rooms: Dict[str, FeedDeduplicator] = {}
+        self._lock = threading.Lock()
+        self._filters = {}
+
+    def room(self, room_id: str) -> FeedDeduplicator:
+        dedup = self.rooms.get(room_id)
+        if dedup is None:
+            with self._lock:
+                dedup = self.rooms.get(room_id)
+                if dedup is None:
+                    dedup = self.rooms[room_id] = FeedDeduplicator(self.window, self.max_keys, self.kinds)
+        return dedup
+
+    def removeRoom(self, room_id: str):
+        with self._lock:
+            self.rooms.pop(room_id, None)
+
+    # 按直播地址区分房间：断线重连、重新开播后仍然是同一个去重集合
+    def attach(self, tool):
+        def onFeedPush(view):
+            self.room(tool.liveUrl).filterFeedPush(view)
+            return view
+
+        self._filters[id(tool)] = onFeedPush
+        tool.dispatcher.addFilter(PayloadType.SC_FEED_PUSH, onFeedPush)
+
+    def detach(self, tool):
+        fn = self._filters.pop(id(tool), None)
+        if fn is not None:
+            tool.dispatcher.removeFilter(PayloadType.SC_FEED_PUSH, fn)
+
+    def getStats(self) -> dict:
+        rooms = {room_id: dedup.getStats() for room_id, dedup in list(self.rooms.items())}
+        return {'rooms': rooms, 'suppressed_total': sum(r['suppressed_total'] for r in rooms.values())}
@@ -0,0 +1,190 @@
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterable, Optional
+
+# 队列满时的处理策略
+BLOCK = 'block'
+DROP_OLDEST = 'drop_oldest'
+DROP_BY_TYPE = 'drop_by_type'
+
+# drop_by_type 时优先丢弃的消息类型（越靠前越先丢）
+DEFAULT_DROP_ORDER = ('like', 'combo_comment', 'share', 'SC_LIVE_WATCHING_LIST', 'system_notice')
+
+
+def _invoke(callback: Callable, data):
+    callback(data)
+
+
+class DeliveryQueue:
+    """websocket 收包线程和用户回调之间的有界队列 + 消费者线程池
+
+    收包线程只负责入队，回调在消费者线程（或进程池）里执行，慢回调不会阻塞收包和心跳。
+    队列按消息类型分桶存放，整体仍按入队顺序出队，drop_by_type 可以 O(1) 丢掉最不重要的类型。
+    """
+
+    def __init__(self, maxsize: int = 10000, workers: int = 4, policy: str = BLOCK,
+                 drop_order: Iterable[str] = DEFAULT_DROP_ORDER, use_processes: bool = False,
+                 block_timeout: Optional[float] = None):
+        if policy not in (BLOCK, DROP_OLDEST, DROP_BY_TYPE):
+            raise ValueError(f'未知的队列溢出策略: {policy}')
+        # maxsize 小于 1 时队列为空也放不下新消息：drop_oldest 没有可丢的消息，block 会一直等
+        if maxsize < 1:
+            raise ValueError(f'maxsize 必须大于 0: {maxsize}')
+        self.maxsize = maxsize
+        self.workers = workers
+        self.policy = policy
+        self.drop_order = tuple(drop_order)
+        self.use_processes = use_processes
+        # block 策略下最多等待多久，超时后丢弃新消息；None 表示一直等
+        self.block_timeout = block_timeout
+
+        self._buckets: Dict[str, deque] = {}
+        self._size = 0
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._notEmpty = threading.Condition(self._lock)
+        self._notFull = threading.Condition(self._lock)
+        self._threads = []
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._running = False
+
+        # 统计
+        self.enqueued = 0
+        self.delivered = 0
+        self.errors = 0
+        self.max_depth = 0
+        self.dropped: Dict[str, int] = {}
+
+    @property
+    def depth(self) -> int:
+        return self._size
+
+    def start(self):
+        with self._lock:
+            if self._running:
+                return self
+            self._running = True
+        if self.use_processes:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        for i in range(self.workers):
+            t = threading.Thread(target=self._work, name=f'ks-delivery-{i}', daemon=True)
+            t.start()
+            self._threads.append(t)
+        return self
+
+    # 停止消费者；drain 为 True 时先把队列里的消息处理完
+    def stop(self, drain: bool = True, timeout: Optional[float] = None):
+        with self._lock:
+            if not drain:
+                for kind, bucket in self._buckets.items():
+                    self._drop(kind, len(bucket))
+                    bucket.clear()
+                self._size = 0
+            self._running = False
+            self._notEmpty.notify_all()
+            self._notFull.notify_all()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+        if self._pool is not None:
+            self._pool.shutdown(wait=drain)
+            self._pool = None
+
+    def _drop(self, kind: str, n: int = 1):
+        self.dropped[kind] = self.dropped.get(kind, 0) + n
+
+    # 各类型桶的队首里取序号最小的，即全局最早入队的消息
+    def _popOldest(self):
+        bucket = None
+        oldest = None
+        for b in self._buckets.values():
+            if b and (oldest is None or b[0][0] < oldest):
+                bucket, oldest = b, b[0][0]
+        if bucket is None:
+            return None
+        self._size -= 1
+        return bucket.popleft()
+
+    # 为新消息腾出位置；返回 False 表示新消息本身被丢弃
+    def _makeRoom(self, kind: str) -> bool:
+        if self.policy == DROP_OLDEST:
+            item = self._popOldest()
+            self._drop(item[1])
+            return True
+        if self.policy == DROP_BY_TYPE:
+            for dropKind in self.drop_order:
+                bucket = self._buckets.get(dropKind)
+                if bucket:
+                    bucket.popleft()
+                    self._size -= 1
+                    self._drop(dropKind)
+                    return True
+            if kind in self.drop_order:
+                self._drop(kind)
+                return False
+        # block（以及 drop_by_type 下队列里全是不能丢的消息）：等消费者腾出位置
+        deadline = None if self.block_timeout is None else time.monotonic() + self.block_timeout
+        while self._size >= self.maxsize and self._running:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                self._drop(kind)
+                return False
+            self._notFull.wait(remaining)
+        return True
+
+    # 收包线程调用：入队一条待回调的消息；metrics 为该直播间的 RoomMetrics，回调耗时记到 kuaishou_callback_seconds
+    def put(self, kind: str, callback: Callable, data, metrics=None):
+        with self._lock:
+            if self._size >= self.maxsize and not self._makeRoom(kind):
+                return False
+            bucket = self._buckets.get(kind)
+            if bucket is None:
+                bucket = self._buckets[kind] = deque()
+            bucket.append((next(self._seq), kind, callback, data, metrics))
+            self._size += 1
+            self.enqueued += 1
+            if self._size > self.max_depth:
+                self.max_depth = self._size
+            self._notEmpty.notify()
+        return True
+
+    def _work(self):
+        while True:
+            with self._lock:
+                while self._size == 0 and self._running:
+                    self._notEmpty.wait()
+                if self._size == 0:
+                    return
+                _, kind, callback, data, metrics = self._popOldest()
+                self._notFull.notify()
+            start = time.perf_counter() if metrics is not None else 0
+            try:
+                if self._pool is not None:
+                    self._pool.submit(_invoke, callback, data).result()
+                else:
+                    callback(data)
+                ok = True
+            except Exception as e:
+                ok = False
+                logging.exception(f'[DeliveryQueue] [回调异常, kind = {kind}, err = {e}]')
+            if metrics is not None:
+                metrics.observeCallback(kind, time.perf_counter() - start)
+            with self._lock:
+                if ok:
+                    self.delivered += 1
+                else:
+                    self.errors += 1
+
+    def getStats(self) -> dict:
+        return {
+            'depth': self._size,
+            'max_depth': self.max_depth,
+            'enqueued': self.enqueued,
+            'delivered': self.delivered,
+            'errors': self.errors,
+            'dropped': dict(self.dropped),
+        }
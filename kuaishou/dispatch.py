@@ -0,0 +1,164 @@
+import logging
+import time
+from typing import Callable, Dict, List
+
+from .ks_pb2 import PayloadType
+from .ks_pb2 import SCHeartbeatAck
+from .ks_pb2 import SCWebEnterRoomAck
+from .ks_pb2 import SCWebFeedPush
+from .ks_pb2 import SCWebLiveWatchingUsers
+from .views import FEED_KINDS
+from .views import FeedPushView
+from .views import MessageView
+
+# 已知结构的数据包：PayloadType -> (protobuf 类, 视图类)
+DECODERS = {
+    PayloadType.SC_ENTER_ROOM_ACK: (SCWebEnterRoomAck, MessageView),
+    PayloadType.SC_HEARTBEAT_ACK: (SCHeartbeatAck, MessageView),
+    PayloadType.SC_FEED_PUSH: (SCWebFeedPush, FeedPushView),
+    PayloadType.SC_LIVE_WATCHING_LIST: (SCWebLiveWatchingUsers, MessageView),
+}
+
+
+def payloadTypeName(payloadType: int) -> str:
+    try:
+        return PayloadType.Name(payloadType)
+    except ValueError:
+        return str(payloadType)
+
+
+class FeedPushCallback:
+    """把 FeedPushView 按需转成 dict 再交给用户回调；可被 pickle，进程池消费者也能用"""
+
+    __slots__ = ('callback', 'lazy')
+
+    def __init__(self, callback: Callable, lazy: bool = False):
+        self.callback = callback
+        self.lazy = lazy
+
+    def __call__(self, data):
+        self.callback(data if self.lazy else data.to_dict())
+
+
+class Dispatcher:
+    """PayloadType -> 解码器 + 订阅者列表；没有订阅者的数据包不做 protobuf 解析"""
+
+    def __init__(self):
+        self.decoders = dict(DECODERS)
+        # 订阅列表写时复制，分发过程中增删订阅不影响正在遍历的列表
+        self._subscribers: Dict[int, List[Callable]] = {}
+        self._feedSubscribers: Dict[str, List[Callable]] = {}
+        # 分发前按顺序执行的过滤器：filter(data) 返回（可以是修改过的）data，返回 None 时丢弃
+        self._filters: Dict[int, List[Callable]] = {}
+        # 设置 DeliveryQueue 后回调在消费者线程里执行，收包线程只负责入队
+        self.delivery = None
+        # 不经过 DeliveryQueue、直接在收包线程里执行的回调（内部状态维护用）
+        self._inline = set()
+        # RoomMetrics：设置后记录解码和回调耗时
+        self.metrics = None
+
+    # 注册（或替换）某个 PayloadType 的解码器
+    def registerDecoder(self, payloadType: int, messageClass, viewClass=MessageView):
+        self.decoders[payloadType] = (messageClass, viewClass)
+
+    # 订阅某个 PayloadType，回调拿到对应的视图；没有解码器的类型拿到原始 bytes
+    def subscribe(self, payloadType: int, callback: Callable, inline: bool = False) -> Callable:
+        self._subscribers[payloadType] = self._subscribers.get(payloadType, []) + [callback]
+        if inline:
+            self._inline.add(callback)
+        return callback
+
+    def unsubscribe(self, payloadType: int, callback: Callable):
+        callbacks = [cb for cb in self._subscribers.get(payloadType, []) if cb != callback]
+        if callbacks:
+            self._subscribers[payloadType] = callbacks
+        else:
+            self._subscribers.pop(payloadType, None)
+        self._inline.discard(callback)
+
+    # 订阅 SCWebFeedPush 里的某一类 feed：comment/gift/like/share/system_notice/combo_comment
+    def subscribeFeed(self, kind: str, callback: Callable) -> Callable:
+        if kind not in FEED_KINDS:
+            raise ValueError(f'未知的 feed 类型: {kind}, 可选 {list(FEED_KINDS)}')
+        self._feedSubscribers[kind] = self._feedSubscribers.get(kind, []) + [callback]
+        return callback
+
+    def unsubscribeFeed(self, kind: str, callback: Callable):
+        callbacks = [cb for cb in self._feedSubscribers.get(kind, []) if cb != callback]
+        if callbacks:
+            self._feedSubscribers[kind] = callbacks
+        else:
+            self._feedSubscribers.pop(kind, None)
+
+    # 在分发给订阅者之前处理数据（去重、合并等），按添加顺序执行
+    def addFilter(self, payloadType: int, fn: Callable) -> Callable:
+        self._filters[payloadType] = self._filters.get(payloadType, []) + [fn]
+        return fn
+
+    def removeFilter(self, payloadType: int, fn: Callable):
+        filters = [f for f in self._filters.get(payloadType, []) if f != fn]
+        if filters:
+            self._filters[payloadType] = filters
+        else:
+            self._filters.pop(payloadType, None)
+
+    def hasSubscribers(self, payloadType: int) -> bool:
+        if payloadType in self._subscribers:
+            return True
+        return payloadType == PayloadType.SC_FEED_PUSH and bool(self._feedSubscribers)
+
+    # 解析负载；没有注册解码器的类型原样返回
+    def decode(self, payloadType: int, payload: bytes):
+        decoder = self.decoders.get(payloadType)
+        if decoder is None:
+            return payload
+        messageClass, viewClass = decoder
+        message = messageClass()
+        metrics = self.metrics
+        if metrics is None:
+            message.ParseFromString(payload)
+        else:
+            start = time.perf_counter()
+            message.ParseFromString(payload)
+            metrics.observeDecode(payloadType, time.perf_counter() - start)
+        return viewClass(message)
+
+    # 有订阅者时解析并分发，返回解析结果；没有订阅者返回 None
+    def dispatch(self, payloadType: int, payload: bytes):
+        if not self.hasSubscribers(payloadType):
+            return None
+        data = self.decode(payloadType, payload)
+        self.publish(payloadType, data)
+        return data
+
+    # 把已经解析好的数据分发给订阅者；skip_filters 为 True 时不再经过过滤器（过滤器自己产生的数据）
+    def publish(self, payloadType: int, data, skip_filters: bool = False):
+        filters = self._filters.get(payloadType)
+        if filters and not skip_filters:
+            for fn in filters:
+                data = fn(data)
+                if data is None:
+                    return
+        callbacks = self._subscribers.get(payloadType)
+        if callbacks:
+            kind = payloadTypeName(payloadType)
+            for callback in callbacks:
+                self._call(callback, data, kind)
+        if payloadType == PayloadType.SC_FEED_PUSH and self._feedSubscribers:
+            for kind, callbacks in self._feedSubscribers.items():
+                for feed in data.feeds(kind):
+                    for callback in callbacks:
+                        self._call(callback, feed, kind)
+
+    def _call(self, callback: Callable, data, kind: str):
+        if self.delivery is not None and callback not in self._inline:
+            self.delivery.put(kind, callback, data, self.metrics)
+            return
+        metrics = self.metrics
+        start = time.perf_counter() if metrics is not None else 0
+        try:
+            callback(data)
+        except Exception as e:
+            logging.exception(f'[Dispatcher] [订阅回调异常, callback = {callback}, err = {e}]')
+        if metrics is not None:
+            metrics.observeCallback(kind, time.perf_counter() - start)
@@ -0,0 +1,190 @@
+import json
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+
+class GiftInfo:
+    """礼物信息：id、名称、单价（快币）、图片地址"""
+
+    __slots__ = ('id', 'name', 'price', 'image')
+
+    def __init__(self, id: int, name: str = '', price: float = 0, image: str = ''):
+        self.id = id
+        self.name = name
+        self.price = price
+        self.image = image
+
+    def to_dict(self) -> dict:
+        return {'id': self.id, 'name': self.name, 'price': self.price, 'image': self.image}
+
+    def __repr__(self):
+        return f'GiftInfo({self.id}, {self.name!r}, price={self.price})'
+
+
+def _image(item: dict) -> str:
+    pic = item.get('picUrl') or item.get('giftUrl') or item.get('url') or ''
+    if isinstance(pic, list):
+        pic = pic[0] if pic else ''
+    if isinstance(pic, dict):
+        pic = pic.get('url', '')
+    return pic if isinstance(pic, str) else ''
+
+
+# 解析 emoji/allgifts（或 graphql allGifts）的返回，建立 礼物id -> GiftInfo 的索引
+def parseAllGifts(raw) -> Dict[int, GiftInfo]:
+    data = raw.get('data', raw) if isinstance(raw, dict) else raw
+    if isinstance(data, dict) and 'allGifts' in data:
+        data = data['allGifts']
+    if isinstance(data, dict):
+        items = data.items()
+    elif isinstance(data, list):
+        items = ((None, item) for item in data)
+    else:
+        return {}
+    index = {}
+    for key, item in items:
+        if not isinstance(item, dict):
+            continue
+        gift_id = item.get('id', item.get('giftId', key))
+        try:
+            gift_id = int(gift_id)
+        except (TypeError, ValueError):
+            continue
+        index[gift_id] = GiftInfo(gift_id, item.get('name') or item.get('giftName') or '',
+                                  item.get('unitPrice', item.get('price', 0)) or 0, _image(item))
+    return index
+
+
+class GiftCatalogue:
+    """礼物目录：进程内只加载一次，缓存到磁盘，过期后带 ETag / Last-Modified 重新校验
+
+    查询只读内存里的 dict，不会触发网络请求；过期后的刷新在后台线程进行，刷新期间继续使用旧数据。
+    """
+
+    def __init__(self, cache_path: Optional[str] = None, ttl: float = 24 * 3600):
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.index: Dict[int, GiftInfo] = {}
+        self.raw = None
+        self.etag: Optional[str] = None
+        self.last_modified: Optional[str] = None
+        self.fetched_at = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = False
+        # 统计
+        self.fetches = 0
+        self.not_modified = 0
+
+    @property
+    def loaded(self) -> bool:
+        return self.raw is not None
+
+    def fresh(self) -> bool:
+        return self.loaded and time.time() - self.fetched_at < self.ttl
+
+    def get(self, gift_id: int) -> Optional[GiftInfo]:
+        return self.index.get(gift_id)
+
+    # 礼物单价，未知礼物为 0；可以直接作为 RoomAggregator 的 gift_price
+    def price(self, gift_id: int) -> float:
+        info = self.index.get(gift_id)
+        return info.price if info is not None else 0
+
+    # 解析不出任何礼物时（比如 HTTP 200 的错误包体）抛出 ValueError，保留原来的索引和磁盘缓存
+    def _set(self, raw, etag: Optional[str], last_modified: Optional[str], fetched_at: float):
+        index = parseAllGifts(raw)
+        if not index:
+            raise ValueError(f'礼物目录为空: {str(raw)[:200]}')
+        self.index = index
+        self.raw = raw
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = fetched_at
+
+    def _loadDisk(self):
+        if not self.cache_path:
+            return
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as fh:
+                data = json.load(fh)
+            self._set(data.get('data'), data.get('etag'), data.get('last_modified'), data.get('fetched_at', 0))
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError, AttributeError) as e:
+            logging.warning(f'[GiftCatalogue] [磁盘缓存不可用, path = {self.cache_path}, err = {e}]')
+            return
+        logging.info(f'[GiftCatalogue] [读取磁盘缓存, path = {self.cache_path}, gifts = {len(self.index)}]')
+
+    def _saveDisk(self):
+        if not self.cache_path:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)), exist_ok=True)
+        tmp = self.cache_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as fh:
+            json.dump({'data': self.raw, 'etag': self.etag, 'last_modified': self.last_modified,
+                       'fetched_at': self.fetched_at}, fh, ensure_ascii=False)
+        os.replace(tmp, self.cache_path)
+
+    # fetch(headers) 发起请求并返回 requests.Response；headers 里带着条件请求头
+    def _revalidate(self, fetch: Callable):
+        headers = {}
+        if self.loaded and self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.loaded and self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        resp = fetch(headers)
+        self.fetches += 1
+        if resp.status_code == 304 and self.loaded:
+            self.not_modified += 1
+            self.fetched_at = time.time()
+        else:
+            resp.raise_for_status()
+            self._set(resp.json(), resp.headers.get('ETag'), resp.headers.get('Last-Modified'), time.time())
+            logging.info(f'[GiftCatalogue] [礼物目录已更新, gifts = {len(self.index)}]')
+        self._saveDisk()
+
+    # 保证目录可用：第一次先读磁盘，磁盘没有或者过期再请求；force 为 True 时强制重新校验
+    def ensure(self, fetch: Callable, force: bool = False) -> 'GiftCatalogue':
+        with self._lock:
+            if not self.loaded:
+                self._loadDisk()
+            if force or not self.fresh():
+                try:
+                    self._revalidate(fetch)
+                except Exception as e:
+                    if not self.loaded:
+                        raise
+                    logging.error(f'[GiftCatalogue] [刷新礼物目录失败，继续使用旧数据, err = {e}]')
+        return self
+
+    # 后台刷新，不阻塞调用方；已经是最新的或正在刷新时直接返回
+    def ensureInBackground(self, fetch: Callable):
+        if self.fresh() or self._refreshing:
+            return
+        self._refreshing = True
+
+        def run():
+            try:
+                self.ensure(fetch)
+            except Exception as e:
+                logging.error(f'[GiftCatalogue] [加载礼物目录失败, err = {e}]')
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, name='GiftCatalogue', daemon=True).start()
+
+
+_default_catalogue: Optional[GiftCatalogue] = None
+_default_lock = threading.Lock()
+
+
+# 进程内共享的礼物目录
+def getGiftCatalogue() -> GiftCatalogue:
+    global _default_catalogue
+    with _default_lock:
+        if _default_catalogue is None:
+            _default_catalogue = GiftCatalogue()
+        return _default_catalogue
@@ -0,0 +1,225 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from .ks_pb2 import CSWebHeartbeat
+from .ks_pb2 import PayloadType
+
+# Heartbeat.poll 的返回值
+IDLE = 0
+SEND = 1
+DEAD = 2
+
+
+class Heartbeat:
+    """单个连接的心跳状态：下次发送时间、应答往返耗时、连续丢失次数
+
+    发出心跳后 ack_timeout 秒内没有收到 SCHeartbeatAck 记一次丢失并立即补发，
+    连续丢失 max_missed 次认为连接已经失效。
+    """
+
+    # fixed 为 True 时不跟随进房应答里的 heartbeatIntervalMs
+    def __init__(self, interval: float, ack_timeout: Optional[float] = None, max_missed: int = 2, name: str = '',
+                 fixed: bool = False):
+        self.interval = interval
+        self.ack_timeout = ack_timeout
+        self.max_missed = max_missed
+        self.name = name
+        self.fixed = fixed
+        self.sent = 0
+        self.acked = 0
+        # 连续丢失次数 / 累计丢失次数
+        self.missed = 0
+        self.missed_total = 0
+        # 往返耗时（秒）：最近一次、滑动平均、最大
+        self.rtt: Optional[float] = None
+        self.rtt_avg: Optional[float] = None
+        self.rtt_max = 0.0
+        self.awaiting = False
+        self.cancelled = False
+        self._lock = threading.Lock()
+        self._base = time.monotonic()
+        self.due = self._base + interval
+        self._sentAt = 0.0
+        self._sentMs = 0
+        # 复用同一个 protobuf 对象，每次只改时间戳
+        self._msg = CSWebHeartbeat()
+        self._msg.payloadType = PayloadType.CS_HEARTBEAT
+        # 由 HeartbeatScheduler 设置
+        self._send: Optional[Callable[[bytes], None]] = None
+        self._onDead: Optional[Callable[[], None]] = None
+        self._gen = 0
+
+    def timeout(self) -> float:
+        return self.ack_timeout if self.ack_timeout is not None else min(self.interval, 10.0)
+
+    # 修改心跳间隔（进房应答下发），还没发出的心跳按新间隔重新计算时间
+    def setInterval(self, interval: float):
+        with self._lock:
+            self.interval = interval
+            if not self.awaiting:
+                self.due = self._base + interval
+
+    # 组一个心跳包并记为已发送
+    def packet(self) -> bytes:
+        with self._lock:
+            now = time.monotonic()
+            self._sentMs = int(time.time() * 1000)
+            self._msg.payload.timestamp = self._sentMs
+            self.sent += 1
+            self.awaiting = True
+            self._sentAt = self._base = now
+            self.due = now + self.timeout()
+            return self._msg.SerializeToString()
+
+    # 收到 SCHeartbeatAck；clientTimestamp 为应答里带回的发送时间戳；返回这次的往返耗时，旧应答返回 None
+    def onAck(self, clientTimestamp: int = 0) -> Optional[float]:
+        with self._lock:
+            self.acked += 1
+            self.missed = 0
+            if not self.awaiting or (clientTimestamp and clientTimestamp != self._sentMs):
+                # 补发之后才到的旧应答：连接还活着，但不计 RTT
+                return None
+            rtt = time.monotonic() - self._sentAt
+            self.rtt = rtt
+            self.rtt_avg = rtt if self.rtt_avg is None else self.rtt_avg * 0.8 + rtt * 0.2
+            self.rtt_max = max(self.rtt_max, rtt)
+            self.awaiting = False
+            self.due = self._sentAt + self.interval
+            return rtt
+
+    # 到期检查：返回 IDLE / SEND / DEAD
+    def poll(self, now: Optional[float] = None) -> int:
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            if self.cancelled or now < self.due:
+                return IDLE
+            if self.awaiting:
+                self.awaiting = False
+                self.missed += 1
+                self.missed_total += 1
+                if self.missed >= self.max_missed:
+                    return DEAD
+            return SEND
+
+    def to_dict(self) -> dict:
+        return {
+            'name': self.name,
+            'interval': self.interval,
+            'sent': self.sent,
+            'acked': self.acked,
+            'missed': self.missed,
+            'missed_total': self.missed_total,
+            'rtt': self.rtt,
+            'rtt_avg': self.rtt_avg,
+            'rtt_max': self.rtt_max,
+        }
+
+
+class HeartbeatScheduler:
+    """进程内共享的心跳调度器：一个线程 + 按到期时间排序的最小堆，服务所有连接
+
+    连接关闭时调用 cancel，不会再有线程残留；send 在调度线程里执行，应当是非阻塞的
+    （websocket-client 的 ws.send，或者把 aiohttp 的 send_bytes 投递回事件循环）。
+    """
+
+    def __init__(self):
+        self._heap: List[tuple] = []
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._thread: Optional[threading.Thread] = None
+        self.heartbeats: Dict[int, Heartbeat] = {}
+
+    # 注册一个连接的心跳；on_dead 在连续丢失应答时调用（一般是关闭连接触发重连）
+    def register(self, heartbeat: Heartbeat, send: Callable[[bytes], None],
+                 on_dead: Optional[Callable[[], None]] = None) -> Heartbeat:
+        heartbeat._send = send
+        heartbeat._onDead = on_dead
+        with self._cond:
+            self.heartbeats[id(heartbeat)] = heartbeat
+            self._push(heartbeat)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='HeartbeatScheduler', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return heartbeat
+
+    # 到期时间变了（修改了心跳间隔）时重新排队
+    def reschedule(self, heartbeat: Heartbeat):
+        with self._cond:
+            if not heartbeat.cancelled:
+                self._push(heartbeat)
+                self._cond.notify()
+
+    def cancel(self, heartbeat: Heartbeat):
+        with self._cond:
+            heartbeat.cancelled = True
+            heartbeat._gen += 1
+            self.heartbeats.pop(id(heartbeat), None)
+            # 堆里过期的条目太多时整理一次
+            if len(self._heap) > 64 and len(self._heap) > 2 * len(self.heartbeats):
+                self._heap = [e for e in self._heap if e[3] == e[2]._gen]
+                heapq.heapify(self._heap)
+
+    # 调用方需持有锁；旧的条目靠 _gen 失效
+    def _push(self, heartbeat: Heartbeat):
+        heartbeat._gen += 1
+        heapq.heappush(self._heap, (heartbeat.due, next(self._seq), heartbeat, heartbeat._gen))
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    due, _, heartbeat, gen = self._heap[0]
+                    if gen != heartbeat._gen:
+                        heapq.heappop(self._heap)
+                        continue
+                    now = time.monotonic()
+                    if due > now:
+                        self._cond.wait(due - now)
+                        continue
+                    heapq.heappop(self._heap)
+                    break
+            action = heartbeat.poll(now)
+            try:
+                if action == SEND:
+                    heartbeat._send(heartbeat.packet())
+                elif action == DEAD:
+                    self.cancel(heartbeat)
+                    logging.debug(f'[HeartbeatScheduler] [连续{heartbeat.missed}次心跳没有应答, '
+                                  f'name = {heartbeat.name}]')
+                    if heartbeat._onDead is not None:
+                        heartbeat._onDead()
+                    continue
+            except Exception as e:
+                # 连接已经断开
+                logging.debug(f'[HeartbeatScheduler] [发送心跳失败，停止心跳, name = {heartbeat.name}, err = {e}]')
+                self.cancel(heartbeat)
+                continue
+            self.reschedule(heartbeat)
+
+    # 所有连接的心跳统计
+    def getStats(self) -> List[dict]:
+        with self._cond:
+            heartbeats = list(self.heartbeats.values())
+        return [heartbeat.to_dict() for heartbeat in heartbeats]
+
+
+_default_scheduler: Optional[HeartbeatScheduler] = None
+_default_lock = threading.Lock()
+
+
+# 进程内默认共享的 HeartbeatScheduler
+def getHeartbeatScheduler() -> HeartbeatScheduler:
+    global _default_scheduler
+    with _default_lock:
+        if _default_scheduler is None:
+            _default_scheduler = HeartbeatScheduler()
+        return _default_scheduler
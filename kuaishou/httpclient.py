@@ -0,0 +1,147 @@
+import json
+import logging
+import threading
+from typing import TYPE_CHECKING, Optional, Tuple, Union
+
+# requests / aiohttp / asyncio 在第一次用到对应的客户端时才导入，只解析帧的进程不需要加载
+if TYPE_CHECKING:
+    import requests
+
+# 遇到这些状态码时重试
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+class HttpClient:
+    """进程内共享的 keep-alive 连接池（requests.Session），所有直播间共用，免去每次请求的 TCP+TLS 握手
+
+    只对 GET 做自动重试，POST（发弹幕、关注）不会被重复提交。
+    """
+
+    def __init__(self, pool_size: int = 100, timeout: Union[float, Tuple[float, float]] = (5, 15), retries: int = 3,
+                 backoff_factor: float = 0.5, proxies: Optional[dict] = None):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        self.timeout = timeout
+        self.proxies = proxies
+        retry = Retry(total=retries, backoff_factor=backoff_factor, status_forcelist=RETRY_STATUS,
+                      allowed_methods=frozenset(['GET', 'HEAD']), respect_retry_after_header=True,
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def request(self, method: str, url: str, **kwargs) -> 'requests.Response':
+        kwargs.setdefault('timeout', self.timeout)
+        if kwargs.get('proxies') is None and self.proxies is not None:
+            kwargs['proxies'] = self.proxies
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url: str, **kwargs) -> 'requests.Response':
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> 'requests.Response':
+        return self.request('POST', url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+_default_client: Optional[HttpClient] = None
+_default_lock = threading.Lock()
+
+
+# 进程内默认共享的 HttpClient
+def getHttpClient() -> HttpClient:
+    global _default_client
+    with _default_lock:
+        if _default_client is None:
+            _default_client = HttpClient()
+        return _default_client
+
+
+# 替换进程内默认的 HttpClient（比如调整连接池大小、统一代理）
+def setHttpClient(client: HttpClient):
+    global _default_client
+    with _default_lock:
+        _default_client = client
+
+
+class AsyncHttpResponse:
+    """已读完 body 的异步响应"""
+
+    __slots__ = ('status', 'headers', 'content', 'encoding')
+
+    def __init__(self, status: int, headers, content: bytes, encoding: Optional[str]):
+        self.status = status
+        self.headers = headers
+        self.content = content
+        self.encoding = encoding
+
+    @property
+    def text(self) -> str:
+        return self.content.decode(self.encoding or 'utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class AsyncHttpClient:
+    """aiohttp 版本的共享连接池，给 asyncio 多直播间使用；websocket 连接也复用同一个 ClientSession"""
+
+    def __init__(self, pool_size: int = 100, timeout: float = 15, retries: int = 3, backoff_factor: float = 0.5,
+                 proxy: Optional[str] = None):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.proxy = proxy
+        self._session = None
+
+    def session(self):
+        import aiohttp
+
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._session
+
+    async def request(self, method: str, url: str, **kwargs) -> AsyncHttpResponse:
+        import asyncio
+
+        import aiohttp
+
+        if kwargs.get('proxy') is None and self.proxy is not None:
+            kwargs['proxy'] = self.proxy
+        retry_get = method.upper() in ('GET', 'HEAD')
+        attempt = 0
+        while True:
+            try:
+                async with self.session().request(method, url, **kwargs) as resp:
+                    content = await resp.read()
+                    result = AsyncHttpResponse(resp.status, resp.headers, content, resp.charset)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if not retry_get or attempt >= self.retries:
+                    raise
+                result = None
+            if result is not None and (result.status not in RETRY_STATUS or not retry_get or attempt >= self.retries):
+                return result
+            delay = self.backoff_factor * (2 ** attempt)
+            if result is not None and result.headers.get('Retry-After', '').isdigit():
+                delay = max(delay, int(result.headers['Retry-After']))
+            attempt += 1
+            logging.debug(f'[AsyncHttpClient] [{delay:.1f}秒后重试, url = {url}, attempt = {attempt}]')
+            await asyncio.sleep(delay)
+
+    async def get(self, url: str, **kwargs) -> AsyncHttpResponse:
+        return await self.request('GET', url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> AsyncHttpResponse:
+        return await self.request('POST', url, **kwargs)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
@@ -0,0 +1,458 @@
+import argparse
+import asyncio
+import functools
+import json
+import logging
+import os
+import signal
+import threading
+import time
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from .delivery import DROP_OLDEST
+from .ks_pb2 import PayloadType
+from .views import FEED_KINDS
+
+# 客户端缓冲区满时断开连接（drop_oldest 为丢弃最旧的事件）
+DISCONNECT = 'disconnect'
+
+# feed 类型 -> SCWebFeedPush 上的字段名
+_FIELDS = [(kind, field) for kind, (field, _) in FEED_KINDS.items()]
+
+
+class Subscriber:
+    """一个本地订阅者：按直播间 / feed 类型过滤，事件放在自己的有界缓冲区里，由各自的写协程发送
+
+    缓冲区里存的是编码好的 bytes，所有订阅者共用同一个对象，不复制。
+    """
+
+    def __init__(self, transport: str, rooms: Optional[Iterable[str]] = None, kinds: Optional[Iterable[str]] = None,
+                 max_buffer: int = 10000, overflow: str = DROP_OLDEST, peer: str = ''):
+        self.transport = transport
+        self.rooms: Optional[Set[str]] = set(rooms) if rooms else None
+        self.kinds: Optional[Set[str]] = set(kinds) if kinds else None
+        if self.kinds is not None and not self.kinds <= set(FEED_KINDS):
+            raise ValueError(f'未知的 feed 类型: {self.kinds - set(FEED_KINDS)}, 可选 {list(FEED_KINDS)}')
+        self.max_buffer = max_buffer
+        self.overflow = overflow
+        self.peer = peer
+        self.buffer: deque = deque()
+        self.closed = False
+        # 因为缓冲区满被断开
+        self.overflowed = False
+        self._ready = asyncio.Event()
+        # 统计
+        self.sent = 0
+        self.dropped = 0
+
+    # 在事件循环线程里调用
+    def offer(self, data: bytes):
+        if self.closed:
+            return
+        if len(self.buffer) >= self.max_buffer:
+            if self.overflow == DISCONNECT:
+                logging.warning(f'[BroadcastHub] [订阅者太慢，断开连接, peer = {self.peer}]')
+                self.overflowed = True
+                self.close()
+                return
+            self.buffer.popleft()
+            self.dropped += 1
+        self.buffer.append(data)
+        self._ready.set()
+
+    # 等到有事件时取出缓冲区里的全部事件；连接关闭后返回空列表
+    async def take(self) -> List[bytes]:
+        while not self.buffer and not self.closed:
+            self._ready.clear()
+            await self._ready.wait()
+        if self.closed:
+            return []
+        batch = list(self.buffer)
+        self.buffer.clear()
+        self.sent += len(batch)
+        return batch
+
+    def close(self):
+        self.closed = True
+        self.buffer.clear()
+        self._ready.set()
+
+    def getStats(self) -> dict:
+        return {'transport': self.transport, 'peer': self.peer, 'rooms': sorted(self.rooms) if self.rooms else None,
+                'kinds': sorted(self.kinds) if self.kinds else None, 'sent': self.sent, 'dropped': self.dropped,
+                'buffered': len(self.buffer)}
+
+
+class BroadcastHub:
+    """本地广播服务：每个直播间一个上游连接，解析后的 feed 分发给多个本地订阅者
+
+    - 每条 feed 只编码一次（一行 JSON：{"room", "kind", "ts", "data"}），所有订阅者共用同一个 bytes
+    - HTTP 端口提供 websocket（/ws）、SSE（/events）和 /stats，用 ?room=...&kind=... 过滤，可以重复
+    - Unix socket / TCP 端口按行输出 JSON，客户端连上后先发一行过滤条件：{"rooms": [...], "kinds": [...]}
+    - 每个订阅者一个有界缓冲区，满了按 overflow 丢弃最旧的事件或者断开，慢客户端不影响其他订阅者和收包线程
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: Optional[int] = 8770, unix_path: Optional[str] = None,
+                 tcp_port: Optional[int] = None, max_buffer: int = 10000, overflow: str = DROP_OLDEST,
+                 sse_keepalive: float = 15.0):
+        if overflow not in (DROP_OLDEST, DISCONNECT):
+            raise ValueError(f'未知的缓冲区溢出策略: {overflow}')
+        self.host = host
+        self.port = port
+        self.unix_path = unix_path
+        self.tcp_port = tcp_port
+        self.max_buffer = max_buffer
+        self.overflow = overflow
+        # SSE 没有事件时每隔多少秒发一行注释，客户端断开后写入失败才能发现
+        self.sse_keepalive = sse_keepalive
+        self.subscribers: Set[Subscriber] = set()
+        # 直播间 -> 只订阅了这些直播间的订阅者；不限直播间的订阅者单独放
+        self._byRoom: Dict[str, Set[Subscriber]] = {}
+        self._anyRoom: Set[Subscriber] = set()
+        # 有人关心的 feed 类型 -> 订阅者数；在收包线程里用来跳过没人要的编码
+        self._kindRefs: Dict[str, int] = {}
+        self._callbacks = {}
+        self._runner = None
+        self._servers = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        # 统计
+        self.published = 0
+        self.encoded_bytes = 0
+        self.disconnected = 0
+
+    # 订阅 Tool 的 SC_FEED_PUSH；room 默认是直播间地址
+    def attach(self, tool, room: Optional[str] = None):
+        def onFeedPush(view):
+            self.publishFeedPush(room or tool.liveUrl, view)
+
+        self._callbacks[id(tool)] = onFeedPush
+        tool.dispatcher.subscribe(PayloadType.SC_FEED_PUSH, onFeedPush, inline=True)
+
+    def detach(self, tool):
+        callback = self._callbacks.pop(id(tool), None)
+        if callback is not None:
+            tool.dispatcher.unsubscribe(PayloadType.SC_FEED_PUSH, callback)
+
+    # 有没有订阅者关心这个直播间
+    def wants(self, room: str) -> bool:
+        return bool(self._anyRoom) or bool(self._byRoom.get(room))
+
+    # 编码一个 SCWebFeedPush（FeedPushView）里的 feed 并广播；可以在任意线程调用
+    def publishFeedPush(self, room: str, view, recv_ts: Optional[int] = None) -> int:
+        loop = self._loop
+        if loop is None or not self.wants(room):
+            return 0
+        kindRefs = self._kindRefs
+        message = view.message
+        fields = [(kind, field) for kind, field in _FIELDS if kindRefs.get(kind) and getattr(message, field)]
+        if not fields:
+            return 0
+        if recv_ts is None:
+            recv_ts = int(time.time() * 1000)
+        # FeedPushView.to_dict 有缓存，feed_push_callback 已经转换过时不会再解析一次
+        data = view.to_dict()
+        prefix = '{"room": ' + json.dumps(room, ensure_ascii=False) + f', "ts": {recv_ts}, "kind": "'
+        dumps = json.dumps
+        events = []
+        for kind, field in fields:
+            head = prefix + kind + '", "data": '
+            for feed in data.get(field, ()):
+                events.append((kind, (head + dumps(feed, ensure_ascii=False) + '}\n').encode('utf-8')))
+        if events:
+            self.published += len(events)
+            self.encoded_bytes += sum(len(e) for _, e in events)
+            loop.call_soon_threadsafe(self._fanout, room, events)
+        return len(events)
+
+    # 在事件循环线程里把同一份 bytes 放进每个匹配的订阅者缓冲区
+    def _fanout(self, room: str, events: List[Tuple[str, bytes]]):
+        targets = list(self._anyRoom)
+        roomSubscribers = self._byRoom.get(room)
+        if roomSubscribers:
+            targets.extend(roomSubscribers)
+        for subscriber in targets:
+            kinds = subscriber.kinds
+            for kind, data in events:
+                if kinds is None or kind in kinds:
+                    subscriber.offer(data)
+
+    def _add(self, subscriber: Subscriber):
+        self.subscribers.add(subscriber)
+        if subscriber.rooms is None:
+            self._anyRoom.add(subscriber)
+        else:
+            for room in subscriber.rooms:
+                self._byRoom.setdefault(room, set()).add(subscriber)
+        for kind in subscriber.kinds or FEED_KINDS:
+            self._kindRefs[kind] = self._kindRefs.get(kind, 0) + 1
+        logging.info(f'[BroadcastHub] [订阅者已连接, transport = {subscriber.transport}, peer = {subscriber.peer}]')
+
+    def _remove(self, subscriber: Subscriber):
+        if subscriber not in self.subscribers:
+            return
+        self.subscribers.discard(subscriber)
+        if subscriber.rooms is None:
+            self._anyRoom.discard(subscriber)
+        else:
+            for room in subscriber.rooms:
+                subscribers = self._byRoom.get(room)
+                if subscribers is not None:
+                    subscribers.discard(subscriber)
+                    if not subscribers:
+                        del self._byRoom[room]
+        for kind in subscriber.kinds or FEED_KINDS:
+            self._kindRefs[kind] -= 1
+        if subscriber.overflowed:
+            self.disconnected += 1
+        subscriber.close()
+        logging.info(f'[BroadcastHub] [订阅者已断开, transport = {subscriber.transport}, peer = {subscriber.peer}, '
+                     f'sent = {subscriber.sent}, dropped = {subscriber.dropped}]')
+
+    def _subscriber(self, transport: str, rooms, kinds, peer: str) -> Subscriber:
+        return Subscriber(transport, rooms, kinds, self.max_buffer, self.overflow, peer)
+
+    async def handleUnix(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        await self._handleStream(reader, writer, 'unix')
+
+    async def handleTcp(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        await self._handleStream(reader, writer, 'tcp')
+
+    async def _handleStream(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, transport: str):
+        peer = str(writer.get_extra_info('peername') or transport)
+        try:
+            line = await asyncio.wait_for(reader.readline(), 10)
+            options = json.loads(line) if line.strip() else {}
+            subscriber = self._subscriber(transport, options.get('rooms'), options.get('kinds'), peer)
+        except (asyncio.TimeoutError, ValueError, AttributeError) as e:
+            writer.write(json.dumps({'error': f'过滤条件无效: {e}'}, ensure_ascii=False).encode('utf-8') + b'\n')
+            writer.close()
+            return
+        self._add(subscriber)
+        # 客户端断开时 read 返回空
+        watcher = asyncio.ensure_future(reader.read())
+        watcher.add_done_callback(lambda _: subscriber.close())
+        try:
+            while True:
+                batch = await subscriber.take()
+                if not batch:
+                    break
+                writer.writelines(batch)
+                await writer.drain()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            watcher.cancel()
+            self._remove(subscriber)
+            writer.close()
+
+    def _queryFilter(self, request) -> Tuple[Optional[List[str]], Optional[List[str]]]:
+        rooms = [r for value in request.query.getall('room', []) for r in value.split(',') if r]
+        kinds = [k for value in request.query.getall('kind', []) for k in value.split(',') if k]
+        return rooms or None, kinds or None
+
+    async def handleWebSocket(self, request):
+        from aiohttp import WSMsgType, web
+
+        rooms, kinds = self._queryFilter(request)
+        try:
+            subscriber = self._subscriber('websocket', rooms, kinds, request.remote or '')
+        except ValueError as e:
+            raise web.HTTPBadRequest(text=str(e))
+        ws = web.WebSocketResponse(heartbeat=30)
+        await ws.prepare(request)
+        self._add(subscriber)
+
+        async def receive():
+            # 只处理 ping/close，客户端发来的数据忽略
+            async for _ in ws:
+                pass
+            subscriber.close()
+
+        watcher = asyncio.ensure_future(receive())
+        try:
+            while not ws.closed:
+                batch = await subscriber.take()
+                if not batch:
+                    break
+                for data in batch:
+                    # 直接发送编码好的 bytes 作为文本帧，不再 decode/encode
+                    await ws.send_frame(data, WSMsgType.TEXT)
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            watcher.cancel()
+            self._remove(subscriber)
+            await ws.close()
+        return ws
+
+    async def handleEvents(self, request):
+        from aiohttp import web
+
+        rooms, kinds = self._queryFilter(request)
+        try:
+            subscriber = self._subscriber('sse', rooms, kinds, request.remote or '')
+        except ValueError as e:
+            raise web.HTTPBadRequest(text=str(e))
+        resp = web.StreamResponse(headers={'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache'})
+        await resp.prepare(request)
+        self._add(subscriber)
+        try:
+            while True:
+                # GET 请求没有请求体可读，只能靠写入发现客户端断开：空闲时发注释行
+                try:
+                    batch = await asyncio.wait_for(subscriber.take(), self.sse_keepalive)
+                except asyncio.TimeoutError:
+                    if request.transport is None or request.transport.is_closing():
+                        break
+                    await resp.write(b':\n\n')
+                    continue
+                if not batch:
+                    break
+                # 每个事件：data: <json>\n\n（编码好的一行已经带了一个换行）
+                chunks = []
+                for data in batch:
+                    chunks.append(b'data: ')
+                    chunks.append(data)
+                    chunks.append(b'\n')
+                await resp.write(b''.join(chunks))
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self._remove(subscriber)
+        return resp
+
+    async def handleStats(self, request):
+        from aiohttp import web
+
+        return web.json_response(self.getStats())
+
+    def app(self):
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_get('/ws', self.handleWebSocket)
+        app.router.add_get('/events', self.handleEvents)
+        app.router.add_get('/stats', self.handleStats)
+        return app
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        if self.port is not None:
+            try:
+                from aiohttp import web
+            except ImportError:
+                raise ImportError('websocket / SSE 需要安装 aiohttp: pip install aiohttp')
+            self._runner = web.AppRunner(self.app(), access_log=None)
+            await self._runner.setup()
+            site = web.TCPSite(self._runner, self.host, self.port)
+            await site.start()
+            # port 为 0 时取系统分配的端口
+            self.port = self._runner.addresses[0][1]
+            logging.info(f'[BroadcastHub] [websocket / SSE 已启动, url = http://{self.host}:{self.port}]')
+        if self.unix_path is not None:
+            if os.path.exists(self.unix_path):
+                os.unlink(self.unix_path)
+            self._servers.append(await asyncio.start_unix_server(self.handleUnix, self.unix_path))
+            logging.info(f'[BroadcastHub] [Unix socket 已启动, path = {self.unix_path}]')
+        if self.tcp_port is not None:
+            server = await asyncio.start_server(self.handleTcp, self.host, self.tcp_port)
+            self.tcp_port = server.sockets[0].getsockname()[1]
+            self._servers.append(server)
+            logging.info(f'[BroadcastHub] [TCP 已启动, addr = {self.host}:{self.tcp_port}]')
+        return self
+
+    async def stop(self):
+        for subscriber in list(self.subscribers):
+            subscriber.close()
+        for server in self._servers:
+            server.close()
+            await server.wait_closed()
+        self._servers = []
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        if self.unix_path is not None and os.path.exists(self.unix_path):
+            os.unlink(self.unix_path)
+        self._loop = None
+
+    # 在后台线程的事件循环里运行，给同步的 Tool.wssServerStart 使用
+    def startInThread(self):
+        started = threading.Event()
+        loop = asyncio.new_event_loop()
+
+        def run():
+            loop.run_until_complete(self.start())
+            started.set()
+            loop.run_forever()
+            loop.run_until_complete(self.stop())
+            loop.close()
+
+        self._thread = threading.Thread(target=run, name='BroadcastHub', daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def stopInThread(self):
+        if self._thread is not None and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._thread = None
+
+    def getStats(self) -> dict:
+        subscribers = [s.getStats() for s in list(self.subscribers)]
+        return {'subscribers': len(subscribers), 'published': self.published, 'encoded_bytes': self.encoded_bytes,
+                'sent': sum(s['sent'] for s in subscribers), 'dropped': sum(s['dropped'] for s in subscribers),
+                'disconnected': self.disconnected, 'clients': subscribers}
+
+
+async def _serve(args):
+    from .KsLive import Tool
+    from .rooms import RoomManager
+
+    hub = BroadcastHub(args.host, args.port, args.unix, args.tcp_port, args.max_buffer, args.overflow)
+    await hub.start()
+    manager = RoomManager()
+    loop = asyncio.get_running_loop()
+    for liveUrl in args.urls:
+        # 没有 cookie 时 Tool 会用浏览器获取，放到线程里，不阻塞已经在运行的广播服务
+        tool = await loop.run_in_executor(None, functools.partial(
+            Tool, liveUrl, args.chrome_bin, args.chrome_driver, args.runtime_dir, cookie=args.cookie,
+            proxy_host=args.proxy_host, proxy_port=args.proxy_port, api_base=args.api_base))
+        hub.attach(tool)
+        await manager.addRoom(tool)
+    stopped = asyncio.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stopped.set)
+    try:
+        await stopped.wait()
+    finally:
+        await manager.close()
+        await hub.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='本地广播服务：每个直播间一个上游连接，弹幕分发给多个本地订阅者')
+    parser.add_argument('urls', nargs='+', help='直播间地址')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8770, help='websocket / SSE 端口')
+    parser.add_argument('--unix', help='Unix socket 路径')
+    parser.add_argument('--tcp-port', type=int, help='按行输出 JSON 的 TCP 端口')
+    parser.add_argument('--max-buffer', type=int, default=10000, help='每个订阅者最多缓存多少条事件')
+    parser.add_argument('--overflow', choices=(DROP_OLDEST, DISCONNECT), default=DROP_OLDEST)
+    parser.add_argument('--cookie', help='快手网页 cookie；不传时用浏览器获取')
+    parser.add_argument('--runtime-dir', default='./runtime')
+    parser.add_argument('--chrome-bin', default='')
+    parser.add_argument('--chrome-driver', default='')
+    parser.add_argument('--proxy-host')
+    parser.add_argument('--proxy-port')
+    parser.add_argument('--api-base', help='接口地址前缀，指向 MockLiveServer 时可离线测试')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    asyncio.run(_serve(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,380 @@
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence, Tuple
+
+from .dispatch import payloadTypeName
+from .ks_pb2 import PayloadType
+
+if TYPE_CHECKING:
+    from http.server import ThreadingHTTPServer
+
+# 默认的直方图分桶（秒）：解码、回调在几十微秒到几毫秒，HTTP 请求和进房在几十毫秒到几秒
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                   2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labelText(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class CounterValue:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+
+class GaugeValue:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.inc(-amount)
+
+
+class HistogramValue:
+    __slots__ = ('bounds', 'counts', 'sum', 'count', '_lock')
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        # 每个桶自己的计数（不累加），输出时再累加
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        i = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+
+class Metric:
+    """一个指标及其全部标签组合；labels(...) 返回某个标签组合的值对象，调用方可以缓存下来避免重复查找"""
+
+    type = ''
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[tuple, object] = {}
+        self._lock = threading.Lock()
+
+    def _new(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        value = self._values.get(values)
+        if value is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f'{self.name} 需要标签 {self.labelnames}')
+            with self._lock:
+                value = self._values.get(values)
+                if value is None:
+                    value = self._values[values] = self._new()
+        return value
+
+    # 删除某个标签组合（比如房间下线）
+    def remove(self, *values):
+        with self._lock:
+            self._values.pop(values, None)
+
+    def _samples(self, values: tuple, value) -> List[str]:
+        return [f'{self.name}{_labelText(self.labelnames, values)} {_number(value.value)}']
+
+    def collect(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        for values, value in list(self._values.items()):
+            lines.extend(self._samples(values, value))
+        return lines
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def _new(self):
+        return CounterValue()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def _new(self):
+        return GaugeValue()
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new(self):
+        return HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def _samples(self, values: tuple, value: HistogramValue) -> List[str]:
+        lines = []
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), value.counts):
+            total += count
+            labels = _labelText(self.labelnames, values, f'le="{_number(bound)}"')
+            lines.append(f'{self.name}_bucket{labels} {total}')
+        labels = _labelText(self.labelnames, values)
+        lines.append(f'{self.name}_sum{labels} {_number(value.sum)}')
+        lines.append(f'{self.name}_count{labels} {value.count}')
+        return lines
+
+
+class MetricsRegistry:
+    """进程内的指标注册表，按 Prometheus 文本格式输出"""
+
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name: str, *args, **kwargs):
+        with self._lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f'指标 {name} 已经注册为 {metric.type}')
+            return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._get(Counter, name, help, labelnames)
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._get(Gauge, name, help, labelnames)
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help, labelnames, buckets)
+
+    # Prometheus 文本格式
+    def exposition(self) -> str:
+        with self._lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+_default_registry: Optional[MetricsRegistry] = None
+_default_lock = threading.Lock()
+
+
+# 进程内默认共享的 MetricsRegistry
+def getMetricsRegistry() -> MetricsRegistry:
+    global _default_registry
+    with _default_lock:
+        if _default_registry is None:
+            _default_registry = MetricsRegistry()
+        return _default_registry
+
+
+class MetricsServer:
+    """在后台线程提供 GET /metrics，给 Prometheus 拉取"""
+
+    def __init__(self, registry: Optional[MetricsRegistry] = None, host: str = '0.0.0.0', port: int = 9464):
+        self.registry = registry or getMetricsRegistry()
+        self.host = host
+        self.port = port
+        self._server: Optional['ThreadingHTTPServer'] = None
+
+    def start(self):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.exposition().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        # port 为 0 时取系统分配的端口
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, name='MetricsServer', daemon=True).start()
+        logging.info(f'[MetricsServer] [指标服务已启动, url = http://{self.host}:{self.port}/metrics]')
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+# OpenTelemetry tracer，调用 enableOpenTelemetry 后才会使用
+_tracer = None
+
+
+# 把 span 同时上报给 OpenTelemetry（需要安装 opentelemetry-api，exporter 由使用方配置）
+def enableOpenTelemetry(name: str = 'kuaishou'):
+    global _tracer
+    try:
+        from opentelemetry import trace
+    except ImportError:
+        raise ImportError('OpenTelemetry 需要安装 opentelemetry-api: pip install opentelemetry-api opentelemetry-sdk')
+    _tracer = trace.get_tracer(name)
+
+
+def disableOpenTelemetry():
+    global _tracer
+    _tracer = None
+
+
+class Span:
+    """一段耗时：结束时记到 kuaishou_span_seconds{span=...}，启用了 OpenTelemetry 时同时结束对应的 span"""
+
+    __slots__ = ('name', 'start', '_otel', '_ended')
+
+    def __init__(self, name: str, attributes: dict):
+        self.name = name
+        self.start = time.perf_counter()
+        self._otel = _tracer.start_span(name, attributes=attributes) if _tracer is not None else None
+        self._ended = False
+
+    def end(self, error: Optional[BaseException] = None) -> float:
+        elapsed = time.perf_counter() - self.start
+        if self._ended:
+            return elapsed
+        self._ended = True
+        _spanSeconds().labels(self.name, 'error' if error is not None else 'ok').observe(elapsed)
+        if self._otel is not None:
+            if error is not None:
+                self._otel.record_exception(error)
+            self._otel.end()
+        return elapsed
+
+
+def _spanSeconds() -> Histogram:
+    return getMetricsRegistry().histogram('kuaishou_span_seconds', '连接过程各阶段耗时', ('span', 'status'))
+
+
+def startSpan(name: str, **attributes) -> Span:
+    return Span(name, attributes)
+
+
+# with span('getWebSocketInfo', room=...): ...
+@contextmanager
+def span(name: str, **attributes):
+    s = Span(name, attributes)
+    try:
+        yield s
+    except BaseException as e:
+        s.end(e)
+        raise
+    s.end()
+
+
+class RoomMetrics:
+    """一个直播间（Tool）的指标：按房间和 PayloadType 的帧数/字节数、解码和回调耗时、重连次数、心跳 RTT、
+    wssServerStart 之后收到第一条弹幕推送的耗时
+
+    标签对应的值对象第一次用到时缓存下来，收包线程里只做一次 dict 查找和加法。
+    """
+
+    def __init__(self, room: str, registry: Optional[MetricsRegistry] = None):
+        registry = registry or getMetricsRegistry()
+        self.room = room
+        self.registry = registry
+        self.frames = registry.counter('kuaishou_frames_total', '收到的数据包数', ('room', 'payload_type'))
+        self.bytes = registry.counter('kuaishou_bytes_total', '收到的字节数（线上大小）', ('room', 'payload_type'))
+        self.decode_seconds = registry.histogram('kuaishou_decode_seconds', 'protobuf 解析耗时', ('payload_type',))
+        # 回调交给 DeliveryQueue 时在消费者线程里计时，和收包线程里执行的回调记在同一个直方图
+        self.callback_seconds = registry.histogram('kuaishou_callback_seconds', '执行订阅回调的耗时', ('kind',))
+        self.reconnects = registry.counter('kuaishou_reconnects_total', '重连次数', ('room',)).labels(room)
+        self.heartbeat_rtt = registry.histogram('kuaishou_heartbeat_rtt_seconds', '心跳往返耗时',
+                                                ('room',)).labels(room)
+        self.first_feed = registry.gauge('kuaishou_time_to_first_feed_seconds',
+                                         '开始连接到收到第一条弹幕推送的耗时', ('room',)).labels(room)
+        self._frameValues: Dict[int, tuple] = {}
+        self._decodeValues: Dict[int, HistogramValue] = {}
+        self._callbackValues: Dict[str, HistogramValue] = {}
+        self._startedAt: Optional[float] = None
+
+    # 开始连接（wssServerStart / RoomSession.run），重新计算首条弹幕耗时
+    def start(self):
+        self._startedAt = time.perf_counter()
+
+    def onFrame(self, payloadType: int, size: int):
+        values = self._frameValues.get(payloadType)
+        if values is None:
+            name = payloadTypeName(payloadType)
+            values = self._frameValues[payloadType] = (self.frames.labels(self.room, name),
+                                                       self.bytes.labels(self.room, name))
+        values[0].inc()
+        values[1].inc(size)
+        if payloadType == PayloadType.SC_FEED_PUSH and self._startedAt is not None:
+            self.first_feed.set(time.perf_counter() - self._startedAt)
+            self._startedAt = None
+
+    def observeDecode(self, payloadType: int, seconds: float):
+        value = self._decodeValues.get(payloadType)
+        if value is None:
+            value = self._decodeValues[payloadType] = self.decode_seconds.labels(payloadTypeName(payloadType))
+        value.observe(seconds)
+
+    def observeCallback(self, kind: str, seconds: float):
+        value = self._callbackValues.get(kind)
+        if value is None:
+            value = self._callbackValues[kind] = self.callback_seconds.labels(kind)
+        value.observe(seconds)
@@ -0,0 +1,342 @@
+import argparse
+import asyncio
+import gzip
+import json
+import logging
+import random
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+from aiohttp import WSMsgType, web
+
+from .ks_pb2 import CSWebEnterRoom
+from .ks_pb2 import CSWebHeartbeat
+from .ks_pb2 import CompressionType
+from .ks_pb2 import PayloadType
+from .ks_pb2 import SCHeartbeatAck
+from .ks_pb2 import SCWebEnterRoomAck
+from .ks_pb2 import SCWebFeedPush
+from .ks_pb2 import SocketMessage
+
+_NAMES = ['快手用户', '小可爱', '路人甲', 'Like.', '北晨的信智', '子璩ᵇᵃᵇʸ']
+_GIFT_IDS = [1, 2, 9, 197, 10075]
+# emoji/allgifts 的返回：礼物id -> 礼物信息
+_ALL_GIFTS = {str(gift_id): {'id': gift_id, 'name': f'礼物{gift_id}', 'unitPrice': price,
+                             'picUrl': [{'cdn': 'mock', 'url': f'https://mock/gift/{gift_id}.png'}]}
+              for gift_id, price in zip(_GIFT_IDS, (1, 10, 66, 520, 1314))}
+_ALL_GIFTS_ETAG = '"mock-allgifts-1"'
+
+_PAGE = ('<!DOCTYPE html><html><head><title>mock</title></head><body><div id="app"></div>'
+         '<script>window.__INITIAL_STATE__={state};(function(){{var s;(s=document.currentScript||'
+         'document.scripts[document.scripts.length-1]).parentNode.removeChild(s);}}());</script></body></html>')
+
+
+class MockStats:
+    """服务端统计"""
+
+    __slots__ = ('connections', 'active', 'enter_rooms', 'rejected', 'heartbeats', 'frames', 'bytes',
+                 'comments', 'gifts', 'likes', 'dropped')
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class MockLiveServer:
+    """本地模拟的快手直播服务：直播页、websocketinfo 接口和 websocket 长连接
+
+    任意 /u/<主播id> 都是一个正在直播的房间；进房鉴权、心跳应答和 SCWebFeedPush 推送都按 ks.proto 组包，
+    用于在没有真实直播间和 cookie 的情况下压测 wssServerStart / RoomManager 的吞吐和断线重连。
+    """
+
+    # comment_rate/gift_rate/like_rate：每个连接每秒推送的条数；push_interval：推送间隔（秒）
+    # drop_after：每个连接存活的平均秒数，到时服务端主动断开，用来测试重连；None 表示不断开
+    # offline：这些主播id 显示为未开播；ack_heartbeats 为 False 时不回心跳应答，用来测试丢失心跳后的重连
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, comment_rate: float = 10.0, gift_rate: float = 1.0,
+                 like_rate: float = 20.0, push_interval: float = 0.5, heartbeat_interval_ms: int = 20000,
+                 min_reconnect_ms: int = 1000, max_reconnect_ms: int = 10000, drop_after: Optional[float] = None,
+                 gzip_feeds: bool = False, offline: Iterable[str] = (), ack_heartbeats: bool = True):
+        self.host = host
+        self.port = port
+        self.comment_rate = comment_rate
+        self.gift_rate = gift_rate
+        self.like_rate = like_rate
+        self.push_interval = push_interval
+        self.heartbeat_interval_ms = heartbeat_interval_ms
+        self.min_reconnect_ms = min_reconnect_ms
+        self.max_reconnect_ms = max_reconnect_ms
+        self.drop_after = drop_after
+        self.gzip_feeds = gzip_feeds
+        self.offline = set(offline)
+        self.ack_heartbeats = ack_heartbeats
+        self.stats = MockStats()
+        # liveStreamId -> 当前连接数
+        self.rooms: Dict[str, int] = {}
+        self._runner: Optional[web.AppRunner] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._seq = 0
+
+    @property
+    def base_url(self) -> str:
+        return f'http://{self.host}:{self.port}'
+
+    # 传给 Tool(api_base=...) 的地址
+    @property
+    def api_base(self) -> str:
+        return self.base_url
+
+    # 某个模拟主播的直播页地址
+    def liveUrl(self, principalId: str) -> str:
+        return f'{self.base_url}/u/{principalId}'
+
+    @staticmethod
+    def liveStreamId(principalId: str) -> str:
+        return f'mock-{principalId}'
+
+    @staticmethod
+    def token(liveStreamId: str) -> str:
+        return f'token-{liveStreamId}'
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get('/u/{principalId}', self.handleLivePage)
+        app.router.add_get('/live_api/liveroom/websocketinfo', self.handleWebSocketInfo)
+        app.router.add_get('/live_api/emoji/allgifts', self.handleAllGifts)
+        app.router.add_get('/websocket', self.handleWebSocket)
+        return app
+
+    async def start(self):
+        self._runner = web.AppRunner(self.app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port, backlog=4096)
+        await site.start()
+        # port 为 0 时取系统分配的端口
+        self.port = self._runner.addresses[0][1]
+        logging.info(f'[MockLiveServer] [模拟服务已启动, url = {self.base_url}]')
+        return self
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    # 在后台线程的事件循环里运行，给同步的 Tool.wssServerStart 使用
+    def startInThread(self):
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(self.start())
+            started.set()
+            self._loop.run_forever()
+            self._loop.run_until_complete(self.stop())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, name='MockLiveServer', daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def stopInThread(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop = None
+
+    async def handleLivePage(self, request: web.Request) -> web.Response:
+        principalId = request.match_info['principalId']
+        if principalId in self.offline:
+            liveStream = {'playUrls': []}
+        else:
+            liveStream = {'id': self.liveStreamId(principalId), 'caption': f'{principalId} 的直播间'}
+        state = {'liveroom': {'liveStream': liveStream, 'author': {'id': principalId}},
+                 'padding': 'x' * 2048}
+        return web.Response(text=_PAGE.format(state=json.dumps(state, ensure_ascii=False)),
+                            content_type='text/html')
+
+    async def handleWebSocketInfo(self, request: web.Request) -> web.Response:
+        liveStreamId = request.query.get('liveStreamId', '')
+        if not request.headers.get('cookie') or not liveStreamId:
+            return web.json_response({'data': {'result': 2}})
+        ws_url = f'ws://{self.host}:{self.port}/websocket'
+        return web.json_response({'data': {'result': 1, 'token': self.token(liveStreamId),
+                                           'websocketUrls': [ws_url, ws_url + '?backup=1']}})
+
+    # 支持 If-None-Match，内容不变时返回 304
+    async def handleAllGifts(self, request: web.Request) -> web.Response:
+        if request.headers.get('If-None-Match') == _ALL_GIFTS_ETAG:
+            return web.Response(status=304, headers={'ETag': _ALL_GIFTS_ETAG})
+        return web.json_response({'data': _ALL_GIFTS}, headers={'ETag': _ALL_GIFTS_ETAG})
+
+    async def handleWebSocket(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse(autoping=True, max_msg_size=0)
+        try:
+            await ws.prepare(request)
+        except ConnectionResetError:
+            # 客户端在握手期间断开
+            return ws
+        self.stats.connections += 1
+        self.stats.active += 1
+        liveStreamId = None
+        pusher = None
+        try:
+            msg = await ws.receive(timeout=30)
+            if msg.type != WSMsgType.BINARY:
+                return ws
+            enter = CSWebEnterRoom()
+            enter.ParseFromString(msg.data)
+            liveStreamId = enter.payload.liveStreamId
+            if enter.payloadType != PayloadType.CS_ENTER_ROOM or enter.payload.token != self.token(liveStreamId):
+                self.stats.rejected += 1
+                liveStreamId = None
+                await ws.close(code=4001, message=b'invalid token')
+                return ws
+            self.stats.enter_rooms += 1
+            self.rooms[liveStreamId] = self.rooms.get(liveStreamId, 0) + 1
+            await self._send(ws, PayloadType.SC_ENTER_ROOM_ACK, self._enterRoomAck())
+            pusher = asyncio.ensure_future(self._push(ws))
+            async for msg in ws:
+                if msg.type != WSMsgType.BINARY:
+                    continue
+                heartbeat = CSWebHeartbeat()
+                heartbeat.ParseFromString(msg.data)
+                if heartbeat.payloadType == PayloadType.CS_HEARTBEAT:
+                    self.stats.heartbeats += 1
+                    if not self.ack_heartbeats:
+                        continue
+                    ack = SCHeartbeatAck()
+                    ack.timestamp = int(time.time() * 1000)
+                    ack.clientTimestamp = heartbeat.payload.timestamp
+                    await self._send(ws, PayloadType.SC_HEARTBEAT_ACK, ack.SerializeToString())
+        except (asyncio.TimeoutError, ConnectionResetError):
+            pass
+        finally:
+            if pusher is not None:
+                pusher.cancel()
+            if liveStreamId is not None:
+                self.rooms[liveStreamId] -= 1
+                if not self.rooms[liveStreamId]:
+                    del self.rooms[liveStreamId]
+            self.stats.active -= 1
+        return ws
+
+    def _enterRoomAck(self) -> bytes:
+        ack = SCWebEnterRoomAck()
+        ack.minReconnectMs = self.min_reconnect_ms
+        ack.maxReconnectMs = self.max_reconnect_ms
+        ack.heartbeatIntervalMs = self.heartbeat_interval_ms
+        return ack.SerializeToString()
+
+    async def _send(self, ws: web.WebSocketResponse, payloadType: int, payload: bytes,
+                    compressionType: int = CompressionType.NONE):
+        msg = SocketMessage()
+        msg.payloadType = payloadType
+        msg.compressionType = compressionType
+        msg.payload = payload
+        data = msg.SerializeToString()
+        await ws.send_bytes(data)
+        self.stats.frames += 1
+        self.stats.bytes += len(data)
+
+    # 按配置的速率周期性推送 SCWebFeedPush；小数部分累计到下一次
+    async def _push(self, ws: web.WebSocketResponse):
+        rnd = random.Random()
+        deadline = None
+        if self.drop_after:
+            deadline = time.monotonic() + rnd.uniform(0.5, 1.5) * self.drop_after
+        carry = [0.0, 0.0, 0.0]
+        rates = (self.comment_rate, self.gift_rate, self.like_rate)
+        # 错开各个连接的推送时间
+        await asyncio.sleep(rnd.uniform(0, self.push_interval))
+        while not ws.closed:
+            counts = []
+            for i, rate in enumerate(rates):
+                carry[i] += rate * self.push_interval
+                counts.append(int(carry[i]))
+                carry[i] -= counts[-1]
+            if any(counts):
+                payload = self._feedPush(rnd, *counts)
+                if self.gzip_feeds:
+                    await self._send(ws, PayloadType.SC_FEED_PUSH, gzip.compress(payload, 1), CompressionType.GZIP)
+                else:
+                    await self._send(ws, PayloadType.SC_FEED_PUSH, payload)
+            if deadline is not None and time.monotonic() >= deadline:
+                self.stats.dropped += 1
+                await ws.close(code=1011, message=b'mock drop')
+                return
+            await asyncio.sleep(self.push_interval)
+
+    def _feedPush(self, rnd: random.Random, comments: int, gifts: int, likes: int) -> bytes:
+        push = SCWebFeedPush()
+        push.displayWatchingCount = str(rnd.randint(100, 20000))
+        push.pushInterval = int(self.push_interval * 1000)
+        now = int(time.time() * 1000)
+        for _ in range(comments):
+            feed = push.commentFeeds.add()
+            feed.id = self._nextId('c')
+            self._fillUser(rnd, feed.user)
+            feed.content = '主播好厉害' * rnd.randint(1, 3)
+        for _ in range(gifts):
+            feed = push.giftFeeds.add()
+            feed.id = self._nextId('g')
+            self._fillUser(rnd, feed.user)
+            feed.time = now
+            feed.giftId = rnd.choice(_GIFT_IDS)
+            feed.batchSize = 1
+            feed.comboCount = rnd.randint(1, 10)
+            feed.mergeKey = feed.id
+        for _ in range(likes):
+            feed = push.likeFeeds.add()
+            feed.id = self._nextId('l')
+            self._fillUser(rnd, feed.user)
+        self.stats.comments += comments
+        self.stats.gifts += gifts
+        self.stats.likes += likes
+        return push.SerializeToString()
+
+    def _nextId(self, prefix: str) -> str:
+        self._seq += 1
+        return f'{prefix}{self._seq}'
+
+    @staticmethod
+    def _fillUser(rnd: random.Random, user):
+        i = rnd.randrange(100000)
+        user.principalId = f'3x{i:013d}'
+        user.userName = _NAMES[i % len(_NAMES)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地模拟快手直播服务')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--comment-rate', type=float, default=10.0)
+    parser.add_argument('--gift-rate', type=float, default=1.0)
+    parser.add_argument('--like-rate', type=float, default=20.0)
+    parser.add_argument('--push-interval', type=float, default=0.5)
+    parser.add_argument('--drop-after', type=float, default=None)
+    parser.add_argument('--gzip', action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    server = MockLiveServer(args.host, args.port, args.comment_rate, args.gift_rate, args.like_rate,
+                            args.push_interval, drop_after=args.drop_after, gzip_feeds=args.gzip)
+
+    async def run():
+        await server.start()
+        while True:
+            await asyncio.sleep(10)
+            logging.info(f'[MockLiveServer] [统计] {server.stats.to_dict()}')
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+import json
+import re
+import threading
+import time
+from json.decoder import scanstring
+from typing import Dict, Optional, Tuple
+
+STATE_MARKER = b'__INITIAL_STATE__='
+# state 对象后面紧跟的脚本
+STATE_END = b';(function(){'
+
+_decoder = json.JSONDecoder()
+
+
+class StateExtractor:
+    """边下载直播页边查找 __INITIAL_STATE__，拿到完整的 state 后即可停止读取剩余页面"""
+
+    def __init__(self):
+        self._buf = bytearray()
+        # 下一次查找的起点，避免重复扫描已经看过的内容
+        self._scan = 0
+        self._start = -1
+        self.state: Optional[bytes] = None
+        self.bytes_read = 0
+
+    # 喂入一段响应数据，返回 True 表示 state 已经完整
+    def feed(self, chunk: bytes) -> bool:
+        if self.state is not None:
+            return True
+        self.bytes_read += len(chunk)
+        self._buf += chunk
+        if self._start < 0:
+            i = self._buf.find(STATE_MARKER, self._scan)
+            if i < 0:
+                # 还没找到起始标记：只保留可能跨 chunk 的尾巴
+                keep = len(STATE_MARKER) - 1
+                if len(self._buf) > keep:
+                    del self._buf[:-keep]
+                self._scan = 0
+                return False
+            del self._buf[:i + len(STATE_MARKER)]
+            self._start = 0
+            self._scan = 0
+        j = self._buf.find(STATE_END, self._scan)
+        if j < 0:
+            self._scan = max(len(self._buf) - len(STATE_END) + 1, 0)
+            return False
+        self.state = bytes(self._buf[:j])
+        self._buf = bytearray()
+        return True
+
+    # 只解析 liveroom 对象，取出 liveStream；找不到 state 时返回 None
+    def liveStream(self):
+        if self.state is None:
+            return None
+        return parseLiveStream(self.state.decode('utf-8'))
+
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+# 按顶层对象的结构逐个跳过成员，直到 key 为 liveroom：只解析它前面的值，后面的推荐列表等不再解析；
+# 字符串值里或者更深层对象里的同名 key 不会被误认。没有 liveroom 时抛出 KeyError
+def _topLevelLiveroom(state: str):
+    ws = _WHITESPACE.match
+    j = ws(state, 0).end()
+    if state[j] != '{':
+        raise ValueError('state 不是 JSON 对象')
+    j += 1
+    while True:
+        j = ws(state, j).end()
+        if state[j] != '"':
+            raise KeyError('liveroom')
+        key, j = scanstring(state, j + 1)
+        j = ws(state, j).end()
+        if state[j] != ':':
+            raise ValueError(f'state 在 {j} 处缺少冒号')
+        j = ws(state, j + 1).end()
+        value, j = _decoder.raw_decode(state, j)
+        if key == 'liveroom':
+            return value
+        j = ws(state, j).end()
+        if state[j] != ',':
+            raise KeyError('liveroom')
+        j += 1
+
+
+# 从 __INITIAL_STATE__ 文本里取 liveroom.liveStream，不解析整个 state；结构不符合预期或者被截断时退回完整解析
+def parseLiveStream(state: str):
+    try:
+        return _topLevelLiveroom(state)['liveStream']
+    except (IndexError, ValueError, KeyError, TypeError):
+        return json.loads(state)['liveroom']['liveStream']
+
+
+class LiveRoomIdCache:
+    """直播地址 -> 房间号 的 TTL 缓存，进程内共享"""
+
+    def __init__(self, ttl: float = 300):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._items: Dict[str, Tuple[str, float]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, liveUrl: str) -> Optional[str]:
+        with self._lock:
+            item = self._items.get(liveUrl)
+            if item is None or item[1] < time.monotonic():
+                self._items.pop(liveUrl, None)
+                self.misses += 1
+                return None
+            self.hits += 1
+            return item[0]
+
+    def set(self, liveUrl: str, liveRoomId: str):
+        with self._lock:
+            self._items[liveUrl] = (liveRoomId, time.monotonic() + self.ttl)
+
+    # 房间号可能已经变了（重新开播），删除缓存
+    def invalidate(self, liveUrl: str):
+        with self._lock:
+            self._items.pop(liveUrl, None)
+
+
+liveRoomIdCache = LiveRoomIdCache()
@@ -0,0 +1,293 @@
+import sys
+import threading
+import time
+from array import array
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .ks_pb2 import PayloadType
+
+JOIN = 'join'
+LEAVE = 'leave'
+
+
+class SimpleUser:
+    """UserTable 里某个用户的只读视图（对应 SimpleUserInfo）"""
+
+    __slots__ = ('table', 'handle')
+
+    def __init__(self, table: 'UserTable', handle: int):
+        self.table = table
+        self.handle = handle
+
+    @property
+    def principal_id(self) -> str:
+        return self.table.principal_ids[self.handle]
+
+    @property
+    def user_name(self) -> str:
+        return self.table.names[self.handle]
+
+    @property
+    def head_url(self) -> str:
+        return self.table.heads[self.handle]
+
+    def to_dict(self) -> dict:
+        return {'principalId': self.principal_id, 'userName': self.user_name, 'headUrl': self.head_url}
+
+    def __repr__(self):
+        return f'SimpleUser({self.principal_id!r}, {self.user_name!r})'
+
+
+class UserTable:
+    """进程内共享的用户表：按列存放 principalId / 昵称 / 头像，字符串全部 intern
+
+    同一个用户同时在多个直播间时只存一份；按引用计数回收，没有直播间引用的行放进空闲列表复用。
+    """
+
+    def __init__(self):
+        self.principal_ids: List[Optional[str]] = []
+        self.names: List[Optional[str]] = []
+        self.heads: List[Optional[str]] = []
+        self.refs = array('I')
+        self._index: Dict[str, int] = {}
+        self._free: List[int] = []
+        self._lock = threading.Lock()
+
+    # 登记一个 SimpleUserInfo 并增加引用，返回行号；昵称、头像变了时更新
+    def acquire(self, user) -> int:
+        principalId = user.principalId
+        with self._lock:
+            handle = self._index.get(principalId)
+            if handle is None:
+                principalId = sys.intern(principalId)
+                if self._free:
+                    handle = self._free.pop()
+                    self.principal_ids[handle] = principalId
+                    self.names[handle] = sys.intern(user.userName)
+                    self.heads[handle] = sys.intern(user.headUrl)
+                    self.refs[handle] = 1
+                else:
+                    handle = len(self.principal_ids)
+                    self.principal_ids.append(principalId)
+                    self.names.append(sys.intern(user.userName))
+                    self.heads.append(sys.intern(user.headUrl))
+                    self.refs.append(1)
+                self._index[principalId] = handle
+                return handle
+            self.refs[handle] += 1
+            if self.names[handle] != user.userName:
+                self.names[handle] = sys.intern(user.userName)
+            if self.heads[handle] != user.headUrl:
+                self.heads[handle] = sys.intern(user.headUrl)
+            return handle
+
+    def release(self, handle: int):
+        with self._lock:
+            self.refs[handle] -= 1
+            if self.refs[handle] == 0:
+                del self._index[self.principal_ids[handle]]
+                self.principal_ids[handle] = self.names[handle] = self.heads[handle] = None
+                self._free.append(handle)
+
+    def get(self, handle: int) -> SimpleUser:
+        return SimpleUser(self, handle)
+
+    def __len__(self):
+        return len(self._index)
+
+
+_default_table: Optional[UserTable] = None
+_default_lock = threading.Lock()
+
+
+# 进程内共享的 UserTable
+def getUserTable() -> UserTable:
+    global _default_table
+    with _default_lock:
+        if _default_table is None:
+            _default_table = UserTable()
+        return _default_table
+
+
+class PresenceEvent:
+    """观众进出事件；leave 事件的 dwell 为这次停留的秒数"""
+
+    __slots__ = ('kind', 'room_id', 'principal_id', 'user_name', 'head_url', 'time', 'dwell')
+
+    def __init__(self, kind: str, room_id: str, principal_id: str, user_name: str, head_url: str, time: float,
+                 dwell: float = 0.0):
+        self.kind = kind
+        self.room_id = room_id
+        self.principal_id = principal_id
+        self.user_name = user_name
+        self.head_url = head_url
+        self.time = time
+        self.dwell = dwell
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return f'PresenceEvent({self.kind}, {self.room_id!r}, {self.principal_id!r}, dwell={self.dwell:.1f})'
+
+
+class RoomPresence:
+    """单个直播间的在线观众：和上一次的 SCWebLiveWatchingUsers 比较，只处理进出的用户
+
+    观众列表是服务端下发的部分在线用户，这里的进出指进入 / 离开这个列表。
+    dwell_limit：最多记录多少个用户的累计停留时间，超出时丢掉停留最短的一半。
+    """
+
+    def __init__(self, room_id: str, table: Optional[UserTable] = None,
+                 on_event: Optional[Callable[[PresenceEvent], None]] = None, dwell_limit: int = 100000):
+        self.room_id = room_id
+        self.table = table or getUserTable()
+        self.on_event = on_event
+        self.dwell_limit = dwell_limit
+        # principalId -> (UserTable 行号, 进入时间)
+        self.current: Dict[str, Tuple[int, float]] = {}
+        # principalId -> 已经离开的停留时间累计（秒）
+        self.dwell: Dict[str, float] = {}
+        self.display_watching_count = ''
+        self.snapshots = 0
+        self.joins = 0
+        self.leaves = 0
+        self._lock = threading.Lock()
+
+    # 处理一个 SCWebLiveWatchingUsers（或视图），返回这次产生的事件
+    def update(self, message, now: Optional[float] = None) -> List[PresenceEvent]:
+        message = getattr(message, 'message', message)
+        if now is None:
+            now = time.time()
+        events = []
+        table = self.table
+        with self._lock:
+            self.snapshots += 1
+            if message.displayWatchingCount:
+                self.display_watching_count = message.displayWatchingCount
+            current = self.current
+            seen = set()
+            for info in message.watchingUser:
+                if info.offline:
+                    continue
+                user = info.user
+                principalId = user.principalId
+                seen.add(principalId)
+                if principalId in current:
+                    continue
+                handle = table.acquire(user)
+                # 用表里 intern 过的字符串作 key
+                principalId = table.principal_ids[handle]
+                current[principalId] = (handle, now)
+                events.append(PresenceEvent(JOIN, self.room_id, principalId, table.names[handle],
+                                            table.heads[handle], now))
+            for principalId in [p for p in current if p not in seen]:
+                events.append(self._leave(principalId, now))
+            self.joins += sum(1 for e in events if e.kind == JOIN)
+            self.leaves += sum(1 for e in events if e.kind == LEAVE)
+        if self.on_event is not None:
+            for event in events:
+                self.on_event(event)
+        return events
+
+    # 调用方需持有锁
+    def _leave(self, principalId: str, now: float) -> PresenceEvent:
+        handle, joined = self.current.pop(principalId)
+        table = self.table
+        dwell = now - joined
+        event = PresenceEvent(LEAVE, self.room_id, principalId, table.names[handle], table.heads[handle], now, dwell)
+        self.dwell[principalId] = self.dwell.get(principalId, 0.0) + dwell
+        if len(self.dwell) > self.dwell_limit:
+            keep = sorted(self.dwell.items(), key=lambda item: item[1], reverse=True)[:self.dwell_limit // 2]
+            self.dwell = dict(keep)
+        table.release(handle)
+        return event
+
+    # 某个用户在这个直播间的累计停留秒数（包括当前这次）
+    def dwellTime(self, principalId: str, now: Optional[float] = None) -> float:
+        total = self.dwell.get(principalId, 0.0)
+        entry = self.current.get(principalId)
+        if entry is not None:
+            total += (time.time() if now is None else now) - entry[1]
+        return total
+
+    # 当前在列表里的观众
+    def viewers(self) -> List[SimpleUser]:
+        return [self.table.get(handle) for handle, _ in list(self.current.values())]
+
+    # 直播间下线：所有人记为离开，释放用户表里的引用
+    def close(self, now: Optional[float] = None) -> List[PresenceEvent]:
+        if now is None:
+            now = time.time()
+        with self._lock:
+            events = [self._leave(principalId, now) for principalId in list(self.current)]
+            self.leaves += len(events)
+        if self.on_event is not None:
+            for event in events:
+                self.on_event(event)
+        return events
+
+    def snapshot(self, now: Optional[float] = None) -> dict:
+        if now is None:
+            now = time.time()
+        with self._lock:
+            top = sorted(self.current, key=lambda p: self.current[p][1])[:10]
+            return {
+                'room_id': self.room_id,
+                'online': len(self.current),
+                'display_watching_count': self.display_watching_count,
+                'snapshots': self.snapshots,
+                'joins': self.joins,
+                'leaves': self.leaves,
+                'longest_present': [{'principalId': p, 'dwell': now - self.current[p][1]} for p in top],
+            }
+
+
+class PresenceTracker:
+    """多个直播间的在线观众追踪，按直播地址分别维护 RoomPresence，共用一个 UserTable"""
+
+    def __init__(self, on_event: Optional[Callable[[PresenceEvent], None]] = None,
+                 table: Optional[UserTable] = None, **room_kwargs):
+        self.on_event = on_event
+        self.table = table or getUserTable()
+        self.room_kwargs = room_kwargs
+        self.rooms: Dict[str, RoomPresence] = {}
+        self._lock = threading.Lock()
+        self._callbacks = {}
+
+    def room(self, room_id: str) -> RoomPresence:
+        presence = self.rooms.get(room_id)
+        if presence is None:
+            with self._lock:
+                presence = self.rooms.get(room_id)
+                if presence is None:
+                    presence = self.rooms[room_id] = RoomPresence(room_id, self.table, self.on_event,
+                                                                  **self.room_kwargs)
+        return presence
+
+    def removeRoom(self, room_id: str):
+        with self._lock:
+            presence = self.rooms.pop(room_id, None)
+        if presence is not None:
+            presence.close()
+
+    # 订阅 Tool 的 SC_LIVE_WATCHING_LIST，在收包线程里直接比较；
+    # 按直播地址区分房间，和 FeedDedup 一致：liveRoomId 在第一次连接后才有值、重新开播会变，不能作为 key
+    def attach(self, tool):
+        def onWatchingUsers(view):
+            self.room(tool.liveUrl).update(view)
+
+        self._callbacks[id(tool)] = onWatchingUsers
+        tool.dispatcher.subscribe(PayloadType.SC_LIVE_WATCHING_LIST, onWatchingUsers, inline=True)
+
+    def detach(self, tool):
+        callback = self._callbacks.pop(id(tool), None)
+        if callback is not None:
+            tool.dispatcher.unsubscribe(PayloadType.SC_LIVE_WATCHING_LIST, callback)
+
+    def snapshot(self, now: Optional[float] = None) -> Dict[str, dict]:
+        return {room_id: presence.snapshot(now) for room_id, presence in list(self.rooms.items())}
+
+    def getStats(self) -> dict:
+        return {'rooms': len(self.rooms), 'users': len(self.table),
+                'online': sum(len(presence.current) for presence in list(self.rooms.values()))}
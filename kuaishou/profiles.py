@@ -0,0 +1,190 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, Iterable, List, Optional
+
+from .ratelimit import TokenBucket
+
+
+class ProfileCache:
+    """LRU + TTL 缓存：最多 capacity 个用户，超过 ttl 秒的条目视为过期"""
+
+    def __init__(self, capacity: int = 10000, ttl: float = 600.0):
+        self.capacity = capacity
+        self.ttl = ttl
+        # principalId -> (过期时间, 信息)
+        self._data: 'OrderedDict[str, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    # 返回 (是否命中, 信息)；信息为 None 表示用户不存在（负缓存）
+    def get(self, principalId: str):
+        with self._lock:
+            entry = self._data.get(principalId)
+            if entry is None:
+                return False, None
+            if entry[0] < time.monotonic():
+                del self._data[principalId]
+                return False, None
+            self._data.move_to_end(principalId)
+            return True, entry[1]
+
+    def put(self, principalId: str, profile: Optional[dict], ttl: Optional[float] = None):
+        with self._lock:
+            self._data[principalId] = (time.monotonic() + (self.ttl if ttl is None else ttl), profile)
+            self._data.move_to_end(principalId)
+            while len(self._data) > self.capacity:
+                self._data.popitem(last=False)
+
+    def discard(self, principalId: str):
+        with self._lock:
+            self._data.pop(principalId, None)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class ProfileService:
+    """用户信息服务：包在 Tool.getUserCardInfoByIds 外面，带缓存、合并请求、批量查询和限速
+
+    - 缓存命中直接返回，不发请求
+    - 同一个用户同时被多处查询时共用一个 Future，只查一次
+    - 后台线程把 batch_delay 秒内攒下的用户合并成一个 GraphQL 请求（最多 batch_size 个别名）
+    - 请求按 qps 限速，burst 为允许的突发请求数
+    """
+
+    # negative_ttl：查不到的用户缓存多久
+    def __init__(self, tool, capacity: int = 10000, ttl: float = 600.0, negative_ttl: float = 60.0,
+                 batch_size: int = 20, batch_delay: float = 0.05, qps: float = 2.0, burst: Optional[float] = None):
+        self.tool = tool
+        self.cache = ProfileCache(capacity, ttl)
+        self.negative_ttl = negative_ttl
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.limiter = TokenBucket(qps, burst)
+        # principalId -> 正在查询的 Future
+        self._inflight: Dict[str, Future] = {}
+        # 等待发出的 principalId，按加入顺序
+        self._pending: List[str] = []
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        # 统计
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.requests = 0
+        self.fetched = 0
+        self.errors = 0
+
+    # 查询一个用户，返回 Future，结果为用户信息 dict，用户不存在时为 None
+    def lookup(self, principalId: str) -> Future:
+        hit, profile = self.cache.get(principalId)
+        if hit:
+            self.hits += 1
+            future = Future()
+            future.set_result(profile)
+            return future
+        with self._cond:
+            future = self._inflight.get(principalId)
+            if future is not None:
+                self.coalesced += 1
+                return future
+            if self._closed:
+                raise RuntimeError('ProfileService 已关闭')
+            self.misses += 1
+            future = self._inflight[principalId] = Future()
+            self._pending.append(principalId)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='ProfileService', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return future
+
+    # 阻塞查询
+    def get(self, principalId: str, timeout: Optional[float] = None) -> Optional[dict]:
+        return self.lookup(principalId).result(timeout)
+
+    # 批量阻塞查询，返回 principalId -> 信息
+    def getMany(self, principalIds: Iterable[str], timeout: Optional[float] = None) -> Dict[str, Optional[dict]]:
+        futures = {principalId: self.lookup(principalId) for principalId in principalIds}
+        return {principalId: future.result(timeout) for principalId, future in futures.items()}
+
+    # 在事件循环里查询：profile = await service.getAsync(principalId)
+    def getAsync(self, principalId: str) -> asyncio.Future:
+        return asyncio.wrap_future(self.lookup(principalId))
+
+    # 预取（比如新出现的送礼用户），不关心结果
+    def prefetch(self, principalIds: Iterable[str]):
+        for principalId in principalIds:
+            self.lookup(principalId)
+
+    # 让某个用户的缓存失效（比如关注状态变了）
+    def invalidate(self, principalId: str):
+        self.cache.discard(principalId)
+
+    def _take(self) -> List[str]:
+        with self._cond:
+            while not self._pending and not self._closed:
+                self._cond.wait()
+            # 等一小会儿，让同一时间到来的查询合并成一批
+            if len(self._pending) < self.batch_size and not self._closed:
+                self._cond.wait(self.batch_delay)
+            batch = self._pending[:self.batch_size]
+            del self._pending[:self.batch_size]
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take()
+            if not batch:
+                return
+            self.limiter.acquire()
+            self._fetch(batch)
+
+    def _fetch(self, batch: List[str]):
+        self.requests += 1
+        try:
+            profiles = self.tool.getUserCardInfoByIds(batch)
+        except Exception as e:
+            self.errors += 1
+            logging.error(f'[ProfileService] [批量获取用户信息失败, users = {len(batch)}, err = {e}]')
+            with self._cond:
+                futures = [self._inflight.pop(principalId) for principalId in batch]
+            for future in futures:
+                future.set_exception(e)
+            return
+        self.fetched += len(batch)
+        for principalId in batch:
+            profile = profiles.get(principalId)
+            self.cache.put(principalId, profile, None if profile is not None else self.negative_ttl)
+        with self._cond:
+            futures = [(self._inflight.pop(principalId), profiles.get(principalId)) for principalId in batch]
+        for future, profile in futures:
+            future.set_result(profile)
+
+    # 发出还没处理的查询后停止后台线程
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+
+    def getStats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            'size': len(self.cache),
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            # 命中缓存或者合并到已有请求的比例
+            'hit_rate': (self.hits + self.coalesced) / lookups if lookups else 0.0,
+            'requests': self.requests,
+            'fetched': self.fetched,
+            'users_per_request': self.fetched / self.requests if self.requests else 0.0,
+            'errors': self.errors,
+            'throttled_seconds': self.limiter.waited,
+        }
@@ -0,0 +1,68 @@
+import threading
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """令牌桶：每秒补充 rate 个令牌，最多攒 capacity 个（允许的突发量）
+
+    acquire 会预留令牌后再睡眠，多个线程同时等待时按调用顺序依次放行，不会一起醒来抢令牌。
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        if rate <= 0:
+            raise ValueError('rate 必须大于 0')
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        # 统计：放行次数、累计等待秒数
+        self.acquired = 0
+        self.waited = 0.0
+
+    # 调用方需持有锁
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    # 还要等多少秒才有 tokens 个令牌（不预留）
+    def waitTime(self, tokens: float = 1) -> float:
+        with self._lock:
+            self._refill()
+            return max(0.0, (tokens - self.tokens) / self.rate)
+
+    # 有令牌时立即取走并返回 True，否则返回 False
+    def tryAcquire(self, tokens: float = 1) -> bool:
+        with self._lock:
+            self._refill()
+            if self.tokens < tokens:
+                return False
+            self.tokens -= tokens
+            self.acquired += 1
+            return True
+
+    # 预留令牌（令牌数可以为负），返回需要等待的秒数；给 asyncio 使用：await asyncio.sleep(bucket.reserve())
+    def reserve(self, tokens: float = 1) -> float:
+        with self._lock:
+            self._refill()
+            self.tokens -= tokens
+            self.acquired += 1
+            wait = max(0.0, -self.tokens / self.rate)
+            self.waited += wait
+            return wait
+
+    # 阻塞直到取得令牌；需要等待的时间超过 timeout 时不预留，返回 False
+    def acquire(self, tokens: float = 1, timeout: Optional[float] = None) -> bool:
+        with self._lock:
+            self._refill()
+            wait = max(0.0, (tokens - self.tokens) / self.rate)
+            if timeout is not None and wait > timeout:
+                return False
+            self.tokens -= tokens
+            self.acquired += 1
+            self.waited += wait
+        if wait > 0:
+            time.sleep(wait)
+        return True
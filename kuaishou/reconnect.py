@@ -0,0 +1,34 @@
+import random
+from typing import Optional
+
+
+class Backoff:
+    """带抖动的指数退避，等待时间不低于服务端下发的 minReconnectMs"""
+
+    def __init__(self, base: float = 1.0, factor: float = 2.0, max_delay: float = 60.0, jitter: float = 0.5):
+        self.base = base
+        self.factor = factor
+        self.max_delay = max_delay
+        # 抖动比例：实际等待在 [delay * (1 - jitter), delay] 之间
+        self.jitter = jitter
+        self.attempt = 0
+        # SCWebEnterRoomAck 下发的重连间隔（秒）
+        self.server_min: float = 0.0
+        self.server_max: Optional[float] = None
+
+    # 根据进房应答更新服务端要求的重连间隔
+    def updateFromAck(self, minReconnectMs: int, maxReconnectMs: int = 0):
+        self.server_min = minReconnectMs / 1000
+        self.server_max = maxReconnectMs / 1000 if maxReconnectMs else None
+
+    # 连接成功后重置退避次数
+    def reset(self):
+        self.attempt = 0
+
+    # 下一次重连前需要等待的秒数
+    def next(self) -> float:
+        ceiling = self.max_delay if self.server_max is None else min(self.max_delay, self.server_max)
+        delay = min(ceiling, self.base * self.factor ** self.attempt)
+        delay = random.uniform(delay * (1 - self.jitter), delay)
+        self.attempt += 1
+        return max(delay, self.server_min)
@@ -0,0 +1,151 @@
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Callable, Iterator, Optional, Tuple, Union
+
+# 文件头：魔数 + 版本 + 标志位 + 保留字节
+MAGIC = b'KSREC'
+VERSION = 1
+FLAG_ZLIB = 0x01
+_HEADER = struct.Struct('<5sBBx')
+# 每帧：接收时间（纳秒） + 长度
+_RECORD = struct.Struct('<QI')
+
+
+class FrameRecorder:
+    """把收到的原始 SocketMessage 字节追加写入录制文件（长度前缀，可选逐帧 zlib 压缩）"""
+
+    def __init__(self, path: str, compress: bool = False, level: int = 1):
+        self.path = path
+        self.level = level
+        self._lock = threading.Lock()
+        if os.path.exists(path) and os.path.getsize(path) >= _HEADER.size:
+            with open(path, 'rb') as fh:
+                magic, version, flags = _HEADER.unpack(fh.read(_HEADER.size))
+            if magic != MAGIC:
+                raise ValueError(f'不是录制文件: {path}')
+            # 追加写入时沿用原文件的压缩设置
+            self.compress = bool(flags & FLAG_ZLIB)
+            self._fh = open(path, 'ab')
+        else:
+            self.compress = compress
+            self._fh = open(path, 'wb')
+            self._fh.write(_HEADER.pack(MAGIC, VERSION, FLAG_ZLIB if compress else 0))
+        self.frames = 0
+        self.bytes = 0
+
+    def record(self, frame: bytes, timestamp_ns: Optional[int] = None):
+        if timestamp_ns is None:
+            timestamp_ns = time.time_ns()
+        data = zlib.compress(frame, self.level) if self.compress else frame
+        with self._lock:
+            self._fh.write(_RECORD.pack(timestamp_ns, len(data)))
+            self._fh.write(data)
+            self.frames += 1
+            self.bytes += len(frame)
+
+    def flush(self):
+        with self._lock:
+            self._fh.flush()
+
+    def close(self):
+        with self._lock:
+            if not self._fh.closed:
+                self._fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FrameReader:
+    """以 mmap 方式读取录制文件，逐帧返回 (接收时间纳秒, SocketMessage 字节)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fh = open(path, 'rb')
+        size = os.fstat(self._fh.fileno()).st_size
+        if size < _HEADER.size:
+            raise ValueError(f'不是录制文件: {path}')
+        self._mm = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, flags = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f'不是录制文件: {path}')
+        self.version = version
+        self.compressed = bool(flags & FLAG_ZLIB)
+
+    def __iter__(self) -> Iterator[Tuple[int, bytes]]:
+        mm = self._mm
+        end = len(mm)
+        pos = _HEADER.size
+        unpack = _RECORD.unpack_from
+        size = _RECORD.size
+        decompress = zlib.decompress if self.compressed else None
+        while pos + size <= end:
+            timestamp_ns, length = unpack(mm, pos)
+            pos += size
+            if pos + length > end:
+                # 录制时被中断，最后一帧不完整
+                break
+            data = mm[pos:pos + length]
+            pos += length
+            yield timestamp_ns, decompress(data) if decompress else data
+
+    def close(self):
+        self._mm.close()
+        self._fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ReplayStats:
+    __slots__ = ('frames', 'bytes', 'elapsed')
+
+    def __init__(self):
+        self.frames = 0
+        self.bytes = 0
+        self.elapsed = 0.0
+
+    @property
+    def fps(self) -> float:
+        return self.frames / self.elapsed if self.elapsed else 0.0
+
+    def __repr__(self):
+        return f'ReplayStats(frames={self.frames}, bytes={self.bytes}, elapsed={self.elapsed:.3f}s, fps={self.fps:.0f})'
+
+
+# 回放录制文件：target 为 Tool（走 onMessage 解析分发）或者接收 bytes 的函数
+# realtime 为 True 时按录制时的间隔回放（speed 为倍速），否则尽可能快
+def replay(path: str, target: Union[Callable, object], realtime: bool = False, speed: float = 1.0) -> ReplayStats:
+    if hasattr(target, 'onMessage'):
+        onMessage = target.onMessage
+
+        def handle(frame):
+            onMessage(None, frame)
+    else:
+        handle = target
+    stats = ReplayStats()
+    start = time.perf_counter()
+    first_ts = None
+    with FrameReader(path) as reader:
+        for timestamp_ns, frame in reader:
+            if realtime:
+                if first_ts is None:
+                    first_ts = timestamp_ns
+                delay = (timestamp_ns - first_ts) / 1e9 / speed - (time.perf_counter() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            handle(frame)
+            stats.frames += 1
+            stats.bytes += len(frame)
+    stats.elapsed = time.perf_counter() - start
+    return stats
@@ -0,0 +1,187 @@
+import asyncio
+import logging
+from typing import Callable, Dict, Optional
+
+import aiohttp
+
+from .delivery import BLOCK
+from .httpclient import AsyncHttpClient
+from .KsLive import CookieNotUseful
+from .KsLive import NoLivingException
+from .KsLive import Tool
+
+
+class RoomSession:
+    """单个直播间在事件循环上的会话（连接、进房、心跳、分发均为协程）"""
+
+    # heartbeat_interval 为 None 时使用进房应答下发的心跳间隔
+    def __init__(self, tool: Tool, feed_push_callback: Optional[Callable] = None,
+                 heartbeat_interval: Optional[float] = None, lazy: bool = False, reconnect: bool = True):
+        self.tool = tool
+        self.feed_push_callback = feed_push_callback
+        self.lazy = lazy
+        self.heartbeat_interval = heartbeat_interval
+        self.reconnect = reconnect
+        self.ws: Optional[aiohttp.ClientWebSocketResponse] = None
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def key(self) -> str:
+        return self.tool.liveUrl
+
+    # 获取（轮换）websocket地址，必要时重新获取房间号和token
+    async def bootstrap(self, http: AsyncHttpClient):
+        await self.tool.nextWebSocketUrlAsync(http)
+
+    # 建立websocket连接，和 HTTP 请求共用一个连接池
+    async def connect(self, http: AsyncHttpClient):
+        self.ws = await http.session().ws_connect(self.tool.webSocketUrl, proxy=self.tool._aiohttpProxy(),
+                                                  autoping=True)
+        logging.info(f'[RoomSession] [建立wss连接] [liveUrl = {self.key}]')
+
+    # 发送进房鉴权包
+    async def enterRoom(self):
+        await self.ws.send_bytes(self.tool.connectData())
+
+    # 定时发送心跳包：注册到进程内共享的心跳调度器，发送和断开都投递回事件循环
+    def keepHeartBeat(self):
+        loop = asyncio.get_running_loop()
+        ws = self.ws
+
+        def send(data: bytes):
+            asyncio.run_coroutine_threadsafe(ws.send_bytes(data), loop)
+
+        def onDead():
+            logging.warning(f'[RoomSession] [心跳无应答，断开重连] [liveUrl = {self.key}]')
+            asyncio.run_coroutine_threadsafe(ws.close(), loop)
+
+        self.tool.startHeartbeat(send, onDead, self.heartbeat_interval)
+
+    # 解析服务端推送的数据包，复用 Tool.onMessage 的解析逻辑
+    async def dispatch(self, message: bytes):
+        self.tool.onMessage(self.ws, message)
+
+    def _bindCallback(self):
+        self.tool.feed_push_lazy = self.lazy
+        callback = self.feed_push_callback
+        if callback is not None and asyncio.iscoroutinefunction(callback):
+            loop = asyncio.get_running_loop()
+            key = self.key
+
+            def onDone(future):
+                if not future.cancelled() and future.exception() is not None:
+                    logging.error(f'[RoomSession] [弹幕回调异常, liveUrl = {key}, err = {future.exception()}]')
+
+            # 回调可能在 DeliveryQueue 的消费者线程或 FeedCoalescer 的定时线程里执行，必须线程安全地投递回事件循环
+            def schedule(data):
+                asyncio.run_coroutine_threadsafe(callback(data), loop).add_done_callback(onDone)
+
+            self.tool.feed_push_callback = schedule
+        else:
+            self.tool.feed_push_callback = callback
+
+    # 单次连接：进房、心跳、收包，直到连接断开
+    async def serve(self):
+        try:
+            await self.enterRoom()
+            self.keepHeartBeat()
+            async for msg in self.ws:
+                if msg.type == aiohttp.WSMsgType.BINARY:
+                    await self.dispatch(msg.data)
+                elif msg.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                    break
+        finally:
+            self.tool.stopHeartbeat()
+            await self.ws.close()
+            if self.ws.close_code:
+                self.tool.lastErrorCode = self.ws.close_code
+            logging.info(f'[RoomSession] [websocket已关闭, code = {self.ws.close_code}] [liveUrl = {self.key}]')
+
+    # 断线后按退避时间重连，轮换全部 websocket 地址
+    async def run(self, http: AsyncHttpClient):
+        self._bindCallback()
+        self.tool.loadGiftCatalogue()
+        if self.tool.metrics is not None:
+            self.tool.metrics.start()
+        while True:
+            try:
+                await self.bootstrap(http)
+                await self.connect(http)
+                await self.serve()
+            except NoLivingException:
+                raise
+            except CookieNotUseful:
+                if not await asyncio.get_running_loop().run_in_executor(None, self.tool.refreshCookie):
+                    raise
+            except (aiohttp.ClientError, asyncio.TimeoutError, OSError, ValueError) as e:
+                logging.error(f'[RoomSession] [连接失败, url = {self.tool.webSocketUrl}, err = {e}]')
+            if not self.reconnect:
+                break
+            self.tool.reconnectCount += 1
+            if self.tool.metrics is not None:
+                self.tool.metrics.reconnects.inc()
+            delay = self.tool.backoff.next()
+            logging.info(f'[RoomSession] [{delay:.1f}秒后第{self.tool.reconnectCount}次重连] [liveUrl = {self.key}]')
+            await asyncio.sleep(delay)
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except (asyncio.CancelledError, Exception):
+                pass
+
+
+class RoomManager:
+    """在一个事件循环里同时监听多个直播间，支持运行时增删房间"""
+
+    # delivery：所有房间共用的 DeliveryQueue（可选）；入队在事件循环线程里执行，
+    #           block 策略必须设置 block_timeout，否则队列满时所有房间的收包和心跳都会卡住
+    # http：所有房间共用的异步连接池（HTTP 请求和 websocket 连接都走它）
+    def __init__(self, heartbeat_interval: Optional[float] = None, delivery=None,
+                 http: Optional[AsyncHttpClient] = None):
+        if delivery is not None and delivery.policy == BLOCK and delivery.block_timeout is None:
+            raise ValueError('RoomManager 的 DeliveryQueue 不能无限阻塞事件循环：'
+                             '使用 drop_oldest / drop_by_type，或者设置 block_timeout')
+        self.heartbeat_interval = heartbeat_interval
+        self.delivery = delivery.start() if delivery is not None else None
+        self.http = http or AsyncHttpClient()
+        self.rooms: Dict[str, RoomSession] = {}
+
+    # 添加直播间，立即在当前事件循环上启动会话
+    async def addRoom(self, tool: Tool, feed_push_callback: Optional[Callable] = None,
+                      lazy: bool = False) -> RoomSession:
+        if tool.liveUrl in self.rooms:
+            await self.removeRoom(tool.liveUrl)
+        room = RoomSession(tool, feed_push_callback, self.heartbeat_interval, lazy)
+        if self.delivery is not None:
+            tool.dispatcher.delivery = self.delivery
+        room.task = asyncio.ensure_future(room.run(self.http))
+        room.task.add_done_callback(lambda t, r=room: self._onRoomDone(r, t))
+        self.rooms[room.key] = room
+        return room
+
+    # 移除直播间并关闭其连接
+    async def removeRoom(self, liveUrl: str):
+        room = self.rooms.pop(liveUrl, None)
+        if room is not None:
+            await room.close()
+
+    def _onRoomDone(self, room: RoomSession, task: asyncio.Task):
+        if self.rooms.get(room.key) is room:
+            del self.rooms[room.key]
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(f'[RoomManager] [直播间会话异常退出, liveUrl = {room.key}, err = {task.exception()}]')
+
+    # 等待所有直播间会话结束
+    async def wait(self):
+        while self.rooms:
+            await asyncio.gather(*[r.task for r in list(self.rooms.values())], return_exceptions=True)
+
+    async def close(self):
+        for liveUrl in list(self.rooms):
+            await self.removeRoom(liveUrl)
+        await self.http.close()
+        if self.delivery is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self.delivery.stop)
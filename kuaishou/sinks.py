@@ -0,0 +1,317 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Optional, Sequence
+
+from .ks_pb2 import PayloadType
+from .views import FEED_KINDS
+
+# 拍平后的事件字段；server_ts 为 feed 自带的服务端时间（毫秒，弹幕/点赞没有时为 0），recv_ts 为收到的时间；
+# FeedCoalescer 合并过的点赞 / 连击弹幕 combo_count 为合并的条数，按它求和等于原始 feed 条数
+COLUMNS = ('room_id', 'kind', 'id', 'recv_ts', 'server_ts', 'user_id', 'user_name', 'content', 'gift_id',
+           'combo_count')
+
+# feed 类型 -> 是否有 time / content / giftId / comboCount 字段
+_FIELDS = {
+    'comment': (False, True, False, False),
+    'gift': (True, False, True, True),
+    'like': (False, False, False, False),
+    'share': (True, False, False, False),
+    'system_notice': (True, True, False, False),
+    'combo_comment': (False, True, False, True),
+}
+
+
+# 把一个 SCWebFeedPush（或 FeedPushView）拍平成按 COLUMNS 排列的元组，直接读 protobuf 字段，不经过 dict
+def flattenFeedPush(push, room_id: str, recv_ts: Optional[int] = None) -> List[tuple]:
+    counts = getattr(push, 'counts', None)
+    push = getattr(push, 'message', push)
+    if recv_ts is None:
+        recv_ts = int(time.time() * 1000)
+    rows = []
+    append = rows.append
+    for kind, (field, _) in FEED_KINDS.items():
+        feeds = getattr(push, field)
+        if not feeds:
+            continue
+        if counts and field in counts:
+            # 合并过的点赞按用户、连击弹幕按内容
+            for feed, count in zip(feeds, counts[field]):
+                if kind == 'like':
+                    user = feed.user
+                    append((room_id, kind, feed.id, recv_ts, 0, user.principalId, user.userName, '', 0, count))
+                else:
+                    append((room_id, kind, feed.id, recv_ts, 0, '', '', feed.content, 0, count))
+            continue
+        has_time, has_content, has_gift, has_combo = _FIELDS[kind]
+        has_user = kind != 'combo_comment'
+        for feed in feeds:
+            user = feed.user if has_user else None
+            append((room_id, kind, feed.id, recv_ts,
+                    feed.time if has_time else 0,
+                    user.principalId if has_user else '',
+                    user.userName if has_user else '',
+                    feed.content if has_content else '',
+                    feed.giftId if has_gift else 0,
+                    feed.comboCount if has_combo else 0))
+    return rows
+
+
+class BatchSink:
+    """微批写出的基类：write 只把事件放进缓冲区，攒够 batch_size 条或者距上次写出超过 flush_interval 秒时
+    由后台线程一次性写出；缓冲区超过 max_pending 条时丢弃最新的事件并计数，不阻塞收包线程"""
+
+    def __init__(self, batch_size: int = 1000, flush_interval: float = 1.0, max_pending: int = 1000000):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending: List[tuple] = []
+        self._cond = threading.Condition()
+        # 写出锁：后台线程和 flush() 不会同时写
+        self._writeLock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        self._callbacks = {}
+        # 统计
+        self.rows = 0
+        self.batches = 0
+        self.dropped = 0
+        self.errors = 0
+
+    def start(self):
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.__class__.__name__, daemon=True)
+                self._thread.start()
+        return self
+
+    def write(self, rows: Sequence[tuple]):
+        if self._thread is None:
+            self.start()
+        with self._cond:
+            room = self.max_pending - len(self._pending)
+            if room < len(rows):
+                self.dropped += len(rows) - max(room, 0)
+                rows = rows[:max(room, 0)]
+            self._pending.extend(rows)
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify()
+
+    def writeFeedPush(self, push, room_id: str, recv_ts: Optional[int] = None):
+        self.write(flattenFeedPush(push, room_id, recv_ts))
+
+    # 订阅 Tool 的 SC_FEED_PUSH；在收包线程里只做拍平和入队，写文件在后台线程
+    def attach(self, tool):
+        def onFeedPush(view):
+            self.writeFeedPush(view, tool.liveRoomId or '')
+
+        self._callbacks[id(tool)] = onFeedPush
+        tool.dispatcher.subscribe(PayloadType.SC_FEED_PUSH, onFeedPush, inline=True)
+        return onFeedPush
+
+    def detach(self, tool):
+        callback = self._callbacks.pop(id(tool), None)
+        if callback is not None:
+            tool.dispatcher.unsubscribe(PayloadType.SC_FEED_PUSH, callback)
+
+    def _take(self) -> List[tuple]:
+        rows, self._pending = self._pending, []
+        return rows
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._closed and len(self._pending) < self.batch_size:
+                    self._cond.wait(self.flush_interval)
+                rows = self._take()
+                closed = self._closed
+            if rows:
+                self._flushRows(rows)
+            if closed:
+                return
+
+    def _flushRows(self, rows: List[tuple]):
+        with self._writeLock:
+            try:
+                self._writeBatch(rows)
+                self.rows += len(rows)
+                self.batches += 1
+            except Exception as e:
+                self.errors += 1
+                logging.error(f'[{self.__class__.__name__}] [批量写出失败, rows = {len(rows)}, err = {e}]')
+
+    # 立即写出缓冲区里的事件
+    def flush(self):
+        with self._cond:
+            rows = self._take()
+        if rows:
+            self._flushRows(rows)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+        with self._writeLock:
+            self._close()
+
+    def getStats(self) -> dict:
+        return {'rows': self.rows, 'batches': self.batches, 'pending': len(self._pending),
+                'dropped': self.dropped, 'errors': self.errors}
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # 子类实现：写出一批元组
+    def _writeBatch(self, rows: List[tuple]):
+        raise NotImplementedError
+
+    def _close(self):
+        pass
+
+
+class _RotatingFiles:
+    """按大小/时间轮换的输出文件名：<directory>/<prefix>-<时间>-<序号><suffix>"""
+
+    def __init__(self, directory: str, prefix: str, suffix: str, rotate_bytes: Optional[int],
+                 rotate_interval: Optional[float]):
+        self.directory = directory
+        self.prefix = prefix
+        self.suffix = suffix
+        self.rotate_bytes = rotate_bytes
+        self.rotate_interval = rotate_interval
+        self.path: Optional[str] = None
+        self.opened_at = 0.0
+        self.size = 0
+        self._seq = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def due(self) -> bool:
+        if self.path is None:
+            return True
+        if self.rotate_bytes is not None and self.size >= self.rotate_bytes:
+            return True
+        return self.rotate_interval is not None and time.time() - self.opened_at >= self.rotate_interval
+
+    def next(self) -> str:
+        self._seq += 1
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        self.path = os.path.join(self.directory, f'{self.prefix}-{stamp}-{self._seq:04d}{self.suffix}')
+        self.opened_at = time.time()
+        self.size = 0
+        return self.path
+
+
+class JsonlSink(BatchSink):
+    """按大小或时间轮换的 JSONL 文件，一行一个事件"""
+
+    def __init__(self, directory: str, prefix: str = 'feeds', rotate_bytes: Optional[int] = 256 * 1024 * 1024,
+                 rotate_interval: Optional[float] = 3600, **kwargs):
+        super().__init__(**kwargs)
+        self.files = _RotatingFiles(directory, prefix, '.jsonl', rotate_bytes, rotate_interval)
+        self._fh = None
+
+    def _writeBatch(self, rows: List[tuple]):
+        if self.files.due():
+            self._close()
+            self._fh = open(self.files.next(), 'w', encoding='utf-8')
+        dumps = json.dumps
+        data = ''.join([dumps(dict(zip(COLUMNS, row)), ensure_ascii=False) + '\n' for row in rows])
+        self._fh.write(data)
+        self._fh.flush()
+        self.files.size += len(data)
+
+    def _close(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+
+class ParquetSink(BatchSink):
+    """列式输出（需要 pyarrow）：每批写成一个 row group；format 为 'parquet' 或 'arrow'（Arrow IPC 文件）"""
+
+    def __init__(self, directory: str, prefix: str = 'feeds', format: str = 'parquet',
+                 rotate_bytes: Optional[int] = 512 * 1024 * 1024, rotate_interval: Optional[float] = 3600,
+                 compression: str = 'zstd', batch_size: int = 50000, flush_interval: float = 5.0, **kwargs):
+        try:
+            import pyarrow
+        except ImportError:
+            raise ImportError('ParquetSink 需要安装 pyarrow: pip install pyarrow')
+        if format not in ('parquet', 'arrow'):
+            raise ValueError(f'不支持的格式: {format}')
+        super().__init__(batch_size=batch_size, flush_interval=flush_interval, **kwargs)
+        self._pa = pyarrow
+        self.format = format
+        self.compression = compression
+        self.schema = pyarrow.schema([
+            ('room_id', pyarrow.string()), ('kind', pyarrow.string()), ('id', pyarrow.string()),
+            ('recv_ts', pyarrow.int64()), ('server_ts', pyarrow.int64()), ('user_id', pyarrow.string()),
+            ('user_name', pyarrow.string()), ('content', pyarrow.string()), ('gift_id', pyarrow.int64()),
+            ('combo_count', pyarrow.int64()),
+        ])
+        self.files = _RotatingFiles(directory, prefix, '.parquet' if format == 'parquet' else '.arrow',
+                                    rotate_bytes, rotate_interval)
+        self._writer = None
+
+    def _open(self, path: str):
+        if self.format == 'parquet':
+            import pyarrow.parquet as pq
+
+            return pq.ParquetWriter(path, self.schema, compression=self.compression)
+        import pyarrow.ipc
+
+        return pyarrow.ipc.new_file(path, self.schema)
+
+    def _writeBatch(self, rows: List[tuple]):
+        if self.files.due():
+            self._close()
+            self._writer = self._open(self.files.next())
+        # 行转列
+        columns = list(zip(*rows))
+        table = self._pa.Table.from_arrays([self._pa.array(col, type=field.type)
+                                            for col, field in zip(columns, self.schema)], schema=self.schema)
+        self._writer.write_table(table)
+        self.files.size += table.nbytes
+
+    def _close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+class SqliteSink(BatchSink):
+    """本地 SQLite：WAL 模式，每批一个事务 + executemany 预编译插入"""
+
+    def __init__(self, path: str, table: str = 'feed_events', **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.table = table
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            f'CREATE TABLE IF NOT EXISTS {table} (room_id TEXT, kind TEXT, id TEXT, recv_ts INTEGER, '
+            f'server_ts INTEGER, user_id TEXT, user_name TEXT, content TEXT, gift_id INTEGER, combo_count INTEGER)')
+        self._db.execute(f'CREATE INDEX IF NOT EXISTS {table}_room_ts ON {table} (room_id, recv_ts)')
+        self._insert = f'INSERT INTO {table} ({", ".join(COLUMNS)}) VALUES ({", ".join("?" * len(COLUMNS))})'
+
+    def _writeBatch(self, rows: List[tuple]):
+        db = self._db
+        db.execute('BEGIN')
+        try:
+            db.executemany(self._insert, rows)
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    def _close(self):
+        self._db.close()
@@ -0,0 +1,464 @@
+import argparse
+import asyncio
+import bisect
+import functools
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import time
+from multiprocessing.connection import Connection, wait
+from typing import Dict, Iterable, List, Optional, Set
+
+from .reconnect import Backoff
+from .sinks import COLUMNS, flattenFeedPush
+
+# 工作进程 -> 主进程的消息类型（消息第一个字节）
+MSG_EVENTS = ord('E')
+MSG_HEALTH = ord('H')
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """一致性哈希环：每个节点放 replicas 个虚拟节点；增删节点时只有相邻区间的 key 会换节点"""
+
+    def __init__(self, nodes: Iterable[int] = (), replicas: int = 128):
+        self.replicas = replicas
+        self._points: List[int] = []
+        self._nodes: List[int] = []
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node: int):
+        for i in range(self.replicas):
+            point = _hash(f'{node}#{i}')
+            idx = bisect.bisect(self._points, point)
+            self._points.insert(idx, point)
+            self._nodes.insert(idx, node)
+
+    def remove(self, node: int):
+        keep = [(p, n) for p, n in zip(self._points, self._nodes) if n != node]
+        self._points = [p for p, _ in keep]
+        self._nodes = [n for _, n in keep]
+
+    def node(self, key: str) -> Optional[int]:
+        if not self._points:
+            return None
+        idx = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._nodes[idx]
+
+    def __contains__(self, node: int) -> bool:
+        return node in self._nodes
+
+
+class _Worker:
+    """工作进程里运行的 RoomManager：收到的弹幕拍平成 JSON 行，攒成一批后通过管道整块发回主进程"""
+
+    def __init__(self, worker_id: int, conn: Connection, tool_kwargs: dict, batch_bytes: int,
+                 flush_interval: float, health_interval: float, retry_base: float = 5.0, retry_max: float = 300.0):
+        self.worker_id = worker_id
+        self.conn = conn
+        self.tool_kwargs = tool_kwargs
+        self.batch_bytes = batch_bytes
+        self.flush_interval = flush_interval
+        self.health_interval = health_interval
+        # 创建 Tool 失败后的重试间隔
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.batch = bytearray([MSG_EVENTS])
+        self.events = 0
+        self.frames = 0
+        self.manager = None
+        self.tools = {}
+        # 正在创建 Tool 的直播间；创建期间收到 remove 时从这里删掉，创建完成后不再加入
+        self.adding: Set[str] = set()
+        # 创建 Tool 失败、正在退避重试的直播间 -> 最近一次的错误，随健康状态上报
+        self.failed: Dict[str, str] = {}
+        self.stopped: Optional[asyncio.Event] = None
+
+    def _send(self, data):
+        try:
+            self.conn.send_bytes(data)
+        except (BrokenPipeError, OSError):
+            # 主进程已经退出
+            self.stopped.set()
+
+    def flush(self):
+        if len(self.batch) > 1:
+            self._send(self.batch)
+            self.batch = bytearray([MSG_EVENTS])
+
+    def onFeedPush(self, tool, view):
+        self.frames += 1
+        dumps = json.dumps
+        batch = self.batch
+        for row in flattenFeedPush(view, tool.liveUrl):
+            batch += dumps(dict(zip(COLUMNS, row)), ensure_ascii=False).encode('utf-8')
+            batch += b'\n'
+            self.events += 1
+        if len(batch) >= self.batch_bytes:
+            self.flush()
+
+    # 创建 Tool 失败（浏览器 / cookie 出错、地址无效）时按退避时间重试，直到成功或者被移除
+    async def addRoom(self, liveUrl: str):
+        from .KsLive import Tool
+
+        if liveUrl in self.adding:
+            return
+        kwargs = dict(self.tool_kwargs)
+        factory = functools.partial(Tool, liveUrl, kwargs.pop('chrome_bin_path', ''),
+                                    kwargs.pop('chrome_driver_path', ''), kwargs.pop('runtime_dir', './runtime'),
+                                    **kwargs)
+        backoff = Backoff(base=self.retry_base, max_delay=self.retry_max)
+        self.adding.add(liveUrl)
+        while True:
+            try:
+                # 没有 cookie 时 Tool 会用浏览器获取，放到线程里，不阻塞其他直播间的收包
+                tool = await asyncio.get_running_loop().run_in_executor(None, factory)
+                break
+            except Exception as e:
+                if liveUrl not in self.adding:
+                    return
+                self.failed[liveUrl] = f'{type(e).__name__}: {e}'
+                delay = backoff.next()
+                logging.error(f'[Worker] [创建直播间失败，{delay:.1f}秒后重试, liveUrl = {liveUrl}, err = {e}]')
+                await asyncio.sleep(delay)
+                if liveUrl not in self.adding:
+                    return
+        self.failed.pop(liveUrl, None)
+        if liveUrl not in self.adding:
+            return
+        self.adding.discard(liveUrl)
+        self.tools[liveUrl] = tool
+        await self.manager.addRoom(tool, lambda view, t=tool: self.onFeedPush(t, view), lazy=True)
+
+    async def removeRoom(self, liveUrl: str):
+        self.adding.discard(liveUrl)
+        self.failed.pop(liveUrl, None)
+        self.tools.pop(liveUrl, None)
+        await self.manager.removeRoom(liveUrl)
+
+    def onCommand(self):
+        try:
+            command, arg = self.conn.recv()
+        except (EOFError, OSError):
+            self.stopped.set()
+            return
+        if command == 'add':
+            asyncio.ensure_future(self.addRoom(arg))
+        elif command == 'remove':
+            asyncio.ensure_future(self.removeRoom(arg))
+        elif command == 'stop':
+            self.stopped.set()
+
+    def health(self) -> dict:
+        connected = sum(1 for room in self.manager.rooms.values() if room.ws is not None and not room.ws.closed)
+        return {'worker': self.worker_id, 'pid': os.getpid(), 'assigned': len(self.tools), 'connected': connected,
+                'pending': len(self.adding), 'failed': dict(self.failed), 'frames': self.frames,
+                'events': self.events, 'reconnects': sum(tool.reconnectCount for tool in self.tools.values())}
+
+    async def run(self):
+        from .rooms import RoomManager
+
+        loop = asyncio.get_running_loop()
+        self.stopped = asyncio.Event()
+        self.manager = RoomManager()
+        loop.add_reader(self.conn.fileno(), self.onCommand)
+        last_health = 0.0
+        try:
+            while not self.stopped.is_set():
+                try:
+                    await asyncio.wait_for(self.stopped.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self.flush()
+                now = time.monotonic()
+                if now - last_health >= self.health_interval:
+                    last_health = now
+                    self._send(bytes([MSG_HEALTH]) + json.dumps(self.health()).encode('utf-8'))
+        finally:
+            loop.remove_reader(self.conn.fileno())
+            await self.manager.close()
+            self.flush()
+
+
+def _workerMain(worker_id: int, conn: Connection, tool_kwargs: dict, batch_bytes: int, flush_interval: float,
+                health_interval: float, log_level: int):
+    # Ctrl-C 由主进程处理，再通知工作进程退出
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(level=log_level, format=f'%(asctime)s - worker{worker_id} - %(levelname)s - %(message)s')
+    worker = _Worker(worker_id, conn, tool_kwargs, batch_bytes, flush_interval, health_interval)
+    asyncio.run(worker.run())
+
+
+class WorkerHandle:
+    """主进程里的工作进程记录"""
+
+    def __init__(self, worker_id: int, process, conn: Connection):
+        self.worker_id = worker_id
+        self.process = process
+        self.conn = conn
+        self.rooms: Set[str] = set()
+        self.started = time.monotonic()
+        self.last_health = self.started
+        self.health: dict = {}
+
+
+class Supervisor:
+    """把直播间按一致性哈希分到 workers 个进程，每个进程一个 RoomManager，充分利用多核
+
+    - 工作进程定时上报健康状态，进程退出或超过 health_timeout 秒没有上报时视为失效，
+      它的直播间立即重新分配给其他进程，restart_delay 秒后拉起新进程，一致性哈希只把原来属于它的房间迁回去
+    - 工作进程把弹幕拍平成 JSON 行，攒够 batch_bytes 字节或 flush_interval 秒后整块写进管道；
+      主进程用 recv_bytes_into 读进复用的缓冲区，不解析直接写到 output，所有事件汇成一条输出流
+    """
+
+    def __init__(self, workers: int = 0, output=None, tool_kwargs: Optional[dict] = None,
+                 batch_bytes: int = 256 * 1024, flush_interval: float = 0.2, health_interval: float = 2.0,
+                 health_timeout: float = 10.0, restart_delay: float = 1.0, replicas: int = 128):
+        self.workers_count = workers or os.cpu_count() or 1
+        self.output = output if output is not None else sys.stdout.buffer
+        self.tool_kwargs = tool_kwargs or {}
+        self.batch_bytes = batch_bytes
+        self.flush_interval = flush_interval
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.restart_delay = restart_delay
+        self.ring = HashRing(replicas=replicas)
+        self.workers: Dict[int, WorkerHandle] = {}
+        self.rooms: Set[str] = set()
+        # worker_id -> 计划重启的时间
+        self._restarts: Dict[int, float] = {}
+        self._buffer = bytearray(batch_bytes * 4)
+        self._stopping = False
+        self._stopRequested = False
+        # 统计
+        self.bytes = 0
+        self.batches = 0
+        self.restarts = 0
+
+    def _spawn(self, worker_id: int):
+        parent, child = multiprocessing.Pipe(duplex=True)
+        process = multiprocessing.Process(
+            target=_workerMain, name=f'kuaishou-worker-{worker_id}',
+            args=(worker_id, child, self.tool_kwargs, self.batch_bytes, self.flush_interval, self.health_interval,
+                  logging.root.level), daemon=True)
+        process.start()
+        # 关掉父进程里的子进程端，子进程退出时父进程才能读到 EOF
+        child.close()
+        self.workers[worker_id] = WorkerHandle(worker_id, process, parent)
+        self.ring.add(worker_id)
+        logging.info(f'[Supervisor] [启动工作进程, worker = {worker_id}, pid = {process.pid}]')
+
+    def start(self):
+        for worker_id in range(self.workers_count):
+            self._spawn(worker_id)
+        self.rebalance()
+        return self
+
+    def addRoom(self, liveUrl: str):
+        self.rooms.add(liveUrl)
+        self.rebalance()
+
+    def removeRoom(self, liveUrl: str):
+        self.rooms.discard(liveUrl)
+        self.rebalance()
+
+    def _command(self, handle: WorkerHandle, command: str, arg=None):
+        try:
+            handle.conn.send((command, arg))
+        except (BrokenPipeError, OSError):
+            pass
+
+    # 按哈希环重新计算每个房间应该在哪个进程，只迁移归属变了的房间
+    def rebalance(self):
+        wanted: Dict[int, Set[str]] = {worker_id: set() for worker_id in self.workers}
+        for liveUrl in self.rooms:
+            worker_id = self.ring.node(liveUrl)
+            if worker_id is not None:
+                wanted[worker_id].add(liveUrl)
+        moved = 0
+        for worker_id, handle in self.workers.items():
+            for liveUrl in handle.rooms - wanted[worker_id]:
+                self._command(handle, 'remove', liveUrl)
+            for liveUrl in wanted[worker_id] - handle.rooms:
+                self._command(handle, 'add', liveUrl)
+                moved += 1
+            handle.rooms = wanted[worker_id]
+        if moved:
+            logging.info(f'[Supervisor] [分配直播间, rooms = {len(self.rooms)}, moved = {moved}, '
+                         f'workers = {len(self.workers)}]')
+
+    def _onDead(self, handle: WorkerHandle, reason: str):
+        logging.error(f'[Supervisor] [工作进程失效, worker = {handle.worker_id}, reason = {reason}, '
+                      f'rooms = {len(handle.rooms)}]')
+        if handle.process.is_alive():
+            handle.process.kill()
+        handle.process.join(1)
+        handle.conn.close()
+        del self.workers[handle.worker_id]
+        self.ring.remove(handle.worker_id)
+        self.rebalance()
+        if not self._stopping:
+            self._restarts[handle.worker_id] = time.monotonic() + self.restart_delay
+
+    def _receive(self, handle: WorkerHandle) -> bool:
+        try:
+            n = handle.conn.recv_bytes_into(self._buffer)
+            view = memoryview(self._buffer)[:n]
+        except multiprocessing.BufferTooShort as e:
+            # 超过缓冲区的大批次：扩大缓冲区，这一批直接用异常里带回的数据
+            data = e.args[0]
+            self._buffer = bytearray(len(data) * 2)
+            view = memoryview(data)
+        except (EOFError, OSError):
+            return False
+        if not view:
+            return True
+        tag = view[0]
+        if tag == MSG_EVENTS:
+            self.output.write(view[1:])
+            self.bytes += len(view) - 1
+            self.batches += 1
+        elif tag == MSG_HEALTH:
+            health = json.loads(bytes(view[1:]))
+            for liveUrl in set(health.get('failed', ())) - set(handle.health.get('failed', ())):
+                logging.warning(f'[Supervisor] [worker{handle.worker_id} 无法创建直播间，正在重试, '
+                                f'liveUrl = {liveUrl}, err = {health["failed"][liveUrl]}]')
+            handle.health = health
+            handle.last_health = time.monotonic()
+        view.release()
+        return True
+
+    def _checkHealth(self):
+        now = time.monotonic()
+        for handle in list(self.workers.values()):
+            if not handle.process.is_alive():
+                self._onDead(handle, f'exitcode = {handle.process.exitcode}')
+            elif now - handle.last_health > self.health_timeout:
+                self._onDead(handle, f'{now - handle.last_health:.0f}秒没有上报健康状态')
+        for worker_id, due in list(self._restarts.items()):
+            if due <= now:
+                del self._restarts[worker_id]
+                self.restarts += 1
+                self._spawn(worker_id)
+                self.rebalance()
+
+    def getStats(self) -> dict:
+        return {'rooms': len(self.rooms), 'workers': {h.worker_id: h.health for h in self.workers.values()},
+                'bytes': self.bytes, 'batches': self.batches, 'restarts': self.restarts}
+
+    # 让 run() 尽快返回（可以在信号处理函数里调用）
+    def requestStop(self):
+        self._stopRequested = True
+
+    @property
+    def stopRequested(self) -> bool:
+        return self._stopRequested
+
+    # 主循环：读管道、写输出、检查健康状态；运行 duration 秒后返回，None 时一直运行到 requestStop()
+    def run(self, duration: Optional[float] = None):
+        deadline = None if duration is None else time.monotonic() + duration
+        last_check = time.monotonic()
+        while not self._stopRequested:
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            handles = {handle.conn: handle for handle in self.workers.values()}
+            for conn in wait(list(handles), timeout=self.health_interval / 2):
+                handle = handles[conn]
+                if handle.worker_id in self.workers and not self._receive(handle):
+                    self._onDead(handle, '管道已关闭')
+            self.output.flush()
+            if time.monotonic() - last_check >= self.health_interval / 2:
+                last_check = time.monotonic()
+                self._checkHealth()
+
+    # 通知所有工作进程退出，读完管道里剩下的数据
+    def stop(self, timeout: float = 10.0):
+        self._stopping = True
+        for handle in self.workers.values():
+            self._command(handle, 'stop')
+        deadline = time.monotonic() + timeout
+        for handle in list(self.workers.values()):
+            while time.monotonic() < deadline:
+                if handle.conn.poll(0.1):
+                    if not self._receive(handle):
+                        break
+                elif not handle.process.is_alive():
+                    break
+            handle.process.join(max(0.0, deadline - time.monotonic()))
+            if handle.process.is_alive():
+                handle.process.kill()
+            handle.conn.close()
+        self.workers.clear()
+        self.output.flush()
+
+
+def _readUrls(args) -> List[str]:
+    urls = list(args.urls)
+    if args.urls_file:
+        with open(args.urls_file, 'r', encoding='utf-8') as fh:
+            urls.extend(line.strip() for line in fh if line.strip() and not line.startswith('#'))
+    return urls
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='多进程分片监听直播间，所有弹幕汇成一条 JSONL 输出流')
+    parser.add_argument('urls', nargs='*', help='直播间地址')
+    parser.add_argument('--urls-file', help='每行一个直播间地址')
+    parser.add_argument('--workers', type=int, default=0, help='工作进程数，默认等于 CPU 核数')
+    parser.add_argument('--output', default='-', help='输出文件，- 为标准输出')
+    parser.add_argument('--cookie', help='快手网页 cookie；不传时每个工作进程用浏览器获取')
+    parser.add_argument('--runtime-dir', default='./runtime')
+    parser.add_argument('--chrome-bin', default='')
+    parser.add_argument('--chrome-driver', default='')
+    parser.add_argument('--proxy-host')
+    parser.add_argument('--proxy-port')
+    parser.add_argument('--api-base', help='接口地址前缀，指向 MockLiveServer 时可离线测试')
+    parser.add_argument('--batch-bytes', type=int, default=256 * 1024)
+    parser.add_argument('--flush-interval', type=float, default=0.2)
+    parser.add_argument('--health-timeout', type=float, default=10.0)
+    parser.add_argument('--duration', type=float, help='运行多少秒后退出，默认一直运行')
+    parser.add_argument('--stats-interval', type=float, default=30.0)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', stream=sys.stderr)
+    tool_kwargs = {'chrome_bin_path': args.chrome_bin, 'chrome_driver_path': args.chrome_driver,
+                   'runtime_dir': args.runtime_dir, 'cookie': args.cookie, 'proxy_host': args.proxy_host,
+                   'proxy_port': args.proxy_port, 'api_base': args.api_base}
+    output = sys.stdout.buffer if args.output == '-' else open(args.output, 'ab')
+    supervisor = Supervisor(args.workers, output, tool_kwargs, batch_bytes=args.batch_bytes,
+                            flush_interval=args.flush_interval, health_timeout=args.health_timeout)
+    for liveUrl in _readUrls(args):
+        supervisor.rooms.add(liveUrl)
+
+    signal.signal(signal.SIGINT, lambda signum, frame: supervisor.requestStop())
+    signal.signal(signal.SIGTERM, lambda signum, frame: supervisor.requestStop())
+    supervisor.start()
+    start = time.monotonic()
+    try:
+        while not supervisor.stopRequested:
+            remaining = None if args.duration is None else args.duration - (time.monotonic() - start)
+            if remaining is not None and remaining <= 0:
+                break
+            supervisor.run(args.stats_interval if remaining is None else min(args.stats_interval, remaining))
+            stats = supervisor.getStats()
+            workers = stats['workers'].values()
+            logging.info(f'[Supervisor] [rooms = {stats["rooms"]}, '
+                         f'connected = {sum(w.get("connected", 0) for w in workers)}, '
+                         f'events = {sum(w.get("events", 0) for w in workers)}, bytes = {stats["bytes"]}, '
+                         f'restarts = {stats["restarts"]}]')
+    finally:
+        supervisor.stop()
+        if output is not sys.stdout.buffer:
+            output.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,348 @@
+import json
+from collections.abc import Mapping
+
+from google.protobuf import json_format
+
+from . import ks_pb2
+from .gifts import getGiftCatalogue
+
+# 进程内共享的礼物目录，GiftView 直接查内存里的索引
+_catalogue = getGiftCatalogue()
+
+
+# 反序列化视图：ks_pb2 生成的类挂在模块名 'ks_pb2' 下，不能直接 pickle，按消息名重新构造
+def _restoreView(viewClass, messageName: str, data: bytes):
+    message = getattr(ks_pb2, messageName)()
+    message.ParseFromString(data)
+    return viewClass(message)
+
+
+class MessageView(Mapping):
+    """protobuf 消息的惰性视图，只在真正需要时才转换成 dict/json"""
+
+    __slots__ = ('message', '_dict')
+
+    def __init__(self, message):
+        self.message = message
+        self._dict = None
+
+    def to_dict(self) -> dict:
+        if self._dict is None:
+            self._dict = json_format.MessageToDict(self.message, preserving_proto_field_name=True)
+        return self._dict
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), ensure_ascii=False)
+
+    # 兼容以前回调拿到 dict 的用法：data['commentFeeds']
+    def __getitem__(self, key):
+        return self.to_dict()[key]
+
+    def __iter__(self):
+        return iter(self.to_dict())
+
+    def __len__(self):
+        return len(self.to_dict())
+
+    # 其余字段直接读 protobuf 对象
+    def __getattr__(self, name):
+        if name == 'message' or name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.message, name)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.to_json()})'
+
+    def __reduce__(self):
+        return _restoreView, (self.__class__, self.message.DESCRIPTOR.name, self.message.SerializeToString())
+
+
+class FeedView:
+    """单条弹幕/礼物/点赞等 feed 的轻量视图"""
+
+    __slots__ = ('message',)
+    kind = ''
+
+    def __init__(self, message):
+        self.message = message
+
+    @property
+    def id(self) -> str:
+        return self.message.id
+
+    @property
+    def user_id(self) -> str:
+        return self.message.user.principalId
+
+    @property
+    def user_name(self) -> str:
+        return self.message.user.userName
+
+    def to_dict(self) -> dict:
+        return json_format.MessageToDict(self.message, preserving_proto_field_name=True)
+
+    def __getattr__(self, name):
+        if name == 'message' or name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.message, name)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({json.dumps(self.to_dict(), ensure_ascii=False)})'
+
+    def __reduce__(self):
+        return _restoreView, (self.__class__, self.message.DESCRIPTOR.name, self.message.SerializeToString())
+
+
+# 弹幕
+class CommentView(FeedView):
+    __slots__ = ()
+    kind = 'comment'
+
+    @property
+    def content(self) -> str:
+        return self.message.content
+
+
+# 礼物
+class GiftView(FeedView):
+    __slots__ = ()
+    kind = 'gift'
+
+    @property
+    def gift_id(self) -> int:
+        return self.message.giftId
+
+    @property
+    def time(self) -> int:
+        return self.message.time
+
+    # 礼物目录里的信息（GiftInfo），目录没有加载或者没有这个礼物时为 None
+    @property
+    def info(self):
+        return _catalogue.index.get(self.message.giftId)
+
+    @property
+    def gift_name(self) -> str:
+        info = _catalogue.index.get(self.message.giftId)
+        return info.name if info is not None else ''
+
+    @property
+    def unit_price(self) -> float:
+        info = _catalogue.index.get(self.message.giftId)
+        return info.price if info is not None else 0
+
+    # 礼物价值 = 单价 * 连击数量
+    @property
+    def value(self) -> float:
+        return self.unit_price * max(self.message.batchSize, 1)
+
+    def to_dict(self) -> dict:
+        return _enrichGift(super().to_dict())
+
+
+# 给礼物 dict 补上礼物目录里的名称、单价和图片
+def _enrichGift(data: dict) -> dict:
+    info = _catalogue.index.get(data.get('giftId', 0))
+    if info is not None:
+        data['giftName'] = info.name
+        data['unitPrice'] = info.price
+        data['giftImage'] = info.image
+    return data
+
+
+# 点赞
+class LikeView(FeedView):
+    __slots__ = ()
+    kind = 'like'
+
+
+# 分享直播间
+class ShareView(FeedView):
+    __slots__ = ()
+    kind = 'share'
+
+    @property
+    def time(self) -> int:
+        return self.message.time
+
+
+# 系统通知
+class SystemNoticeView(FeedView):
+    __slots__ = ()
+    kind = 'system_notice'
+
+    @property
+    def content(self) -> str:
+        return self.message.content
+
+    @property
+    def time(self) -> int:
+        return self.message.time
+
+
+# 连击弹幕（没有用户信息）
+class ComboCommentView(FeedView):
+    __slots__ = ()
+    kind = 'combo_comment'
+
+    @property
+    def user_id(self) -> str:
+        return ''
+
+    @property
+    def user_name(self) -> str:
+        return ''
+
+    @property
+    def content(self) -> str:
+        return self.message.content
+
+
+# feed 类型 -> (SCWebFeedPush 上的字段名, 视图类)
+FEED_KINDS = {
+    'comment': ('commentFeeds', CommentView),
+    'gift': ('giftFeeds', GiftView),
+    'like': ('likeFeeds', LikeView),
+    'share': ('shareFeeds', ShareView),
+    'system_notice': ('systemNoticeFeeds', SystemNoticeView),
+    'combo_comment': ('comboCommentFeed', ComboCommentView),
+}
+
+
+class FeedPushView(MessageView):
+    """SCWebFeedPush 的视图，按类型遍历各种 feed"""
+
+    __slots__ = ()
+
+    def to_dict(self) -> dict:
+        if self._dict is None:
+            data = super().to_dict()
+            if _catalogue.index:
+                for gift in data.get('giftFeeds', ()):
+                    _enrichGift(gift)
+        return self._dict
+
+    def _iter(self, kind: str):
+        field, view = FEED_KINDS[kind]
+        return (view(m) for m in getattr(self.message, field))
+
+    @property
+    def display_watching_count(self) -> str:
+        return self.message.displayWatchingCount
+
+    @property
+    def display_like_count(self) -> str:
+        return self.message.displayLikeCount
+
+    @property
+    def comments(self):
+        return self._iter('comment')
+
+    @property
+    def gifts(self):
+        return self._iter('gift')
+
+    @property
+    def likes(self):
+        return self._iter('like')
+
+    @property
+    def shares(self):
+        return self._iter('share')
+
+    @property
+    def system_notices(self):
+        return self._iter('system_notice')
+
+    @property
+    def combo_comments(self):
+        return self._iter('combo_comment')
+
+    # 按 FEED_KINDS 顺序遍历全部 feed；指定 kind 时只遍历这一类
+    def feeds(self, kind: str = None):
+        if kind is not None:
+            return self._iter(kind)
+        return (feed for kind in FEED_KINDS for feed in self._iter(kind))
+
+
+def _restoreCoalesced(data: bytes, counts: dict, start: float, end: float):
+    message = ks_pb2.SCWebFeedPush()
+    message.ParseFromString(data)
+    return CoalescedFeedPushView(message, counts, start, end)
+
+
+def _restoreFeed(viewClass, messageName: str, data: bytes, count: int):
+    view = _restoreView(viewClass, messageName, data)
+    view.count = count
+    return view
+
+
+# 合并后的点赞 / 连击弹幕：count 为合并掉的 feed 条数
+class CoalescedLikeView(LikeView):
+    __slots__ = ('count',)
+
+    def __init__(self, message, count: int = 1):
+        super().__init__(message)
+        self.count = count
+
+    def to_dict(self) -> dict:
+        return dict(super().to_dict(), count=self.count)
+
+    def __reduce__(self):
+        return _restoreFeed, (self.__class__, self.message.DESCRIPTOR.name, self.message.SerializeToString(),
+                              self.count)
+
+
+class CoalescedComboCommentView(ComboCommentView):
+    __slots__ = ('count',)
+
+    def __init__(self, message, count: int = 1):
+        super().__init__(message)
+        self.count = count
+
+    def to_dict(self) -> dict:
+        return dict(super().to_dict(), count=self.count)
+
+    def __reduce__(self):
+        return _restoreFeed, (self.__class__, self.message.DESCRIPTOR.name, self.message.SerializeToString(),
+                              self.count)
+
+
+# 合并字段 -> 带 count 的视图类
+COALESCED_VIEWS = {
+    'likeFeeds': CoalescedLikeView,
+    'comboCommentFeed': CoalescedComboCommentView,
+}
+
+
+class CoalescedFeedPushView(FeedPushView):
+    """FeedCoalescer 在一个窗口内合并出来的 SCWebFeedPush：每个用户一条点赞、每种内容一条连击弹幕
+
+    counts 为字段名 -> 和 repeated 字段一一对应的合并条数，start / end 为窗口起止时间。
+    """
+
+    __slots__ = ('counts', 'start', 'end')
+
+    def __init__(self, message, counts: dict, start: float = 0.0, end: float = 0.0):
+        super().__init__(message)
+        self.counts = counts
+        self.start = start
+        self.end = end
+
+    def to_dict(self) -> dict:
+        if self._dict is None:
+            data = super().to_dict()
+            for field, counts in self.counts.items():
+                for feed, count in zip(data.get(field, ()), counts):
+                    feed['count'] = count
+        return self._dict
+
+    def _iter(self, kind: str):
+        field, view = FEED_KINDS[kind]
+        coalesced = COALESCED_VIEWS.get(field)
+        if coalesced is None:
+            return (view(m) for m in getattr(self.message, field))
+        return (coalesced(m, count) for m, count in zip(getattr(self.message, field), self.counts.get(field, ())))
+
+    def __reduce__(self):
+        return _restoreCoalesced, (self.message.SerializeToString(), self.counts, self.start, self.end)
@@ -0,0 +1,7 @@
+import sys
+
+from kuaishou.supervisor import main
+
+if __name__ == '__main__':
+    # python supervisor.py --workers 32 --urls-file rooms.txt --cookie '你的快手网页cookie' --output feeds.jsonl
+    main(sys.argv[1:])
@@ -0,0 +1,62 @@
+import unittest
+
+from kuaishou.dedup import FeedDeduplicator
+from kuaishou.ks_pb2 import SCWebFeedPush
+
+
+def _push(*ids):
+    push = SCWebFeedPush()
+    for fid in ids:
+        push.commentFeeds.add(id=fid, content=fid)
+    return push
+
+
+def _ids(push):
+    return [feed.id for feed in push.commentFeeds]
+
+
+class FeedDeduplicatorTest(unittest.TestCase):
+
+    def test_duplicates_removed(self):
+        dedup = FeedDeduplicator(window=10)
+        self.assertEqual(dedup.filterFeedPush(_push('a', 'b'), now=0), 0)
+        push = _push('a', 'b', 'c')
+        self.assertEqual(dedup.filterFeedPush(push, now=1), 2)
+        self.assertEqual(_ids(push), ['c'])
+        self.assertEqual(dedup.getStats()['suppressed']['comment'], 2)
+
+    # 同一批里有重复时，时间戳记录的个数必须等于真正加入的身份个数
+    def test_stamps_count_new_keys(self):
+        dedup = FeedDeduplicator(window=10)
+        dedup.filterFeedPush(_push('a'), now=0)
+        dedup.filterFeedPush(_push('a', 'b', 'c', 'd'), now=1)
+        self.assertEqual([list(stamp) for stamp in dedup._stamps], [[0, 1], [1, 3]])
+        self.assertEqual(len(dedup._order), sum(count for _, count in dedup._stamps))
+
+    def test_window_expiry(self):
+        dedup = FeedDeduplicator(window=10)
+        dedup.filterFeedPush(_push('a'), now=0)
+        dedup.filterFeedPush(_push('a', 'b', 'c', 'd'), now=1)
+        # a 过期，b c d 仍在窗口内
+        dedup.filterFeedPush(_push('x'), now=10.5)
+        push = _push('a', 'b', 'c', 'd')
+        self.assertEqual(dedup.filterFeedPush(push, now=10.5), 3)
+        self.assertEqual(_ids(push), ['a'])
+        # 全部过期后都能再次通过
+        push = _push('b', 'c', 'd', 'x')
+        self.assertEqual(dedup.filterFeedPush(push, now=100), 0)
+        self.assertEqual(_ids(push), ['b', 'c', 'd', 'x'])
+        self.assertEqual(len(dedup._keys), len(dedup._order))
+
+    def test_max_keys(self):
+        dedup = FeedDeduplicator(window=10, max_keys=3)
+        dedup.filterFeedPush(_push('a', 'b'), now=0)
+        dedup.filterFeedPush(_push('a', 'c', 'd'), now=1)
+        self.assertEqual(len(dedup._order), 3)
+        self.assertEqual(sum(count for _, count in dedup._stamps), 3)
+        push = _push('a')
+        self.assertEqual(dedup.filterFeedPush(push, now=2), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()